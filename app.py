@@ -1,6 +1,5 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import pandas as pd
 import json
 import os
 import unicodedata
@@ -8,7 +7,30 @@ import logging
 from difflib import SequenceMatcher
 from word2number import w2n
 import jellyfish
+import numpy as np
 import re
+import functools
+import threading
+import time
+import hashlib
+import heapq
+import math
+import hmac
+import bisect
+import argparse
+import mmap
+import pickle
+import struct
+import sys
+import csv
+import io
+import itertools
+import multiprocessing
+import gc
+import resource
+import contextlib
+import fcntl
+from collections import OrderedDict, deque
 
 # Configure logging
 logging.basicConfig(
@@ -26,327 +48,655 @@ STOPWORDS = [
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Load data
-location_index = {"city": [], "province": []}
-
 def build_location_entries(values):
-    entries = []
+    """Index the distinct location values for detect_location_candidates().
+
+    ``values`` holds the normalized location of every record, by position.
+    Besides the entries (value and stopword-filtered tokens) the index maps
+    tokens to the entries containing them, groups entries by value length
+    for the whole-string fuzzy fallback, and maps each value to the
+    positions of its records.
+    """
+    index = {
+        "entries": [],           # {"value", "tokens"} per distinct location
+        "entry_ids": {},         # value -> entry id
+        "tokens": {},            # token -> entry ids
+        "values_by_length": {},  # len(value) -> entry ids
+        "positions": {},         # value -> record positions
+    }
+    entries = index["entries"]
     seen = set()
-    for val in values:
+    for position, val in enumerate(values):
         if not isinstance(val, str):
             continue
-        if not val or val in seen:
+        if not val:
+            continue
+        index["positions"].setdefault(val, []).append(position)
+        if val in seen:
             continue
         seen.add(val)
         tokens = set(w for w in val.split() if w not in STOPWORDS)
         if not tokens:
             tokens = set(val.split())
+        if not tokens:
+            continue
+        entry_id = len(entries)
         entries.append({"value": val, "tokens": tokens})
-    return entries
+        index["entry_ids"][val] = entry_id
+        for token in tokens:
+            index["tokens"].setdefault(token, []).append(entry_id)
+        index["values_by_length"].setdefault(len(val), []).append(entry_id)
+    return index
+
+
+def add_location(location_index, value, position):
+    """Record one center's location in a build_location_entries() index in place"""
+    if not isinstance(value, str) or not value:
+        return
+    positions = location_index["positions"].setdefault(value, [])
+    if positions:
+        _insert_sorted(positions, position)
+        return
+    positions.append(position)
+    # First center in this location: (re)list its entry for detection
+    entry_id = location_index["entry_ids"].get(value)
+    if entry_id is None:
+        tokens = set(w for w in value.split() if w not in STOPWORDS) or set(value.split())
+        if not tokens:
+            return
+        entry_id = len(location_index["entries"])
+        location_index["entries"].append({"value": value, "tokens": tokens})
+        location_index["entry_ids"][value] = entry_id
+    for token in location_index["entries"][entry_id]["tokens"]:
+        location_index["tokens"].setdefault(token, []).append(entry_id)
+    location_index["values_by_length"].setdefault(len(value), []).append(entry_id)
+
+
+def remove_location(location_index, value, position):
+    """Undo add_location(); a location without centers is no longer detected"""
+    positions = location_index["positions"].get(value)
+    if not positions or not _remove_sorted(positions, position) or positions:
+        return
+    entry_id = location_index["entry_ids"].get(value)
+    if entry_id is None:
+        return
+    for token in location_index["entries"][entry_id]["tokens"]:
+        location_index["tokens"][token].remove(entry_id)
+    location_index["values_by_length"][len(value)].remove(entry_id)
+
+
+def location_positions(location_index, values):
+    """Record positions whose location is one of ``values``"""
+    positions = set()
+    for value in values:
+        positions.update(location_index["positions"].get(value, ()))
+    return positions
+
+
+NUMBER_WORDS = frozenset({
+    'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine',
+    'ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 
+    'seventeen', 'eighteen', 'nineteen', 'twenty', 'thirty', 'forty', 'fifty',
+    'sixty', 'seventy', 'eighty', 'ninety', 'hundred', 'thousand', 'million', 'and'
+})
+
+# Common synonym/alias replacements to align user wording with dataset entries
+REPLACEMENTS = {
+    "saint": "sant",
+    "san": "sant",
+    "andrews": "andreu",
+    "andrew": "andreu",
+    "andrea": "andreu",
+    "andres": "andreu",
+    "sardinia": "sardenya",
+    "sardenia": "sardenya",
+    "della": "de la",
+    "dalla": "de la",
+    "dela": "de la",
+    "barca": "barca",
+    "barka": "barca",
+    "barqa": "barca",
+    "tenerife": "tenerife",
+    "tenerfaith": "tenerife"
+}
+# No replacement produces another key, so one alternation pass is equivalent
+# to applying the word-bounded substitutions one after another.
+REPLACEMENT_PATTERN = re.compile(
+    r"\b(?:" + "|".join(re.escape(old) for old in sorted(REPLACEMENTS, key=len, reverse=True)) + r")\b"
+)
+
+NORMALIZE_CACHE_SIZE = 65536
+
+
+class _NumberConversionError(Exception):
+    """w2n failed with something other than ValueError; the text is left as-is"""
+
+
+@functools.lru_cache(maxsize=4096)
+def _number_sequence_to_words(sequence):
+    """Convert a run of number words to digits; returns the replacement words"""
+    try:
+        return (str(w2n.word_to_num(sequence)),)
+    except ValueError:
+        # If conversion fails, keep the words as-is
+        return tuple(sequence.split(" "))
+    except Exception as exc:
+        raise _NumberConversionError() from exc
 
-df = pd.DataFrame()
 
 def normalize_text(text):
     if not isinstance(text, str):
         return ""
-    
+    return _normalize_cached(text)
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_cached(text):
     # Normalize unicode characters
     text = ''.join(c for c in unicodedata.normalize('NFD', text)
                   if unicodedata.category(c) != 'Mn').lower()
     
-    # Convert number words to digits (e.g., "two hundred" -> "200")
-    # Define number words to identify sequences
-    number_words = {
-        'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine',
-        'ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 
-        'seventeen', 'eighteen', 'nineteen', 'twenty', 'thirty', 'forty', 'fifty',
-        'sixty', 'seventy', 'eighty', 'ninety', 'hundred', 'thousand', 'million', 'and'
-    }
-    
+    # Convert number words to digits (e.g., "two hundred" -> "200"),
+    # collecting consecutive number words (including 'and' as connector)
     try:
         words = text.split()
         new_words = []
         i = 0
-        
         while i < len(words):
-            # Check if current word is a number word
-            if words[i] in number_words:
-                # Collect consecutive number words (including 'and' as connector)
-                number_sequence = []
+            if words[i] in NUMBER_WORDS:
                 j = i
-                while j < len(words) and words[j] in number_words:
-                    number_sequence.append(words[j])
+                while j < len(words) and words[j] in NUMBER_WORDS:
                     j += 1
-                
-                # Try to convert the sequence
-                try:
-                    num_str = " ".join(number_sequence)
-                    num = w2n.word_to_num(num_str)
-                    new_words.append(str(num))
-                    i = j
-                except ValueError:
-                    # If conversion fails, keep the words as-is
-                    new_words.extend(number_sequence)
-                    i = j
+                new_words.extend(_number_sequence_to_words(" ".join(words[i:j])))
+                i = j
             else:
                 # Not a number word, keep as-is
                 new_words.append(words[i])
                 i += 1
-        
         text = " ".join(new_words)
-    except Exception:
+    except _NumberConversionError:
         pass  # If conversion fails, keep original text
     
-    # Common synonym/alias replacements to align user wording with dataset entries
-    replacements = {
-        "saint": "sant",
-        "san": "sant",
-        "andrews": "andreu",
-        "andrew": "andreu",
-        "andrea": "andreu",
-        "andres": "andreu",
-        "sardinia": "sardenya",
-        "sardenia": "sardenya",
-        "della": "de la",
-        "dalla": "de la",
-        "dela": "de la",
-        "barca": "barca",
-        "barka": "barca",
-        "barqa": "barca",
-        "tenerife": "tenerife",
-        "tenerfaith": "tenerife"
-    }
-    for old, new in replacements.items():
-        text = re.sub(rf"\b{old}\b", new, text)
-        
-    return text
+    return REPLACEMENT_PATTERN.sub(lambda m: REPLACEMENTS[m.group(0)], text)
+
+def clean_token(text):
+    """Strip everything but ASCII letters and digits (used for code/ID keys)"""
+    return re.sub(r'[^a-z0-9]', '', text)
+
+
+def field_tokens(value):
+    """Stopword-filtered token set of a normalized field, falling back to all tokens"""
+    tokens = set(w for w in value.split() if w not in STOPWORDS)
+    if not tokens:
+        tokens = set(value.split())
+    return frozenset(tokens)
+
+
+token_metaphone = functools.lru_cache(maxsize=16384)(jellyfish.metaphone)
+
+
+def field_phonetics(tokens):
+    """Metaphone codes of the tokens long enough to be phonetically meaningful"""
+    return frozenset(token_metaphone(w) for w in tokens if len(w) > 2)
+
 
 def fuzzy_similarity(str1, str2):
     """Calculate similarity ratio between two strings (0.0 to 1.0)"""
     return SequenceMatcher(None, str1, str2).ratio()
 
 
-def detect_location_candidates(query_tokens, query_string, entries):
+def detect_location_candidates(query_tokens, query_string, location_index):
+    """Location values the query refers to, from an index built by build_location_entries().
+
+    A location is hinted when at least 40% of its tokens occur in the query
+    (this covers full and single-token matches), or else when the whole
+    query is within a 0.88 SequenceMatcher ratio of it.
+    """
     hints = set()
+    entries = location_index["entries"]
     if not entries or not query_tokens:
         return hints
-    for entry in entries:
-        tokens = entry['tokens']
-        if not tokens:
-            continue
-        overlap = len(tokens & query_tokens)
-        token_ratio = overlap / len(tokens) if tokens else 0
-        if overlap == len(tokens) or (len(tokens) > 1 and token_ratio >= 0.6) or (len(tokens) == 1 and overlap == 1):
-            hints.add(entry['value'])
-            continue
-        if overlap >= 1 and token_ratio >= 0.4:
+    overlaps = {}
+    for token in query_tokens:
+        for entry_id in location_index["tokens"].get(token, ()):
+            overlaps[entry_id] = overlaps.get(entry_id, 0) + 1
+    for entry_id, overlap in overlaps.items():
+        entry = entries[entry_id]
+        if overlap / len(entry['tokens']) >= 0.4:
             hints.add(entry['value'])
+
+    # Whole-string fallback: lengths and character counts bound the ratio, so
+    # the exact SequenceMatcher only runs on locations that could reach 0.88
+    query_length = len(query_string)
+    bound_matcher = SequenceMatcher(None, "", query_string)
+    comparisons = 0
+    for length, entry_ids in list(location_index["values_by_length"].items()):
+        if 2.0 * min(query_length, length) / (query_length + length) < 0.88:
             continue
-        if fuzzy_similarity(query_string, entry['value']) >= 0.88:
-            hints.add(entry['value'])
+        for entry_id in entry_ids:
+            value = entries[entry_id]['value']
+            if value in hints:
+                continue
+            bound_matcher.set_seq1(value)
+            if bound_matcher.quick_ratio() < 0.88:
+                continue
+            comparisons += 1
+            if fuzzy_similarity(query_string, value) >= 0.88:
+                hints.add(value)
+    metrics.current().count_comparisons("sequence_matcher", comparisons)
     return hints
 
 
-DATA_FILE = os.path.join(os.path.dirname(__file__), "centers.json")
+class CenterRecord:
+    """Read-only, precomputed view of a single center used by the matcher.
 
+    Everything chat() needs per row (normalized fields, stopword-filtered
+    token sets, metaphone codes and cleaned code/ID keys) is derived once at
+    load time. Raw center fields stay reachable with ``record['nombre']``.
+    """
 
-def load_data():
-    global df, location_index
-    try:
-        with open(DATA_FILE, 'r') as f:
-            data = json.load(f)
-        df_local = pd.DataFrame(data.get('centers', []))
-        if df_local.empty:
-            df = df_local
-            location_index["city"] = []
-            location_index["province"] = []
-            logger.warning("Centers dataset is empty.")
-            return
-        df_local['norm_nombre'] = df_local['nombre'].apply(lambda x: normalize_text(x))
-        df_local['norm_poblacion'] = df_local['poblacion'].apply(lambda x: normalize_text(x))
-        df_local['norm_provincia'] = df_local['provincia'].apply(lambda x: normalize_text(x))
-        if 'direccion' in df_local.columns:
-            df_local['norm_direccion'] = df_local['direccion'].apply(lambda x: normalize_text(x))
-        else:
-            df_local['norm_direccion'] = ""
-        df = df_local
-        location_index["city"] = build_location_entries(df['norm_poblacion'].dropna().unique())
-        location_index["province"] = build_location_entries(df['norm_provincia'].dropna().unique())
-        logger.info("Data loaded successfully. %d centers found.", len(df))
-    except Exception as e:
-        logger.error(f"Error loading data: {e}")
-        df = pd.DataFrame()
-        location_index["city"] = []
-        location_index["province"] = []
+    __slots__ = (
+        "position", "data",
+        "norm_nombre", "norm_poblacion", "norm_provincia", "norm_direccion",
+        "nombre_tokens", "poblacion_tokens", "provincia_tokens", "direccion_tokens",
+        "nombre_phonetics", "poblacion_phonetics", "provincia_phonetics", "direccion_phonetics",
+        "id_lower", "code_lower", "id_clean", "code_clean", "combined_text", "fields",
+    )
 
+    def __init__(self, position, data):
+        values = {"position": position, "data": data}
+        for field in ("nombre", "poblacion", "provincia", "direccion"):
+            norm = normalize_text(data.get(field))
+            tokens = field_tokens(norm)
+            values[f"norm_{field}"] = norm
+            values[f"{field}_tokens"] = tokens
+            values[f"{field}_phonetics"] = field_phonetics(tokens)
+        values["id_lower"] = str(data.get("id_centro")).lower()
+        values["code_lower"] = str(data.get("codigo")).lower()
+        values["id_clean"] = clean_token(values["id_lower"])
+        values["code_clean"] = clean_token(values["code_lower"])
+        values["fields"] = tuple(
+            (values[f"norm_{field}"], values[f"{field}_tokens"], values[f"{field}_phonetics"])
+            for field in ("nombre", "poblacion", "provincia", "direccion")
+        )
+        values["combined_text"] = " ".join([
+            values["norm_nombre"], values["norm_poblacion"],
+            values["norm_provincia"], values["norm_direccion"],
+        ])
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
 
-load_data()
+    def __setattr__(self, name, value):
+        raise AttributeError("CenterRecord is immutable")
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    user_message = request.json.get('message', '').lower()
-    
-    if df.empty:
-        return jsonify({"response": "Sorry, I couldn't get the data."})
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
 
-    # Normalize query
-    normalized_query = normalize_text(user_message)
-    
-    # Remove stopwords
-    raw_words = normalized_query.split()
-    raw_clean_tokens = [re.sub(r'[^a-z0-9]', '', w) for w in raw_words]
-    query_words = [w for w in raw_words if w not in STOPWORDS]
-    machine_keywords = {"machine", "machines", "lavadora", "lavadoras", "washer", "washers", "secadora", "secadoras", "dryer", "dryers", "equipment"}
-    machine_info_requested = any(kw in raw_words for kw in machine_keywords)
-    code_terms = {"code", "codigo", "codigo", "cod"}
-    id_terms = {"id", "identifier", "identificador", "identificacion", "identification"}
-    code_requested = any(token in code_terms for token in raw_clean_tokens if token)
-    id_requested = any(token in id_terms for token in raw_clean_tokens if token)
-    
-    if not query_words:
-        return jsonify({"response": "Please specify a center name, city, or province."})
-
-    # Pre-calculate normalized columns if not already done
-    if 'norm_nombre' not in df.columns and not df.empty:
-        df['norm_nombre'] = df['nombre'].apply(normalize_text)
-        df['norm_poblacion'] = df['poblacion'].apply(normalize_text)
-        df['norm_provincia'] = df['provincia'].apply(normalize_text)
-        if 'direccion' in df.columns:
-            df['norm_direccion'] = df['direccion'].apply(normalize_text)
-        else:
-            df['norm_direccion'] = ""
-        location_index["city"] = build_location_entries(df['norm_poblacion'].dropna().unique())
-        location_index["province"] = build_location_entries(df['norm_provincia'].dropna().unique())
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
 
-    # Fuzzy matching logic with hybrid scoring
-    matches = []  # Store all potential matches with their scores
-    query_string = " ".join(query_words)
-    query_tokens = set(query_words)
-    detected_city_hints = detect_location_candidates(query_tokens, normalized_query, location_index["city"]) if location_index["city"] else set()
-    detected_province_hints = detect_location_candidates(query_tokens, normalized_query, location_index["province"]) if location_index["province"] else set()
-    filter_by_city = len(detected_city_hints) > 0
-    filter_by_province = len(detected_province_hints) > 0
-    # Additional normalized versions of tokens for code/id detection
-    clean_token = lambda t: re.sub(r'[^a-z0-9]', '', t)
-    query_tokens_clean = {clean_token(t) for t in query_tokens if clean_token(t)}
-    normalized_query_compact = clean_token(normalized_query)
-    
-    # Pre-calculate phonetic codes for query tokens
-    query_phonetics = {qt: jellyfish.metaphone(qt) for qt in query_tokens if len(qt) > 2}
-    
-    for _, row in df.iterrows():
-        if filter_by_city and row['norm_poblacion'] not in detected_city_hints:
-            continue
-        if filter_by_province and row['norm_provincia'] not in detected_province_hints:
-            continue
-        row_id = str(row['id_centro']).lower()
-        row_code = str(row['codigo']).lower()
-        row_id_clean = clean_token(row_id)
-        row_code_clean = clean_token(row_code)
-        # 1. Direct Code/ID Match (Highest Priority)
-        # Check if any query token exactly matches id_centro or codigo (case-insensitive)
-        is_id_match = (row_id in query_tokens or row_id_clean in query_tokens_clean)
-        is_code_match = (row_code in query_tokens or row_code_clean in query_tokens_clean)
-        
-        # Apply strict matching based on user intent
-        if id_requested and is_id_match:
-            # User asked for ID and we found an ID match
-            matches.append({
-                "row": row,
-                "score": 1.0,
-                "reason": "Direct ID match",
-                "location_score": 1.0
-            })
-            continue
-        elif code_requested and is_code_match:
-            # User asked for Code and we found a Code match
-            matches.append({
-                "row": row,
-                "score": 1.0,
-                "reason": "Direct Code match",
-                "location_score": 1.0
-            })
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __repr__(self):
+        return f"CenterRecord({self.data.get('codigo')!r}, {self.data.get('nombre')!r})"
+
+
+def build_center_records(raw_centers):
+    """Build the immutable record snapshot from the raw centers list"""
+    return tuple(CenterRecord(position, dict(center)) for position, center in enumerate(raw_centers))
+
+
+SEARCH_FIELDS = ("nombre", "poblacion", "provincia", "direccion")
+TOKEN_FUZZY_THRESHOLD = 0.88
+
+
+class FuzzyTokenIndex:
+    """Vocabulary lookup of the tokens within the Jaro-Winkler threshold of a query token.
+
+    Jaro-Winkler is not a metric, so a BK-tree (or a trigram filter, which
+    misses transpositions) could drop true matches. Instead the vocabulary is
+    bucketed by length and first character: with m <= min(a, b) matched
+    characters and no transpositions, Jaro <= (min/a + min/b + 1) / 3, and the
+    Winkler prefix boost (at most 0.4 * (1 - jaro)) only applies when the
+    first characters agree. Buckets whose bound is below the threshold are
+    never compared, and results are memoized per query token.
+    """
+
+    def __init__(self, vocabulary, threshold=TOKEN_FUZZY_THRESHOLD, min_length=3, cache_size=4096):
+        self.threshold = threshold
+        self.min_length = min_length
+        self.by_length = {}  # length -> {first character -> [tokens]}
+        for token in vocabulary:
+            if len(token) < min_length:
+                continue
+            self.by_length.setdefault(len(token), {}).setdefault(token[0], []).append(token)
+        self.cache_size = cache_size
+        self.lookup = functools.lru_cache(maxsize=cache_size)(self._lookup)
+
+    def __getstate__(self):
+        # The memo is per process and holds a bound method, so it is not serialized
+        return {"threshold": self.threshold, "min_length": self.min_length,
+                "by_length": self.by_length, "cache_size": self.cache_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lookup = functools.lru_cache(maxsize=self.cache_size)(self._lookup)
+
+    def _lookup(self, token):
+        matches = set()
+        if len(token) < self.min_length:
+            return frozenset(matches)
+        query_length = len(token)
+        comparisons = 0
+        for length, buckets in list(self.by_length.items()):
+            shortest = min(query_length, length)
+            jaro_bound = (shortest / query_length + shortest / length + 1) / 3
+            boosted_bound = jaro_bound + 0.4 * (1.0 - jaro_bound)
+            if boosted_bound < self.threshold - 1e-9:
+                continue
+            if jaro_bound < self.threshold - 1e-9:
+                # Without a shared first character there is no Winkler boost
+                groups = (buckets.get(token[0], ()),)
+            else:
+                groups = list(buckets.values())
+            for group in groups:
+                comparisons += len(group)
+                for candidate in group:
+                    if jellyfish.jaro_winkler_similarity(token, candidate) >= self.threshold:
+                        matches.add(candidate)
+        metrics.current().count_comparisons("jaro_winkler", comparisons)
+        return frozenset(matches)
+
+    def add(self, token):
+        """Add a new vocabulary token.
+
+        Lookups are then served by a fresh memo: clearing the old one would
+        let a request that computed its result before the change store it
+        again afterwards.
+        """
+        if len(token) >= self.min_length:
+            self.by_length.setdefault(len(token), {}).setdefault(token[0], []).append(token)
+        self.lookup = functools.lru_cache(maxsize=self.cache_size)(self._lookup)
+
+    def match_all(self, tokens):
+        """Union of the vocabulary tokens close to any of ``tokens``"""
+        matches = set()
+        for token in tokens:
+            matches.update(self.lookup(token))
+        return matches
+
+
+def _post(postings, key, position):
+    postings.setdefault(key, []).append(position)
+
+
+def build_search_index(records):
+    """Build posting lists mapping tokens, phonetic codes, keys and field values to record positions.
+
+    Posting lists hold ascending record positions so candidate sets can be
+    walked in dataset order, which keeps tie-breaking identical to a full scan.
+    """
+    index = {
+        "tokens": {},         # stopword-filtered field token -> positions (overlap / token fuzzy)
+        "phonetics": {},      # metaphone code -> positions
+        "raw_tokens": {},     # every whitespace token of a normalized field -> positions (substring)
+        "values": {},         # whole normalized field value -> positions
+        "values_by_length": {},
+        "id": {}, "id_clean": {}, "code": {}, "code_clean": {},
+    }
+    for record in records:
+        position = record.position
+        for field in SEARCH_FIELDS:
+            for token in getattr(record, f"{field}_tokens"):
+                _post(index["tokens"], token, position)
+            for code in getattr(record, f"{field}_phonetics"):
+                _post(index["phonetics"], code, position)
+            value = getattr(record, f"norm_{field}")
+            for token in set(value.split()):
+                _post(index["raw_tokens"], token, position)
+            _post(index["values"], value, position)
+        _post(index["id"], record.id_lower, position)
+        _post(index["id_clean"], record.id_clean, position)
+        _post(index["code"], record.code_lower, position)
+        _post(index["code_clean"], record.code_clean, position)
+    for postings in list(index.values()):
+        for key, positions in postings.items():
+            postings[key] = sorted(set(positions))
+    for value in index["values"]:
+        index["values_by_length"].setdefault(len(value), []).append(value)
+    index["fuzzy_tokens"] = FuzzyTokenIndex(index["tokens"])
+    attach_token_candidates(index)
+    return index
+
+
+def _insert_sorted(positions, position):
+    index = bisect.bisect_left(positions, position)
+    if index == len(positions) or positions[index] != position:
+        positions.insert(index, position)
+
+
+def _remove_sorted(positions, position):
+    index = bisect.bisect_left(positions, position)
+    if index < len(positions) and positions[index] == position:
+        del positions[index]
+        return True
+    return False
+
+
+def _record_keys(record):
+    """(postings name, key) pairs build_search_index() posts a record under"""
+    for field in SEARCH_FIELDS:
+        for token in getattr(record, f"{field}_tokens"):
+            yield "tokens", token
+        for code in getattr(record, f"{field}_phonetics"):
+            yield "phonetics", code
+        value = getattr(record, f"norm_{field}")
+        for token in set(value.split()):
+            yield "raw_tokens", token
+        yield "values", value
+    yield "id", record.id_lower
+    yield "id_clean", record.id_clean
+    yield "code", record.code_lower
+    yield "code_clean", record.code_clean
+
+
+def add_to_search_index(index, record):
+    """Post one record into a built search index in place.
+
+    Keys are only ever added (an emptied posting list stays), so requests
+    reading the index concurrently never see a key disappear.
+    """
+    for name, key in _record_keys(record):
+        postings = index[name]
+        if key in postings:
+            _insert_sorted(postings[key], record.position)
             continue
-        elif not id_requested and not code_requested and (is_id_match or is_code_match):
-            # User didn't specify, so match either
-            matches.append({
-                "row": row,
-                "score": 1.0,
-                "reason": "Direct Code/ID match",
-                "location_score": 1.0
-            })
+        postings[key] = [record.position]
+        if name == "tokens":
+            index["fuzzy_tokens"].add(key)
+        elif name == "values":
+            index["values_by_length"].setdefault(len(key), []).append(key)
+    # A fresh memo, not cache_clear(): see FuzzyTokenIndex.add()
+    attach_token_candidates(index)
+
+
+def remove_from_search_index(index, record):
+    """Undo add_to_search_index() for a record"""
+    for name, key in _record_keys(record):
+        positions = index[name].get(key)
+        if positions:
+            _remove_sorted(positions, record.position)
+    attach_token_candidates(index)
+
+
+def attach_token_candidates(index):
+    """Give a search index its shared, memoized token_candidates() lookup"""
+    index["token_candidates"] = functools.lru_cache(maxsize=8192)(functools.partial(token_candidates, index))
+
+
+def lookup_direct_matches(index, query_tokens, query_tokens_clean):
+    """Return the positions whose id_centro / codigo equal a query token (raw or cleaned)"""
+    id_hits = set()
+    code_hits = set()
+    for token in query_tokens:
+        id_hits.update(index["id"].get(token, ()))
+        code_hits.update(index["code"].get(token, ()))
+    for token in query_tokens_clean:
+        id_hits.update(index["id_clean"].get(token, ()))
+        code_hits.update(index["code_clean"].get(token, ()))
+    return id_hits, code_hits
+
+
+def token_candidates(index, token):
+    """Positions a single query token can pull past the relevance guard in score_centers().
+
+    A row is scored if it shares a token, a metaphone code, a substring or a
+    close token spelling with the query; all of these are per-token signals,
+    resolved here against the vocabulary instead of the rows. The result
+    depends only on the token and the index, so build_search_index() wraps
+    this in an LRU cache that every query (and every batch) shares.
+    """
+    candidates = set(index["tokens"].get(token, ()))
+    if len(token) > 2:
+        candidates.update(index["phonetics"].get(token_metaphone(token), ()))
+        # Token-level Jaro-Winkler matches against the field vocabulary
+        for close_token in index["fuzzy_tokens"].lookup(token):
+            candidates.update(index["tokens"][close_token])
+    if len(token) > 3:
+        # Query token contained in a field (it has no spaces, so it sits inside one field token)
+        for field_token, positions in list(index["raw_tokens"].items()):
+            if token in field_token:
+                candidates.update(positions)
+        # Whole field value contained in the query token (includes empty fields)
+        values = index["values"]
+        candidates.update(values.get("", ()))
+        for start in range(len(token)):
+            for end in range(start + 1, len(token) + 1):
+                candidates.update(values.get(token[start:end], ()))
+    return frozenset(candidates)
+
+
+def generate_candidates(index, query_tokens, query_string, similarity_cache):
+    """Union the per-token candidates with the rows passing the full-field fuzzy override.
+
+    Exact full-field similarities computed on the way are stored in
+    ``similarity_cache`` (field value -> ratio) for reuse by the scorer.
+    Every field value whose ratio can reach the 0.7 override ends up there,
+    so a value missing from the cache is provably below it.
+    """
+    candidates = set()
+    cached_before = len(similarity_cache)
+    for token in query_tokens:
+        candidates.update(index["token_candidates"](token))
+
+    # Full-field fuzzy override. Lengths and character counts give upper bounds
+    # on SequenceMatcher.ratio(), so the exact ratio only runs on plausible values.
+    query_length = len(query_string)
+    bound_matcher = SequenceMatcher(None, "", query_string)
+    bound_checks = 0
+    for length, values in list(index["values_by_length"].items()):
+        if 2.0 * min(query_length, length) / (query_length + length) < 0.7:
             continue
-            
-        # Token overlap scoring - must have at least some overlap
-        # Remove stopwords from row data for better overlap calculation
-        row_nombre_tokens = set([w for w in row['norm_nombre'].split() if w not in STOPWORDS])
-        row_poblacion_tokens = set([w for w in row['norm_poblacion'].split() if w not in STOPWORDS])
-        row_provincia_tokens = set([w for w in row['norm_provincia'].split() if w not in STOPWORDS])
-        row_direccion_tokens = set([w for w in row.get('norm_direccion', '').split() if w not in STOPWORDS])
-        
-        # Fallback to original tokens if filtering removed everything
-        if not row_nombre_tokens: row_nombre_tokens = set(row['norm_nombre'].split())
-        if not row_poblacion_tokens: row_poblacion_tokens = set(row['norm_poblacion'].split())
-        if not row_provincia_tokens: row_provincia_tokens = set(row['norm_provincia'].split())
-        if not row_direccion_tokens and row.get('norm_direccion'):
-            row_direccion_tokens = set(row['norm_direccion'].split())
-        
-        # Check for any token overlap
-        nombre_overlap = len(query_tokens & row_nombre_tokens)
-        poblacion_overlap = len(query_tokens & row_poblacion_tokens)
-        provincia_overlap = len(query_tokens & row_provincia_tokens)
-        direccion_overlap = len(query_tokens & row_direccion_tokens)
+        bound_checks += len(values)
+        for value in values:
+            bound_matcher.set_seq1(value)
+            if bound_matcher.quick_ratio() < 0.7:
+                continue
+            similarity = similarity_cache.get(value)
+            if similarity is None:
+                similarity = similarity_cache[value] = fuzzy_similarity(query_string, value)
+            if similarity >= 0.7:
+                candidates.update(index["values"][value])
+    trace = metrics.current()
+    trace.count_comparisons("sequence_matcher_bound", bound_checks)
+    trace.count_comparisons("sequence_matcher", len(similarity_cache) - cached_before)
+    return candidates
+
+
+def extract_row_signals(record, query_tokens, long_query_tokens, query_phonetic_codes, query_fuzzy_tokens,
+                        query_string, similarity_cache):
+    """Per-field match signals of one candidate row.
+
+    Returns one (overlap, token_count, phonetic, token_fuzzy, substring,
+    fuzzy_full) tuple per entry of SEARCH_FIELDS; the scoring engines turn
+    these into the hybrid scores.
+
+    ``similarity_cache`` must already hold every field value that can reach
+    the 0.7 fuzzy override, as generate_candidates() leaves it. The scorers
+    only read a field's ratio when the field shows some relevance or the
+    override fires, so for other fields missing from the cache the exact
+    SequenceMatcher ratio is skipped and reported as 0.0 (it is below 0.7
+    and never used).
+    """
+    signals = []
+    deferred = []
+    fuzzy_override_match = False
+    for field, (norm, tokens, phonetics) in zip(SEARCH_FIELDS, record.fields):
+        overlap = len(query_tokens & tokens)
+        phonetic = not query_phonetic_codes.isdisjoint(phonetics)
         # Token-level fuzzy matches to catch close spellings (e.g., "sardinia" vs "sardenya")
-        def token_fuzzy_match(target_tokens):
-            for qt in query_tokens:
-                if len(qt) <= 2:
-                    continue
-                for tt in target_tokens:
-                    if len(tt) <= 2:
-                        continue
-                    if jellyfish.jaro_winkler_similarity(qt, tt) >= 0.88:
-                        return True
+        token_fuzzy = not query_fuzzy_tokens.isdisjoint(tokens)
+        # Substring matches (e.g., "sebastian" in "san sebastian")
+        substring = any(qt in norm or norm in qt for qt in long_query_tokens)
+        fuzzy_full = similarity_cache.get(norm)
+        if fuzzy_full is None:
+            if overlap or phonetic or substring or (token_fuzzy and field == "direccion"):
+                # Many rows share a field value, so ratios are memoized per request
+                fuzzy_full = similarity_cache[norm] = fuzzy_similarity(query_string, norm)
+            else:
+                deferred.append(len(signals))
+                fuzzy_full = 0.0
+        fuzzy_override_match = fuzzy_override_match or fuzzy_full >= 0.7
+        signals.append((overlap, len(tokens), phonetic, token_fuzzy, substring, fuzzy_full))
+    if fuzzy_override_match:
+        # The override makes every field's ratio count
+        for slot in deferred:
+            norm = record.fields[slot][0]
+            fuzzy_full = similarity_cache.get(norm)
+            if fuzzy_full is None:
+                fuzzy_full = similarity_cache[norm] = fuzzy_similarity(query_string, norm)
+            signals[slot] = signals[slot][:5] + (fuzzy_full,)
+    return signals
+
+
+class SimilarityBound:
+    """Cheap test that fuzzy_similarity(query, value) cannot reach ``threshold``.
+
+    ratio() is 2 * matches / (len(query) + len(value)); matches never exceed
+    the shorter length nor the common character count, which give the
+    length bound and quick_ratio() respectively.
+    """
+
+    def __init__(self, query, threshold):
+        self.threshold = threshold
+        self.query_length = len(query)
+        self._matcher = SequenceMatcher(None, "", query)
+
+    def below(self, value):
+        total = self.query_length + len(value)
+        if not total:
             return False
-        nombre_token_fuzzy = token_fuzzy_match(row_nombre_tokens)
-        poblacion_token_fuzzy = token_fuzzy_match(row_poblacion_tokens)
-        provincia_token_fuzzy = token_fuzzy_match(row_provincia_tokens)
-        direccion_token_fuzzy = token_fuzzy_match(row_direccion_tokens)
-        
-        # Phonetic matching
-        # Check if query phonetics match row phonetics
-        row_nombre_phonetics = {w: jellyfish.metaphone(w) for w in row_nombre_tokens if len(w) > 2}
-        row_poblacion_phonetics = {w: jellyfish.metaphone(w) for w in row_poblacion_tokens if len(w) > 2}
-        row_provincia_phonetics = {w: jellyfish.metaphone(w) for w in row_provincia_tokens if len(w) > 2}
-        row_direccion_phonetics = {w: jellyfish.metaphone(w) for w in row_direccion_tokens if len(w) > 2}
-        
-        nombre_phonetic_match = any(qp in row_nombre_phonetics.values() for qp in query_phonetics.values())
-        poblacion_phonetic_match = any(qp in row_poblacion_phonetics.values() for qp in query_phonetics.values())
-        provincia_phonetic_match = any(qp in row_provincia_phonetics.values() for qp in query_phonetics.values())
-        direccion_phonetic_match = any(qp in row_direccion_phonetics.values() for qp in query_phonetics.values())
-        
-        # Also check for substring matches (e.g., "sebastian" in "san sebastian")
-        nombre_substring_match = any(
-            qt in row['norm_nombre'] or row['norm_nombre'] in qt 
-            for qt in query_tokens if len(qt) > 3
-        )
-        poblacion_substring_match = any(
-            qt in row['norm_poblacion'] or row['norm_poblacion'] in qt 
-            for qt in query_tokens if len(qt) > 3
-        )
-        provincia_substring_match = any(
-            qt in row['norm_provincia'] or row['norm_provincia'] in qt 
-            for qt in query_tokens if len(qt) > 3
-        )
-        direccion_substring_match = any(
-            qt in row.get('norm_direccion', '') or row.get('norm_direccion', '') in qt 
-            for qt in query_tokens if len(qt) > 3
-        )
-        
-        # Pre-calculate fuzzy scores for guard and reuse later
-        nombre_fuzzy_full = fuzzy_similarity(query_string, row['norm_nombre'])
-        poblacion_fuzzy_full = fuzzy_similarity(query_string, row['norm_poblacion'])
-        provincia_fuzzy_full = fuzzy_similarity(query_string, row['norm_provincia'])
-        direccion_fuzzy_full = fuzzy_similarity(query_string, row.get('norm_direccion', ''))
+        if 2.0 * min(self.query_length, len(value)) / total < self.threshold:
+            return True
+        self._matcher.set_seq1(value)
+        return self._matcher.quick_ratio() < self.threshold
+
+
+def score_signals_python(row_signals):
+    """Reference hybrid scorer: one (final, location, nombre) tuple per row, None when the row is irrelevant"""
+    results = []
+    for signals in row_signals:
+        (
+            (nombre_overlap, nombre_count, nombre_phonetic_match, nombre_token_fuzzy, nombre_substring_match, nombre_fuzzy_full),
+            (poblacion_overlap, poblacion_count, poblacion_phonetic_match, poblacion_token_fuzzy, poblacion_substring_match, poblacion_fuzzy_full),
+            (provincia_overlap, provincia_count, provincia_phonetic_match, provincia_token_fuzzy, provincia_substring_match, provincia_fuzzy_full),
+            (direccion_overlap, direccion_count, direccion_phonetic_match, direccion_token_fuzzy, direccion_substring_match, direccion_fuzzy_full),
+        ) = signals
         fuzzy_override_match = max(nombre_fuzzy_full, poblacion_fuzzy_full, provincia_fuzzy_full, direccion_fuzzy_full) >= 0.7
         
         # Skip if there's no overlap, phonetic match, substring match, token fuzzy, or strong fuzzy match
@@ -355,6 +705,7 @@ def chat():
             not nombre_phonetic_match and not poblacion_phonetic_match and not provincia_phonetic_match and not direccion_phonetic_match and
             not nombre_substring_match and not poblacion_substring_match and not provincia_substring_match and not direccion_substring_match and
             not nombre_token_fuzzy and not poblacion_token_fuzzy and not provincia_token_fuzzy and not direccion_token_fuzzy):
+            results.append(None)
             continue
         
         # Calculate fuzzy similarity for fields with some overlap
@@ -365,10 +716,10 @@ def chat():
         direccion_fuzzy = direccion_fuzzy_full if (direccion_overlap > 0 or direccion_phonetic_match or direccion_substring_match or direccion_token_fuzzy or fuzzy_override_match) else 0
         
         # Normalized overlap scores - use Jaccard-like ratio but favor query coverage
-        nombre_overlap_score = (nombre_overlap / len(row_nombre_tokens)) if row_nombre_tokens else 0
-        poblacion_overlap_score = (poblacion_overlap / len(row_poblacion_tokens)) if row_poblacion_tokens else 0
-        provincia_overlap_score = (provincia_overlap / len(row_provincia_tokens)) if row_provincia_tokens else 0
-        direccion_overlap_score = (direccion_overlap / len(row_direccion_tokens)) if row_direccion_tokens else 0
+        nombre_overlap_score = (nombre_overlap / nombre_count) if nombre_count else 0
+        poblacion_overlap_score = (poblacion_overlap / poblacion_count) if poblacion_count else 0
+        provincia_overlap_score = (provincia_overlap / provincia_count) if provincia_count else 0
+        direccion_overlap_score = (direccion_overlap / direccion_count) if direccion_count else 0
         nombre_overlap_score = min(nombre_overlap_score, 1.0)
         poblacion_overlap_score = min(poblacion_overlap_score, 1.0)
         provincia_overlap_score = min(provincia_overlap_score, 1.0)
@@ -422,117 +773,2979 @@ def chat():
                 direccion_score * 0.7,
                 (poblacion_score + provincia_score + direccion_score) / 3 * 0.85
             )
-        
-        # Only collect matches with meaningful scores
-        minimum_score = 0.35 if (filter_by_city or filter_by_province) else 0.4
-        if final_score >= minimum_score:
-            matches.append({
-                'row': row,
-                'score': final_score,
-                'location_score': max(poblacion_score, provincia_score, direccion_score),
-                'nombre_score': nombre_score
-            })
-            continue
-        # fallback scoring using combined fields for partial combos
-        combined_fields = [
-            row['norm_nombre'],
-            row['norm_poblacion'],
-            row['norm_provincia'],
-            row.get('norm_direccion', '')
-        ]
-        combined_text = " ".join([cf for cf in combined_fields if isinstance(cf, str)])
-        combined_similarity = fuzzy_similarity(normalized_query, combined_text)
-        if combined_similarity >= 0.82:
-            matches.append({
-                'row': row,
-                'score': combined_similarity * 0.7,
-                'location_score': max(poblacion_score, provincia_score, direccion_score, combined_similarity),
-                'nombre_score': max(nombre_score, combined_similarity)
-            })
-    
-    # Sort matches by score in descending order
-    matches.sort(key=lambda x: x['score'], reverse=True)
-    
-    # Prioritize matches that strongly hit the requested location
-    location_threshold = 0.35 if (filter_by_city or filter_by_province) else 0.4
-    location_strong_matches = [m for m in matches if m['location_score'] >= location_threshold]
-    if location_strong_matches:
-        matches = location_strong_matches
-    elif filter_by_city or filter_by_province:
-        # fallback to best matches sorted even if location score slightly lower
-        matches = sorted(matches, key=lambda x: (x['location_score'], x['score']), reverse=True)
-    
-    if not matches:
-        response = "I couldn't find a center matching your description."
-    elif len(matches) == 1:
-        # Single match - return it directly
-        best_match = matches[0]['row']
-        response = f"I believe you're referring to **{best_match['nombre']}** in {best_match['poblacion']}.<br>"
-        detail_lines = []
-        if id_requested and not code_requested:
-            detail_lines.append(f"Center ID: {best_match['id_centro']}")
-        elif code_requested and not id_requested:
-            detail_lines.append(f"Center Code: {best_match['codigo']}")
-        else:
-            detail_lines.append(f"Center ID: {best_match['id_centro']}")
-            detail_lines.append(f"Center Code: {best_match['codigo']}")
-        detail_lines.append(f"Location: {best_match['direccion']}")
-        response += "<br>".join(detail_lines)
-        if machine_info_requested:
-            response += "<br>Machine details aren't available in the system yet. Please contact support if you need an exact count."
-    else:
-        # Multiple matches - check if top match is significantly better
-        top_score = matches[0]['score']
-        second_score = matches[1]['score']
-        
-        # If the top match is significantly better (>15% difference), return it
-        if top_score - second_score > 0.15:
-            best_match = matches[0]['row']
-            response = f"I believe you're referring to **{best_match['nombre']}** in {best_match['poblacion']}.<br>"
-            detail_lines = []
-            if id_requested and not code_requested:
-                detail_lines.append(f"Center ID: {best_match['id_centro']}")
-                detail_lines.append(f"Center Code: {best_match['codigo']}")
-            elif code_requested and not id_requested:
-                detail_lines.append(f"Center Code: {best_match['codigo']}")
-                detail_lines.append(f"Center ID: {best_match['id_centro']}")
-            else:
-                detail_lines.append(f"Center ID: {best_match['id_centro']}")
-                detail_lines.append(f"Center Code: {best_match['codigo']}")
-            detail_lines.append(f"Location: {best_match['direccion']}")
-            response += "<br>".join(detail_lines)
-            if machine_info_requested:
-                response += "<br>Machine details aren't available in the system yet. Please contact support if you need an exact count."
-        else:
-            # Multiple similar matches - ask for clarification
-            # Limit to top 10 results to avoid overwhelming the user
-            max_results = 10
-            response = f"I found {len(matches)} centers matching your query. "
-            if len(matches) > max_results:
-                response += f"Here are the top {max_results}. "
-            response += "Please specify which one you're referring to:<br><br>"
-            
-            for i, match in enumerate(matches[:max_results], 1):
-                row = match['row']
-                line = f"{i}. **{row['nombre']}** – {row['provincia']}"
-                
-                details = []
-                if id_requested and not code_requested:
-                    details.append(f"ID: {row['id_centro']}")
-                elif code_requested and not id_requested:
-                    details.append(f"Code: {row['codigo']}")
-                else:
-                    details.append(f"Code: {row['codigo']}")
-                    details.append(f"ID: {row['id_centro']}")
-                
-                line += f" ({', '.join(details)})<br>"
-                response += line
+        results.append((final_score, max(poblacion_score, provincia_score, direccion_score), nombre_score))
+    return results
 
-    return jsonify({"response": response})
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({"status": "healthy", "service": "lawash-tool"})
+def score_signals_numpy(row_signals):
+    """Vectorized hybrid scorer; the same arithmetic as score_signals_python, applied column-wise"""
+    if not row_signals:
+        return []
+    signals = np.array(row_signals, dtype=np.float64)  # rows x fields x signals
+    overlap = signals[:, :, 0]
+    count = signals[:, :, 1]
+    phonetic = signals[:, :, 2] > 0
+    token_fuzzy = signals[:, :, 3] > 0
+    substring = signals[:, :, 4] > 0
+    fuzzy_full = signals[:, :, 5]
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=3000)
+    fuzzy_override_match = fuzzy_full.max(axis=1) >= 0.7
+    relevant = fuzzy_override_match | (overlap > 0).any(axis=1) | phonetic.any(axis=1) | substring.any(axis=1) | token_fuzzy.any(axis=1)
+
+    # Fields only keep their full-string similarity when they show some relevance
+    fuzzy_gate = (overlap > 0) | phonetic | substring | fuzzy_override_match[:, None]
+    fuzzy_gate[:, 3] |= token_fuzzy[:, 3]
+    fuzzy = np.where(fuzzy_gate, fuzzy_full, 0.0)
+
+    overlap_score = np.minimum(np.where(count > 0, overlap / np.maximum(count, 1), 0.0), 1.0)
+    overlap_score = np.where(phonetic | token_fuzzy, np.maximum(overlap_score, 0.6), overlap_score)
+
+    nombre_score = (fuzzy[:, 0] * 0.3) + (overlap_score[:, 0] * 0.7)
+    poblacion_score = (fuzzy[:, 1] * 0.3) + (overlap_score[:, 1] * 0.7)
+    provincia_score = (fuzzy[:, 2] * 0.3) + (overlap_score[:, 2] * 0.7)
+    direccion_score = (fuzzy[:, 3] * 0.4) + (overlap_score[:, 3] * 0.6)
+
+    is_strong_address_match = ((nombre_score > 0.6) & (direccion_score > 0.6)) | ((overlap_score[:, 0] > 0.7) & (overlap_score[:, 3] > 0.7))
+    location_combo = ((poblacion_score > 0.35) & (provincia_score > 0.35)) | ((direccion_score > 0.35) & ((poblacion_score > 0.3) | (provincia_score > 0.3)))
+    strong_name = (nombre_score > 0.5) | (direccion_score > 0.5)
+    final_score = np.select(
+        [
+            location_combo & is_strong_address_match,
+            location_combo & strong_name,
+            location_combo,
+            is_strong_address_match,
+            strong_name,
+            (poblacion_score > 0.5) | (provincia_score > 0.5),
+        ],
+        [
+            (poblacion_score + provincia_score + direccion_score + nombre_score * 3) / 2.0,
+            (poblacion_score + provincia_score + direccion_score + nombre_score * 2) / 2.5,
+            (poblacion_score + provincia_score + direccion_score) * 1.1,
+            np.maximum(nombre_score, direccion_score) * 1.2,
+            np.maximum(nombre_score, direccion_score) * 0.95,
+            np.maximum(poblacion_score, provincia_score) * 0.8,
+        ],
+        default=np.maximum.reduce([
+            nombre_score * 0.7,
+            poblacion_score * 0.8,
+            provincia_score * 0.7,
+            direccion_score * 0.7,
+            (poblacion_score + provincia_score + direccion_score) / 3 * 0.85,
+        ]),
+    )
+    location_score = np.maximum(np.maximum(poblacion_score, provincia_score), direccion_score)
+
+    return [
+        (float(final_score[i]), float(location_score[i]), float(nombre_score[i])) if relevant[i] else None
+        for i in range(len(row_signals))
+    ]
+
+
+SCORING_ENGINES = {"python": score_signals_python, "numpy": score_signals_numpy}
+SCORING_ENGINE = os.environ.get("SCORING_ENGINE", "python")
+if SCORING_ENGINE not in SCORING_ENGINES:
+    raise ValueError(f"Unknown SCORING_ENGINE {SCORING_ENGINE!r}; expected one of {sorted(SCORING_ENGINES)}")
+
+
+class QueryCache:
+    """Thread-safe LRU cache with per-entry TTL, for resolved chat queries and chat sessions.
+
+    ``generation`` is bumped by clear(); a put() made for an older generation
+    is dropped so a request racing a data reload cannot repopulate the cache
+    with results computed from the previous dataset.
+    """
+
+    def __init__(self, max_size=1024, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, generation):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+query_cache = QueryCache(
+    max_size=int(os.environ.get("QUERY_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("QUERY_CACHE_TTL", "300")),
+)
+# Per-session state of /api/chat conversations waiting for the user to pick a center
+chat_sessions = QueryCache(
+    max_size=int(os.environ.get("CHAT_SESSION_SIZE", "10000")),
+    ttl=float(os.environ.get("CHAT_SESSION_TTL", "900")),
+)
+
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+# Directory where every worker process publishes its metrics so /metrics on any one reports them all
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ROW_COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Fixed-bucket histogram in the Prometheus sense (``le`` bounds are inclusive)"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for slot, count in enumerate(other.counts):
+            self.counts[slot] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def state(self):
+        return [list(self.counts), self.sum, self.count]
+
+    @classmethod
+    def from_state(cls, bounds, state):
+        histogram = cls(bounds)
+        histogram.counts, histogram.sum, histogram.count = state
+        return histogram
+
+
+class RequestTrace:
+    """Stage durations, row counts and comparison counts gathered while serving one request.
+
+    The hot path only touches this plain per-thread object; Metrics merges it
+    into the shared histograms once, when the request ends.
+    """
+
+    __slots__ = ("stages", "rows", "comparisons")
+
+    active = True
+
+    def __init__(self):
+        self.stages = {}       # stage -> seconds spent in it during this request
+        self.rows = {}         # kind -> Histogram of rows per matched query
+        self.comparisons = {}  # kind -> comparisons performed
+
+    def start(self):
+        return time.perf_counter()
+
+    def stage(self, name, started):
+        """Charge the time since ``started`` to stage ``name`` and return the current clock"""
+        now = time.perf_counter()
+        self.stages[name] = self.stages.get(name, 0.0) + now - started
+        return now
+
+    def count_rows(self, kind, rows):
+        histogram = self.rows.get(kind)
+        if histogram is None:
+            histogram = self.rows[kind] = Histogram(ROW_COUNT_BUCKETS)
+        histogram.observe(rows)
+
+    def count_comparisons(self, kind, amount):
+        if amount:
+            self.comparisons[kind] = self.comparisons.get(kind, 0) + amount
+
+
+class _NullTrace:
+    """Stand-in used outside traced requests and when metrics are disabled: records nothing"""
+
+    __slots__ = ()
+
+    active = False
+
+    def start(self):
+        return 0.0
+
+    def stage(self, name, started):
+        return 0.0
+
+    def count_rows(self, kind, rows):
+        pass
+
+    def count_comparisons(self, kind, amount):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Metrics:
+    """Request metrics rendered in the Prometheus text exposition format.
+
+    begin() installs a RequestTrace for the current thread and finish() folds
+    it into the shared histograms and counters under a lock. When disabled,
+    no trace is installed and every instrumentation point hits NULL_TRACE.
+
+    With a ``directory`` (METRICS_DIR) each process also publishes its totals
+    there, one file per process, from a daemon thread at most every
+    ``publish_interval`` seconds (off the request path), and render() adds
+    up every file, so any worker answers for all of them, up to that much
+    behind. Files of exited workers are kept, so counters do not drop when
+    a worker is replaced.
+    """
+
+    HISTOGRAMS = (("requests", LATENCY_BUCKETS), ("stages", LATENCY_BUCKETS), ("rows", ROW_COUNT_BUCKETS))
+
+    def __init__(self, enabled=True, directory=None, publish_interval=1.0):
+        self.enabled = enabled
+        self.directory = directory
+        self.publish_interval = publish_interval
+        self.requests = {}     # endpoint -> Histogram of request seconds
+        self.stages = {}       # stage -> Histogram of seconds per request
+        self.rows = {}         # kind -> Histogram of rows per query
+        self.comparisons = {}  # kind -> total comparisons
+        self.cache_stats = None  # this process's query cache counters as of its last request
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._published = None  # (pid, file) this process publishes to; a forked worker starts its own
+        self._publisher = None  # (pid, thread) publishing this process's totals
+        self._dirty = False
+
+    def current(self):
+        return getattr(self._local, "trace", NULL_TRACE)
+
+    def begin(self):
+        if self.enabled:
+            self._local.trace = RequestTrace()
+            self._local.started = time.perf_counter()
+
+    def finish(self, endpoint, cache_stats=None):
+        trace = getattr(self._local, "trace", None)
+        if trace is None:
+            return
+        elapsed = time.perf_counter() - self._local.started
+        del self._local.trace
+        with self._lock:
+            self._histogram(self.requests, endpoint, LATENCY_BUCKETS).observe(elapsed)
+            for stage, seconds in trace.stages.items():
+                self._histogram(self.stages, stage, LATENCY_BUCKETS).observe(seconds)
+            for kind, rows in trace.rows.items():
+                self._histogram(self.rows, kind, ROW_COUNT_BUCKETS).merge(rows)
+            for kind, amount in trace.comparisons.items():
+                self.comparisons[kind] = self.comparisons.get(kind, 0) + amount
+            if cache_stats is not None:
+                self.cache_stats = cache_stats
+            if self.directory:
+                self._dirty = True
+                self._start_publisher()
+
+    def _state(self):
+        state = {name: {label: histogram.state() for label, histogram in getattr(self, name).items()}
+                 for name, _ in self.HISTOGRAMS}
+        state.update(comparisons=dict(self.comparisons), cache=self.cache_stats)
+        return state
+
+    def _start_publisher(self):
+        # Under the lock; a forked worker inherits no running thread, only the reference
+        pid = os.getpid()
+        if self._publisher is None or self._publisher[0] != pid:
+            publisher = threading.Thread(target=self._publish_periodically, name="metrics-publish", daemon=True)
+            publisher.start()
+            self._publisher = (pid, publisher)
+
+    def _publish_periodically(self):
+        while True:
+            time.sleep(self.publish_interval)
+            self.publish()
+
+    def publish(self):
+        """Write this process's totals to ``directory`` if they changed since the last write"""
+        with self._lock:
+            if self.directory and self._dirty:
+                self._publish()
+                self._dirty = False
+
+    def _publish(self):
+        # Under the lock, so an older state never replaces a newer one; os.replace() keeps readers off torn files
+        pid = os.getpid()
+        try:
+            if self._published is None or self._published[0] != pid:
+                os.makedirs(self.directory, exist_ok=True)
+                self._published = (pid, os.path.join(self.directory, f"metrics-{pid}-{time.time_ns()}.json"))
+            path = self._published[1]
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(self._state(), f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning(f"Cannot publish metrics to {self.directory}: {e}")
+
+    def _combined(self, cache_stats):
+        """A Metrics holding this process's totals plus every other process's published ones"""
+        with self._lock:
+            states = [dict(self._state(), cache=cache_stats)]
+            own = self._published[1] if self._published and self._published[0] == os.getpid() else None
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError as e:
+            logger.warning(f"Cannot read metrics from {self.directory}: {e}")
+            names = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if path == own or not (name.startswith("metrics-") and name.endswith(".json")):
+                continue
+            try:
+                with open(path) as f:
+                    states.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        combined = Metrics()
+        for state in states:
+            for name, bounds in self.HISTOGRAMS:
+                for label, histogram in state[name].items():
+                    combined._histogram(getattr(combined, name), label, bounds).merge(
+                        Histogram.from_state(bounds, histogram))
+            for kind, amount in state["comparisons"].items():
+                combined.comparisons[kind] = combined.comparisons.get(kind, 0) + amount
+            if state["cache"] is not None:
+                if combined.cache_stats is None:
+                    combined.cache_stats = dict.fromkeys(("hits", "misses", "evictions", "size"), 0)
+                for key in combined.cache_stats:
+                    combined.cache_stats[key] += state["cache"][key]
+        return combined
+
+    @staticmethod
+    def _histogram(histograms, label, bounds):
+        histogram = histograms.get(label)
+        if histogram is None:
+            histogram = histograms[label] = Histogram(bounds)
+        return histogram
+
+    def render(self, cache_stats=None):
+        """Prometheus text exposition (format 0.0.4) of everything recorded so far, by every worker with a directory"""
+        if self.directory:
+            combined = self._combined(cache_stats)
+            return combined.render(combined.cache_stats)
+        lines = []
+        with self._lock:
+            self._render_histograms(lines, "lawash_request_duration_seconds",
+                                    "Request latency by endpoint.", "endpoint", self.requests)
+            self._render_histograms(lines, "lawash_stage_duration_seconds",
+                                    "Time spent in each matching stage per request.", "stage", self.stages)
+            self._render_histograms(lines, "lawash_query_rows",
+                                    "Rows per matched query: candidates, scanned, scored and kept.", "kind", self.rows)
+            lines.append("# HELP lawash_comparisons_total Fuzzy and phonetic comparisons performed.")
+            lines.append("# TYPE lawash_comparisons_total counter")
+            for kind in sorted(self.comparisons):
+                lines.append(f'lawash_comparisons_total{{kind="{kind}"}} {self.comparisons[kind]}')
+        if cache_stats is not None:
+            for name in ("hits", "misses", "evictions"):
+                lines.append(f"# HELP lawash_query_cache_{name}_total Query cache {name}.")
+                lines.append(f"# TYPE lawash_query_cache_{name}_total counter")
+                lines.append(f"lawash_query_cache_{name}_total {cache_stats[name]}")
+            lines.append("# HELP lawash_query_cache_entries Entries currently in the query cache.")
+            lines.append("# TYPE lawash_query_cache_entries gauge")
+            lines.append(f"lawash_query_cache_entries {cache_stats['size']}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histograms(lines, name, help_text, label, histograms):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for value in sorted(histograms):
+            histogram = histograms[value]
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{label}="{value}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.sum!r}')
+            lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
+
+
+metrics = Metrics(enabled=METRICS_ENABLED, directory=METRICS_DIR or None)
+
+
+EARTH_RADIUS_KM = 6371.0088
+GEO_LEAF_SIZE = 8
+
+
+def parse_coordinate(value, limit):
+    """Float coordinate from the dataset's string columns, or None when missing or out of range"""
+    try:
+        coordinate = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(coordinate) or abs(coordinate) > limit:
+        return None
+    return coordinate
+
+
+def _unit_vectors(latitudes, longitudes):
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def _chord_to_km(chord):
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2.0, 1.0))
+
+
+def _km_to_chord(km):
+    return 2.0 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2.0)
+
+
+class GeoIndex:
+    """KD-tree over the centers' coordinates for nearest and within-radius search.
+
+    Coordinates are mapped to 3-D unit vectors, where straight-line (chord)
+    distance is monotonic in great-circle distance, so an ordinary Euclidean
+    KD-tree answers haversine queries exactly without wrap-around cases.
+    Centers without usable coordinates (missing, out of range or 0,0) are
+    left out. Centers added after the build are scanned linearly next to the
+    tree and removed ones are skipped, until the next rebuild.
+    """
+
+    def __init__(self, records):
+        positions, latitudes, longitudes = [], [], []
+        for record in records:
+            coordinates = self.parse(record)
+            if coordinates is None:
+                continue
+            latitude, longitude = coordinates
+            positions.append(record.position)
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+        self.positions = np.array(positions, dtype=np.int64)
+        self.latitudes = np.array(latitudes, dtype=np.float64)
+        self.longitudes = np.array(longitudes, dtype=np.float64)
+        self.points = _unit_vectors(self.latitudes, self.longitudes) if positions else np.empty((0, 3))
+        self._slot = {position: slot for slot, position in enumerate(positions)}
+        self._root = self._build(np.arange(len(positions))) if positions else None
+        self._removed = set()  # tree slots of removed centers
+        self._extra = {}  # position -> (latitude, longitude, unit vector) of centers added since the build
+
+    @staticmethod
+    def parse(record):
+        latitude = parse_coordinate(record.get("latitud"), 90.0)
+        longitude = parse_coordinate(record.get("longitud"), 180.0)
+        if latitude is None or longitude is None or (latitude == 0.0 and longitude == 0.0):
+            return None
+        return latitude, longitude
+
+    def __len__(self):
+        return len(self.positions) - len(self._removed) + len(self._extra)
+
+    def add(self, record):
+        """Index a new or updated center without rebuilding the tree (discard() the old version first)"""
+        coordinates = self.parse(record)
+        if coordinates is not None:
+            point = _unit_vectors(np.array([coordinates[0]]), np.array([coordinates[1]]))[0]
+            self._extra[record.position] = (*coordinates, point)
+
+    def discard(self, position):
+        if self._extra.pop(position, None) is None:
+            slot = self._slot.pop(position, None)
+            if slot is not None:
+                self._removed.add(slot)
+
+    def _build(self, slots):
+        if len(slots) <= GEO_LEAF_SIZE:
+            return (None, 0.0, slots, None)
+        points = self.points[slots]
+        axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        order = slots[np.argsort(points[:, axis], kind="stable")]
+        middle = len(order) // 2
+        split = float(self.points[order[middle], axis])
+        return (axis, split, self._build(order[:middle]), self._build(order[middle:]))
+
+    def _search(self, node, target, radius, heap, k):
+        axis, split, left, right = node
+        if axis is None:
+            slots = left
+            distances = np.sqrt(((self.points[slots] - target) ** 2).sum(axis=1))
+            for slot, distance in zip(slots.tolist(), distances.tolist()):
+                if distance > radius or slot in self._removed:
+                    continue
+                if k is None or len(heap) < k:
+                    heapq.heappush(heap, (-distance, -slot))
+                elif (-distance, -slot) > heap[0]:
+                    heapq.heapreplace(heap, (-distance, -slot))
+            return
+        offset = target[axis] - split
+        near, far = (left, right) if offset < 0 else (right, left)
+        self._search(near, target, radius, heap, k)
+        bound = radius if k is None or len(heap) < k else min(radius, -heap[0][0])
+        if abs(offset) <= bound:
+            self._search(far, target, radius, heap, k)
+
+    def query(self, latitude, longitude, k=None, radius_km=None):
+        """(position, distance_km) pairs nearest first; ``k`` caps the count, ``radius_km`` the distance"""
+        if (self._root is None and not self._extra) or k == 0:
+            return []
+        target = _unit_vectors(np.array([latitude]), np.array([longitude]))[0]
+        radius = _km_to_chord(radius_km) if radius_km is not None else math.inf
+        heap = []
+        if self._root is not None:
+            self._search(self._root, target, radius, heap, k)
+        # Slots follow positions, so (distance, position) orders like (distance, slot)
+        found = sorted((-distance, int(self.positions[-slot])) for distance, slot in heap)
+        for position, (_, _, point) in list(self._extra.items()):
+            distance = float(np.sqrt(((point - target) ** 2).sum()))
+            if distance <= radius:
+                found.append((distance, position))
+        if self._extra:
+            found = sorted(found)[:k]
+        return [(position, float(_chord_to_km(distance))) for distance, position in found]
+
+    def coordinates(self, position):
+        """Parsed (lat, lon) of a center, or None without usable coordinates"""
+        extra = self._extra.get(position)
+        if extra is not None:
+            return extra[0], extra[1]
+        slot = self._slot.get(position)
+        if slot is None:
+            return None
+        return float(self.latitudes[slot]), float(self.longitudes[slot])
+
+    def distance_km(self, position, latitude, longitude):
+        """Great-circle distance from a center to a point, or None without coordinates"""
+        extra = self._extra.get(position)
+        slot = self._slot.get(position)
+        if extra is None and slot is None:
+            return None
+        point = extra[2] if extra is not None else self.points[slot]
+        target = _unit_vectors(np.array([latitude]), np.array([longitude]))[0]
+        return float(_chord_to_km(np.sqrt(((point - target) ** 2).sum())))
+
+
+def rerank_by_distance(ranked, snapshot, latitude, longitude, limit, band=0.15):
+    """Best ``limit`` matches with those about as good as the best one ordered by distance.
+
+    Matches scoring within ``band`` of the best score come first, nearest
+    first (centers without coordinates last); the rest keep their rank.
+    Returns new match dicts carrying ``distance_km``.
+    """
+    pool = ranked.pool
+    if not pool or limit <= 0:
+        return []
+    geo_index = snapshot.geo_index
+
+    def located(match):
+        located_match = dict(match)
+        located_match['distance_km'] = geo_index.distance_km(match['row'].position, latitude, longitude)
+        return located_match
+
+    top_score = max(m['score'] for m in pool)
+    contenders = [located(m) for m in pool if top_score - m['score'] <= band]
+    contenders.sort(key=lambda m: (m['distance_km'] is None, m['distance_km'] or 0.0, ranked.sort_key(m)))
+    remaining = limit - len(contenders)
+    others = []
+    if remaining > 0:
+        others = heapq.nsmallest(remaining, (m for m in pool if top_score - m['score'] > band), key=ranked.sort_key)
+    return (contenders + [located(m) for m in others])[:limit]
+
+
+SUGGEST_KINDS = ("code", "name", "street", "city")
+SUGGEST_MAX_LIMIT = 20
+# Prefixes up to this length match long runs of keys, so their top lists are precomputed
+SUGGEST_PRECOMPUTED_PREFIX = 2
+
+
+def suggest_terms(text):
+    """Lowercase ASCII letter / digit words of a normalized text, the vocabulary of SuggestIndex keys"""
+    return re.findall(r"[a-z0-9]+", text)
+
+
+class SuggestIndex:
+    """Typeahead completions for center codes, names, streets and cities.
+
+    Every word start of every suggestion's text is a key in one sorted list,
+    so the completions of a prefix are the contiguous run of keys found by
+    bisection. Completions rank by how they match (exact before one edit,
+    start of the text before a later word), then by weight (the number of
+    centers for a city), then shorter texts first. Runs for one- and
+    two-character prefixes are long, so their top lists are kept per kind;
+    add() and discard() drop the top lists they affect, which are then
+    recomputed on their next use.
+    """
+
+    def __init__(self, records):
+        self.entries = []  # (kind, display text, key text, weight, record position or None); None once removed
+        self.by_position = {}  # record position -> its code / name / street entry ids
+        self.cities = {}  # city key text -> entry id
+        cities = {}
+        for record in records:
+            self.by_position[record.position] = [self._append(entry) for entry in self._center_entries(record)]
+            city = " ".join(suggest_terms(record.norm_poblacion))
+            if city:
+                cities.setdefault(city, [str(record['poblacion']).strip(), 0])[1] += 1
+        for key_text, (display, count) in sorted(cities.items()):
+            self.cities[key_text] = self._append(("city", display, key_text, count, None))
+
+        self.keys = sorted(key for entry_id in range(len(self.entries)) for key in self._keys(entry_id))
+        self.precomputed = {}
+        runs = {}
+        for key, entry_id, at_start in self.keys:
+            rank = self.rank(entry_id, at_start, False)
+            for length in range(1, min(len(key), SUGGEST_PRECOMPUTED_PREFIX) + 1):
+                best = runs.setdefault(key[:length], {})
+                current = best.get(entry_id)
+                if current is None or rank < current:
+                    best[entry_id] = rank
+        for prefix, best in runs.items():
+            tops = {kind: [] for kind in (None, *SUGGEST_KINDS)}
+            for rank, entry_id in sorted((rank, entry_id) for entry_id, rank in best.items()):
+                for kind in (None, self.entries[entry_id][0]):
+                    if len(tops[kind]) < SUGGEST_MAX_LIMIT:
+                        tops[kind].append((rank, entry_id))
+            for kind, top in tops.items():
+                self.precomputed[prefix, kind] = top
+        # Character trie of the words, walked for one-edit prefixes of the last typed word
+        self.trie = {}
+        for entry_id in range(len(self.entries)):
+            self._add_words(entry_id)
+
+    @staticmethod
+    def _center_entries(record):
+        entries = [("code", str(record['codigo']), record.code_clean, 1, record.position)]
+        for kind, field in (("name", "nombre"), ("street", "direccion")):
+            key_text = " ".join(suggest_terms(getattr(record, f"norm_{field}")))
+            if key_text:
+                entries.append((kind, str(record[field]).strip(), key_text, 1, record.position))
+        return entries
+
+    def _append(self, entry):
+        self.entries.append(entry)
+        return len(self.entries) - 1
+
+    def _keys(self, entry_id):
+        """(key, entry id, at start of the text) for every word start of an entry's text"""
+        key_text = self.entries[entry_id][2]
+        offset = 0
+        for word in key_text.split(" "):
+            yield key_text[offset:], entry_id, offset == 0
+            offset += len(word) + 1
+
+    def _add_words(self, entry_id):
+        for word in self.entries[entry_id][2].split(" "):
+            node = self.trie
+            for c in word:
+                node = node.setdefault(c, {})
+
+    def _forget_top_lists(self, entry_id):
+        kind = self.entries[entry_id][0]
+        for key, _, _ in self._keys(entry_id):
+            for length in range(1, min(len(key), SUGGEST_PRECOMPUTED_PREFIX) + 1):
+                self.precomputed.pop((key[:length], None), None)
+                self.precomputed.pop((key[:length], kind), None)
+
+    def _insert(self, entry):
+        entry_id = self._append(entry)
+        for key in self._keys(entry_id):
+            bisect.insort(self.keys, key)
+        self._add_words(entry_id)
+        self._forget_top_lists(entry_id)
+        return entry_id
+
+    def _delete(self, entry_id):
+        self._forget_top_lists(entry_id)
+        for key in self._keys(entry_id):
+            index = bisect.bisect_left(self.keys, key)
+            if index < len(self.keys) and self.keys[index] == key:
+                del self.keys[index]
+        self.entries[entry_id] = None
+
+    def _reweigh_city(self, key_text, display, change):
+        entry_id = self.cities.get(key_text)
+        if entry_id is None:
+            if change > 0:
+                self.cities[key_text] = self._insert(("city", display, key_text, change, None))
+            return
+        kind, display, _, weight, _ = self.entries[entry_id]
+        if weight + change <= 0:
+            self._delete(entry_id)
+            del self.cities[key_text]
+            return
+        self.entries[entry_id] = (kind, display, key_text, weight + change, None)
+        self._forget_top_lists(entry_id)
+
+    def add(self, record):
+        """Add the suggestions of a new or updated center (discard() the old version first)"""
+        self.by_position[record.position] = [self._insert(entry) for entry in self._center_entries(record)]
+        city = " ".join(suggest_terms(record.norm_poblacion))
+        if city:
+            self._reweigh_city(city, str(record['poblacion']).strip(), 1)
+
+    def discard(self, record):
+        for entry_id in self.by_position.pop(record.position, ()):
+            self._delete(entry_id)
+        city = " ".join(suggest_terms(record.norm_poblacion))
+        if city:
+            self._reweigh_city(city, None, -1)
+
+    def rank(self, entry_id, at_start, edited):
+        _, _, key_text, weight, _ = self.entries[entry_id]
+        return (edited, not at_start, -weight, len(key_text), key_text, entry_id)
+
+    def _collect(self, prefix, edited, kind, best):
+        keys = self.keys
+        index = bisect.bisect_left(keys, (prefix,))
+        while index < len(keys) and keys[index][0].startswith(prefix):
+            _, entry_id, at_start = keys[index]
+            index += 1
+            entry = self.entries[entry_id]
+            if entry is None or (kind is not None and entry[0] != kind):
+                continue
+            rank = self.rank(entry_id, at_start, edited)
+            current = best.get(entry_id)
+            if current is None or rank < current:
+                best[entry_id] = rank
+
+    def _one_edit_prefixes(self, word):
+        """Prefixes of vocabulary words one deletion, substitution, insertion or transposition away from ``word``"""
+        variants = set()
+
+        def walk(node, i, path, edited):
+            if i == len(word):
+                if edited and path:
+                    variants.add(path)
+                return
+            c = word[i]
+            if c in node:
+                walk(node[c], i + 1, path + c, edited)
+            if edited:
+                return
+            walk(node, i + 1, path, True)
+            for other, child in list(node.items()):
+                if other != c:
+                    walk(child, i + 1, path + other, True)
+                walk(child, i, path + other, True)
+            if i + 1 < len(word) and word[i + 1] in node and c in node[word[i + 1]]:
+                walk(node[word[i + 1]][c], i + 2, path + word[i + 1] + c, True)
+
+        walk(self.trie, 0, "", False)
+        variants.discard(word)
+        return variants
+
+    def complete(self, prefix, limit=8, kind=None, fuzzy=False):
+        """Best ``limit`` (entry, matched with an edit) completions of a suggest_prefix() prefix.
+
+        With ``fuzzy``, a last word of three or more characters may also be
+        one edit away from the start of a word of the completion.
+        """
+        if not prefix.strip():
+            return []
+        head, _, last = prefix.rpartition(" ")
+        if len(prefix) <= SUGGEST_PRECOMPUTED_PREFIX and not (fuzzy and len(last) >= 3):
+            top = self.precomputed.get((prefix, kind))
+            if top is None:
+                best = {}
+                self._collect(prefix, False, kind, best)
+                top = self.precomputed[prefix, kind] = heapq.nsmallest(
+                    SUGGEST_MAX_LIMIT, ((rank, entry_id) for entry_id, rank in best.items()))
+            ranked = top[:limit]
+        else:
+            best = {}
+            self._collect(prefix, False, kind, best)
+            if fuzzy and len(last) >= 3:
+                for variant in self._one_edit_prefixes(last):
+                    self._collect(f"{head} {variant}" if head else variant, True, kind, best)
+            ranked = heapq.nsmallest(limit, ((rank, entry_id) for entry_id, rank in best.items()))
+        completions = []
+        for rank, entry_id in ranked:
+            entry = self.entries[entry_id]
+            if entry is not None:
+                completions.append((entry, rank[0]))
+        return completions
+
+
+def suggest_prefix(text):
+    """Normalized prefix of partially typed text for SuggestIndex.complete().
+
+    Everything before the word being typed goes through normalize_text();
+    that word only has its accents stripped, since replacements and number
+    words apply to whole words. A trailing space keeps the last word whole.
+    """
+    head, _, last = text.lower().rpartition(" ") if not text[-1:].isspace() else (text.lower(), "", "")
+    folded = "".join(c for c in unicodedata.normalize("NFD", last) if unicodedata.category(c) != "Mn")
+    terms = suggest_terms(normalize_text(head)) + suggest_terms(folded)
+    prefix = " ".join(terms)
+    return prefix + " " if prefix and text[-1:].isspace() else prefix
+
+
+SEARCH_SHARDS = int(os.environ.get("SEARCH_SHARDS", "1"))
+SEARCH_WORKERS = int(os.environ.get("SEARCH_WORKERS", "0"))
+SHARD_TOP_K = int(os.environ.get("SHARD_TOP_K", "100"))
+
+
+FACET_FIELDS = ("fabricante_central_pago", "modelo_central_pago", "fabricante_secadoras", "fabricante_lavadoras",
+                "provincia", "poblacion")
+
+
+def facet_key(value):
+    """Normalized form under which FacetIndex files a field value; "" for a missing value"""
+    if value is None:
+        return ""
+    return normalize_text(str(value)).strip()
+
+
+class FacetIndex:
+    """Bitmaps of the centers holding each value of the FACET_FIELDS.
+
+    A bitmap is a Python int with bit ``position`` set for every center with
+    that value. Filters are unions (values of one field) and intersections
+    (across fields) of ints, and a facet count is the popcount of a value's
+    bitmap and-ed with a result bitmap, so no center is visited. Bitmaps are
+    immutable: add() and discard() publish a new int for each value they touch.
+    """
+
+    def __init__(self, records):
+        self.values = {}  # field -> facet_key -> (display value, bitmap)
+        for field in FACET_FIELDS:
+            members = {}
+            for record in records:
+                value = record.get(field)
+                key = facet_key(value)
+                if key:
+                    members.setdefault(key, (value, []))[1].append(record.position)
+            self.values[field] = {key: (display, self.bitmap(positions))
+                                  for key, (display, positions) in members.items()}
+
+    @staticmethod
+    def bitmap(positions):
+        """Bitmap with the bits of ``positions`` set"""
+        positions = list(positions)
+        if not positions:
+            return 0
+        bits = bytearray(max(positions) // 8 + 1)
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(bits, "little")
+
+    @staticmethod
+    def positions(bitmap):
+        """Positions of the set bits of ``bitmap``, ascending"""
+        digits = bin(bitmap)[:1:-1]  # bit 0 first
+        positions = []
+        position = digits.find("1")
+        while position >= 0:
+            positions.append(position)
+            position = digits.find("1", position + 1)
+        return positions
+
+    def match(self, field, text):
+        """Bitmap of the centers whose ``field`` value is ``text`` or contains all its words ("girbau" -> "GIRBAU, S.A.")"""
+        key = facet_key(text)
+        words = set(suggest_terms(key))
+        bits = 0
+        for value_key, (_, value_bits) in list(self.values[field].items()):
+            if value_key == key or (words and words <= set(suggest_terms(value_key))):
+                bits |= value_bits
+        return bits
+
+    def select(self, field, keys):
+        """Bitmap of the centers whose ``field`` value has one of the facet_key()s ``keys``"""
+        bits = 0
+        for key in keys:
+            bits |= self.values[field].get(facet_key(key), (None, 0))[1]
+        return bits
+
+    def any(self, field):
+        """Bitmap of the centers with some value in ``field``"""
+        bits = 0
+        for _, value_bits in list(self.values[field].values()):
+            bits |= value_bits
+        return bits
+
+    def filter(self, filters):
+        """Bitmap of the centers matching, in every field of ``filters`` ({field: [texts]}), one of its texts"""
+        bits = None
+        for field, texts in filters.items():
+            union = 0
+            for text in texts:
+                union |= self.match(field, text)
+            bits = union if bits is None else bits & union
+        return bits
+
+    def counts(self, bitmap, fields=FACET_FIELDS):
+        """{field: [(value, centers)]} over the centers in ``bitmap``, most common value first"""
+        counts = {}
+        for field in fields:
+            values = [(display, (value_bits & bitmap).bit_count())
+                      for display, value_bits in list(self.values[field].values())]
+            counts[field] = sorted(((display, count) for display, count in values if count),
+                                   key=lambda item: (-item[1], str(item[0])))
+        return counts
+
+    def add(self, record):
+        bit = 1 << record.position
+        for field, by_key in self.values.items():
+            value = record.get(field)
+            key = facet_key(value)
+            if key:
+                display, bits = by_key.get(key, (value, 0))
+                by_key[key] = (display, bits | bit)
+
+    def discard(self, record):
+        mask = ~(1 << record.position)
+        for field, by_key in self.values.items():
+            key = facet_key(record.get(field))
+            if key in by_key:
+                display, bits = by_key[key]
+                by_key[key] = (display, bits & mask)
+
+
+class Shard:
+    """A partition of the snapshot's records with its own search index.
+
+    Postings keep global record positions, so shard results merge straight
+    back into dataset order. ``cities`` / ``provinces`` let a query whose
+    location hints the shard cannot contain skip it entirely.
+    """
+
+    __slots__ = ("positions", "search_index", "cities", "provinces")
+
+    def __init__(self, records):
+        self.positions = [record.position for record in records]
+        self.search_index = build_search_index(records)
+        self.cities = frozenset(record.norm_poblacion for record in records)
+        self.provinces = frozenset(record.norm_provincia for record in records)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, record):
+        """Index a new or updated record of this shard in place"""
+        _insert_sorted(self.positions, record.position)
+        add_to_search_index(self.search_index, record)
+        if record.norm_poblacion not in self.cities:
+            self.cities = self.cities | {record.norm_poblacion}
+        if record.norm_provincia not in self.provinces:
+            self.provinces = self.provinces | {record.norm_provincia}
+
+    def discard(self, record):
+        # cities / provinces keep the removed record's location; may_match() only has to be conservative
+        if _remove_sorted(self.positions, record.position):
+            remove_from_search_index(self.search_index, record)
+
+    def may_match(self, city_hints, province_hints):
+        if city_hints and self.cities.isdisjoint(city_hints):
+            return False
+        if province_hints and self.provinces.isdisjoint(province_hints):
+            return False
+        return True
+
+    def __getstate__(self):
+        return {
+            "positions": self.positions, "cities": self.cities, "provinces": self.provinces,
+            "search_index": {key: value for key, value in self.search_index.items() if key != "token_candidates"},
+        }
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        attach_token_candidates(self.search_index)
+
+
+def build_shards(records, count):
+    """Partition records into ``count`` shards by provincia, largest provinces first onto the lightest shard.
+
+    Keeping a province in one shard lets location hints skip whole shards.
+    Returns () when ``count`` is below 2 (no sharding).
+    """
+    if count < 2 or not records:
+        return ()
+    by_province = {}
+    for record in records:
+        by_province.setdefault(record.norm_provincia, []).append(record)
+    shard_records = [[] for _ in range(min(count, len(by_province)))]
+    for province in sorted(by_province, key=lambda p: (-len(by_province[p]), p)):
+        lightest = min(range(len(shard_records)), key=lambda i: (len(shard_records[i]), i))
+        shard_records[lightest].extend(by_province[province])
+    return tuple(Shard(sorted(group, key=lambda r: r.position)) for group in shard_records)
+
+
+class DatasetSnapshot:
+    """Everything the matcher reads for one version of centers.json.
+
+    A snapshot is built completely before it is published, and requests read
+    the module-level ``dataset`` reference once, so a reload swaps the whole
+    dataset atomically and in-flight requests keep a consistent view.
+
+    Single-center changes from the change log (upsert() / remove()) are the
+    exception: they update the published snapshot's indexes in place, one
+    record at a time, so their cost does not grow with the dataset. A
+    request racing a change may see that one center half-indexed, never a
+    torn record. Removed records keep their position (and their record, for
+    requests still holding it) until the change log is compacted.
+    """
+
+    __slots__ = (
+        "records", "search_index", "location_index", "geo_index", "suggest_index", "facet_index", "shard_count",
+        "shards", "version", "source", "source_mtime", "loaded_at", "build_seconds", "removed", "changes", "edits", "log_position",
+    )
+
+    def __init__(self, records, version="empty", source_mtime=None, build_seconds=0.0, shard_count=None):
+        self.records = list(records)
+        self.search_index = build_search_index(records)
+        self.location_index = {
+            "city": build_location_entries([r.norm_poblacion for r in records]),
+            "province": build_location_entries([r.norm_provincia for r in records]),
+        }
+        self.geo_index = GeoIndex(records)
+        self.suggest_index = SuggestIndex(records)
+        self.facet_index = FacetIndex(records)
+        self.shard_count = SEARCH_SHARDS if shard_count is None else shard_count
+        self.shards = build_shards(records, self.shard_count)
+        self.version = version
+        self.source = "json"
+        self.source_mtime = source_mtime
+        self.loaded_at = time.time()
+        self.build_seconds = build_seconds
+        self.removed = set()
+        self.changes = 0
+        self.edits = []  # (method, argument) of every in-place change, replayed by shard pool workers
+        self.log_position = (None, 0)  # (inode, offset) of the change log read so far
+
+    def __len__(self):
+        return len(self.records) - len(self.removed)
+
+    def match_center(self, center):
+        """Position of the center an upsert of ``center`` replaces (by id_centro, else codigo), None for a new one"""
+        for postings, field in (("id", "id_centro"), ("code", "codigo")):
+            if center.get(field) in (None, ""):
+                continue
+            positions = self.search_index[postings].get(str(center[field]).lower())
+            if positions:
+                if len(positions) > 1:
+                    raise ValueError(f"{field} {center[field]!r} matches {len(positions)} centers")
+                return positions[0]
+        return None
+
+    def find(self, key):
+        """Positions of the centers with ``key`` as id_centro or, failing that, as codigo (case-insensitive)"""
+        key = str(key).lower()
+        return list(self.search_index["id"].get(key) or self.search_index["code"].get(key) or ())
+
+    def upsert(self, center):
+        """Add ``center`` or replace the center it matches (see match_center()); returns (position, created)"""
+        position = self.match_center(center)
+        created = position is None
+        if created:
+            position = len(self.records)
+        else:
+            self._unindex(self.records[position])
+        record = CenterRecord(position, dict(center))
+        if created:
+            self.records.append(record)
+        else:
+            self.records[position] = record
+        self._index(record)
+        self._changed("upsert", center)
+        return position, created
+
+    def remove(self, position):
+        self._unindex(self.records[position])
+        self.removed.add(position)
+        self._changed("remove", position)
+
+    def _index(self, record):
+        add_to_search_index(self.search_index, record)
+        add_location(self.location_index["city"], record.norm_poblacion, record.position)
+        add_location(self.location_index["province"], record.norm_provincia, record.position)
+        self.geo_index.add(record)
+        self.suggest_index.add(record)
+        self.facet_index.add(record)
+        if self.shards:
+            # Keep a province together when a shard already holds it
+            home = [shard for shard in self.shards if record.norm_provincia in shard.provinces]
+            (home or [min(self.shards, key=len)])[0].add(record)
+
+    def _unindex(self, record):
+        remove_from_search_index(self.search_index, record)
+        remove_location(self.location_index["city"], record.norm_poblacion, record.position)
+        remove_location(self.location_index["province"], record.norm_provincia, record.position)
+        self.geo_index.discard(record.position)
+        self.suggest_index.discard(record)
+        self.facet_index.discard(record)
+        for shard in self.shards:
+            shard.discard(record)
+
+    def _changed(self, method, argument):
+        self.edits.append((method, argument))
+        self.changes += 1
+        self.version = f"{self.version.split('+')[0]}+{self.changes}"
+
+    def __getstate__(self):
+        state = {name: getattr(self, name) for name in ("records", "location_index", "geo_index", "suggest_index",
+                                                     "facet_index", "shard_count", "shards", "version")}
+        state["search_index"] = {key: value for key, value in self.search_index.items() if key != "token_candidates"}
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        attach_token_candidates(self.search_index)
+        self.source = "index"
+        self.source_mtime = None
+        self.loaded_at = time.time()
+        self.build_seconds = 0.0
+        self.removed = set()
+        self.changes = 0
+        self.edits = []
+        self.log_position = (None, 0)
+
+
+DATA_FILE = os.path.join(os.path.dirname(__file__), "centers.json")
+# Prebuilt index written by `python app.py build-index`; defaults to the data file's name with .idx
+INDEX_FILE = os.environ.get("CENTERS_INDEX_FILE", "")
+INDEX_MAGIC = b"LAWASHIX"
+# Bump whenever normalization, CenterRecord or the index layout changes so old artifacts are rebuilt
+INDEX_FORMAT_VERSION = 6
+# Append-only log of single-center changes; defaults to the data file's name with .changes
+CHANGE_LOG_FILE = os.environ.get("CENTERS_CHANGE_LOG", "")
+RELOAD_INTERVAL = float(os.environ.get("CENTERS_RELOAD_INTERVAL", "0"))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+dataset = DatasetSnapshot(())
+reload_status = {"reloads": 0, "last_error": None, "last_attempt_at": None, "generation": 0, "change_generation": 0}
+_reload_lock = threading.Lock()
+# Shard pool of this serving process (see start_shard_pool()) and the snapshot it scores; "base" counts
+# the edits that snapshot had when it was forked or, after a reload, published
+_shard_pool = {"snapshot": None, "base": 0, "pool": None}
+_shard_pool_lock = threading.Lock()
+# Bumped by /admin/reload. When Gunicorn preloads the app this is created in the master, so it sits in
+# shared memory and the reload watcher of every worker sees the bump.
+reload_generation = multiprocessing.Value("L", 0)
+# Bumped after every change log append, the same way
+change_generation = multiprocessing.Value("L", 0)
+
+
+def index_file_for(path):
+    return INDEX_FILE or os.path.splitext(path)[0] + ".idx"
+
+
+def change_log_for(path):
+    return CHANGE_LOG_FILE or os.path.splitext(path)[0] + ".changes"
+
+
+def write_index_artifact(snapshot, source_digest, path):
+    """Serialize a built snapshot together with the digest of the centers file it came from.
+
+    Layout: INDEX_MAGIC, a 4-byte big-endian header length, a JSON header
+    (format version, source digest, dataset version, center count) and the
+    pickled snapshot. The file is replaced atomically.
+    """
+    header = json.dumps({
+        "format": INDEX_FORMAT_VERSION,
+        "source_sha1": source_digest,
+        "version": snapshot.version,
+        "centers": len(snapshot.records),
+        "built_at": time.time(),
+    }).encode("utf-8")
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, "wb") as f:
+        f.write(INDEX_MAGIC)
+        f.write(struct.pack(">I", len(header)))
+        f.write(header)
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def read_index_header(mapped):
+    """(header, payload offset) of a mapped index artifact, or (None, 0) when it is not one"""
+    prefix = len(INDEX_MAGIC) + 4
+    if len(mapped) < prefix or mapped[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        return None, 0
+    (length,) = struct.unpack(">I", mapped[len(INDEX_MAGIC):prefix])
+    return json.loads(mapped[prefix:prefix + length]), prefix + length
+
+
+def load_index_artifact(path, source_digest):
+    """Snapshot from a prebuilt index, or None when it is missing, stale or unreadable.
+
+    The artifact is unpickled, so it must be as trusted as the application
+    code; it is only used when its format version and source digest match.
+    """
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            header, offset = read_index_header(mapped)
+            if header is None:
+                logger.warning("Ignoring %s: not an index artifact.", path)
+                return None
+            if header.get("format") != INDEX_FORMAT_VERSION or header.get("source_sha1") != source_digest:
+                logger.info("Index %s is stale; building from JSON.", path)
+                return None
+            with memoryview(mapped) as view:
+                return pickle.loads(view[offset:])
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Could not load index %s (%s); building from JSON.", path, e)
+        return None
+
+
+def build_snapshot(path=None, use_index=True):
+    """Parse and index a centers file into a new, unpublished snapshot.
+
+    A prebuilt index matching the file's digest is loaded instead of
+    rebuilding, unless ``use_index`` is false.
+    """
+    path = path or DATA_FILE
+    started = time.perf_counter()
+    source_mtime = os.stat(path).st_mtime_ns
+    with open(path, 'rb') as f:
+        payload = f.read()
+    digest = hashlib.sha1(payload).hexdigest()
+    snapshot = load_index_artifact(index_file_for(path), digest) if use_index else None
+    if snapshot is None:
+        data = json.loads(payload)
+        records = build_center_records(data.get('centers', []))
+        snapshot = DatasetSnapshot(records, version=digest[:12])
+    elif snapshot.shard_count != SEARCH_SHARDS:
+        # Prebuilt with another SEARCH_SHARDS setting
+        snapshot.shard_count = SEARCH_SHARDS
+        snapshot.shards = build_shards(snapshot.records, SEARCH_SHARDS)
+    snapshot.source_mtime = source_mtime
+    snapshot.build_seconds = time.perf_counter() - started
+    return snapshot
+
+
+def build_index(path=None, output=None):
+    """Build a snapshot from a centers file and write it as an index artifact; returns the snapshot"""
+    path = path or DATA_FILE
+    snapshot = build_snapshot(path, use_index=False)
+    with open(path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    write_index_artifact(snapshot, digest, output or index_file_for(path))
+    return snapshot
+
+
+def load_data():
+    """Build a fresh snapshot from DATA_FILE and publish it.
+
+    A failed reload keeps serving the previous snapshot; only a failed
+    initial load leaves the service without data.
+    """
+    global dataset
+    with _reload_lock:
+        reload_status["last_attempt_at"] = time.time()
+        try:
+            snapshot = build_snapshot()
+            replay_change_log(snapshot)
+        except Exception as e:
+            logger.error(f"Error loading data: {e}")
+            reload_status["last_error"] = str(e)
+            return False
+        dataset = snapshot
+        with _shard_pool_lock:
+            if _shard_pool["pool"] is not None:
+                # No new fork: the pool's processes rebuild this snapshot on their next task
+                _shard_pool.update(snapshot=snapshot, base=len(snapshot.edits))
+        query_cache.clear()
+        chat_sessions.clear()
+        reload_status["reloads"] += 1
+        reload_status["last_error"] = None
+        if reload_status["reloads"] > 1 and gc.get_freeze_count():
+            # The snapshot frozen before a preload fork is no longer shared; let the collector reclaim it
+            gc.unfreeze()
+    if not snapshot.records:
+        logger.warning("Centers dataset is empty.")
+    else:
+        logger.info("Data loaded successfully. %d centers found (version %s from %s, %.1f ms).",
+                    len(snapshot), snapshot.version, snapshot.source, snapshot.build_seconds * 1000)
+    return True
+
+
+@contextlib.contextmanager
+def change_log_lock(path=None):
+    """Exclusive lock, across threads and worker processes, for appending to or compacting the change log"""
+    path = path or change_log_for(DATA_FILE)
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def append_change(change, path=None):
+    """Durably append one change to the log (hold change_log_lock()) and tell the other workers"""
+    path = path or change_log_for(DATA_FILE)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(dict(change, at=time.time()), ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    with change_generation.get_lock():
+        change_generation.value += 1
+
+
+# Fields every reply and listing reads from a center; they may be empty but must be there
+CENTER_DISPLAY_FIELDS = ("codigo", "nombre", "direccion", "poblacion", "provincia")
+
+
+def center_error(center):
+    """Why ``center`` cannot be upserted, or None"""
+    if not isinstance(center, dict):
+        return "body must be a JSON object with the center's fields"
+    if not str(center.get("id_centro") or "").strip():
+        return "'id_centro' is required"
+    missing = [field for field in CENTER_DISPLAY_FIELDS if not isinstance(center.get(field), str)]
+    if missing:
+        return f"{', '.join(repr(field) for field in missing)} must be given as strings"
+    if any(isinstance(value, (dict, list)) for value in center.values()):
+        return "center fields must be strings, numbers, booleans or null"
+    return None
+
+
+def apply_change(snapshot, change):
+    """Apply one change log entry to ``snapshot`` in place"""
+    if change["op"] == "upsert":
+        # Entries logged before the display fields were required would break every reply listing them
+        error = center_error(change["center"])
+        if error:
+            raise ValueError(error)
+        snapshot.upsert(change["center"])
+    elif change["op"] == "delete":
+        positions = snapshot.find(change["key"])
+        if len(positions) != 1:
+            raise ValueError(f"{change['key']!r} matches {len(positions)} centers")
+        snapshot.remove(positions[0])
+    else:
+        raise ValueError(f"unknown change {change['op']!r}")
+
+
+def replay_change_log(snapshot, path=None):
+    """Apply the change log entries ``snapshot`` has not seen yet; returns how many were read.
+
+    Returns None when the log was compacted into a new file since, so the
+    snapshot has to be rebuilt from the centers file. Every worker applies
+    the same entries in the same order, skipping the same invalid ones.
+    """
+    path = path or change_log_for(DATA_FILE)
+    inode, offset = snapshot.log_position
+    try:
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if (inode is not None and stat.st_ino != inode) or stat.st_size < offset:
+                return None
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return None if offset else 0
+    # A line still being written is picked up next time
+    data = data[:data.rfind(b"\n") + 1]
+    lines = data.splitlines()
+    for line in lines:
+        try:
+            apply_change(snapshot, json.loads(line))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error(f"Skipping change log entry {line[:200]!r}: {e}")
+    snapshot.log_position = (stat.st_ino, offset + len(data))
+    return len(lines)
+
+
+def follow_change_log():
+    """Apply the changes any worker logged since the published snapshot last looked"""
+    reload_status["change_generation"] = change_generation.value
+    with _reload_lock:
+        applied = replay_change_log(dataset)
+        if applied:
+            query_cache.clear()
+            chat_sessions.clear()
+    if applied is None:
+        return load_data()
+    return bool(applied)
+
+
+def _write_atomically(path, text):
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def compact_change_log(path=None):
+    """Fold the change log into the centers file and start a new, empty log; returns the entries folded.
+
+    Both files are replaced atomically while the log is locked. Workers
+    notice the new log file and rebuild from the compacted centers file.
+    """
+    path = path or DATA_FILE
+    log_path = change_log_for(path)
+    with change_log_lock(log_path):
+        snapshot = build_snapshot(path, use_index=False)
+        folded = replay_change_log(snapshot, log_path)
+        if not folded:
+            return 0
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        data["centers"] = [record.data for record in snapshot.records if record.position not in snapshot.removed]
+        _write_atomically(path, json.dumps(data, indent=4, ensure_ascii=False) + "\n")
+        _write_atomically(log_path, "")
+    return folded
+
+
+def announce_reload():
+    """Have every other worker's reload watcher reload as well (see reload_generation)"""
+    with reload_generation.get_lock():
+        reload_generation.value += 1
+        reload_status["generation"] = reload_generation.value
+
+
+def reload_if_changed(announce=False):
+    """Reload when DATA_FILE's mtime differs from the published snapshot or another worker announced a reload.
+
+    Otherwise apply any center changes logged since the last look. With
+    ``announce`` a reload caused by a changed file is announced to the other
+    workers, as the preloading Gunicorn master does for its forked workers.
+    """
+    try:
+        mtime = os.stat(DATA_FILE).st_mtime_ns
+    except OSError as e:
+        logger.error(f"Cannot stat {DATA_FILE}: {e}")
+        return False
+    generation = reload_generation.value
+    if mtime == dataset.source_mtime and generation == reload_status["generation"]:
+        return follow_change_log()
+    file_changed = mtime != dataset.source_mtime
+    reload_status["generation"] = generation
+    loaded = load_data()
+    if loaded and announce and file_changed:
+        announce_reload()
+    return loaded
+
+
+_reload_watcher = {"thread": None, "announce": False}
+
+
+def _watch_data_file(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            reload_if_changed(_reload_watcher["announce"])
+        except Exception:
+            logger.exception("Centers file watcher failed")
+
+
+def start_reload_watcher(interval=RELOAD_INTERVAL, announce=False):
+    """Poll DATA_FILE in a daemon thread so this process picks up edits (and, with ``announce``, tells the workers).
+
+    There is one watcher per process: calling this again only turns on
+    ``announce``, so a watcher started at import and the one the Gunicorn
+    master asks for never race each other for the same change.
+    """
+    if announce:
+        _reload_watcher["announce"] = True
+    watcher = _reload_watcher["thread"]
+    if interval <= 0 or (watcher is not None and watcher.is_alive()):
+        return watcher
+    watcher = threading.Thread(target=_watch_data_file, args=(interval,), name="centers-reload", daemon=True)
+    watcher.start()
+    _reload_watcher["thread"] = watcher
+    return watcher
+
+
+_reload_follower = {"thread": None}
+_reload_follower_lock = threading.Lock()
+
+
+def _follow_reload():
+    try:
+        reload_if_changed()
+    except Exception:
+        logger.exception("Following an announced reload failed")
+
+
+def follow_reload_in_background():
+    """Rebuild for a reload another process announced on a daemon thread; returns that thread.
+
+    Requests keep being served from the published snapshot until load_data()
+    swaps the new one in. At most one such rebuild runs per process; a
+    reload announced while it runs is followed by the next request after it.
+    """
+    with _reload_follower_lock:
+        follower = _reload_follower["thread"]
+        if follower is None or not follower.is_alive():
+            follower = threading.Thread(target=_follow_reload, name="centers-follow", daemon=True)
+            follower.start()
+            _reload_follower["thread"] = follower
+        return follower
+
+
+def init_worker():
+    """Per-worker setup after a preloading server (gunicorn.conf.py) forks this process.
+
+    Workers inherit the master's snapshot and share its pages copy-on-write.
+    The master's reload watcher is the only one polling DATA_FILE and
+    announces what it reloads, so workers just follow announcements (see
+    follow_reload_announcements()) instead of each polling the file. Locks
+    the master's watcher may have held at fork time are recreated and the
+    master's shard pool state is dropped. Each worker forks its own shard
+    pool here, before its request threads start (see start_shard_pool());
+    the master never scores.
+    """
+    global _reload_lock, _reload_follower_lock, _shard_pool_lock
+    _reload_lock = threading.Lock()
+    _reload_follower_lock = threading.Lock()
+    _shard_pool_lock = threading.Lock()
+    _shard_pool.update(snapshot=None, base=0, pool=None)
+    _reload_watcher.update(thread=None, announce=False)
+    _reload_follower["thread"] = None
+    query_cache._lock = threading.Lock()
+    chat_sessions._lock = threading.Lock()
+    metrics._lock = threading.Lock()
+    start_shard_pool()
+
+
+def process_memory():
+    """Memory of this process in kB: resident, proportional and the shared / private split (Linux)"""
+    fields = {"Rss": "rss_kb", "Pss": "pss_kb", "Shared_Clean": "shared_kb", "Shared_Dirty": "shared_kb",
+              "Private_Clean": "private_kb", "Private_Dirty": "private_kb"}
+    memory = {"pid": os.getpid()}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    memory[fields[name]] = memory.get(fields[name], 0) + int(value.split()[0])
+    except (OSError, ValueError):
+        # Peak RSS only (kB on Linux, bytes on macOS)
+        memory["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return memory
+
+
+load_data()
+start_reload_watcher()
+
+MACHINE_KEYWORDS = {"machine", "machines", "lavadora", "lavadoras", "washer", "washers", "secadora", "secadoras", "dryer", "dryers", "equipment"}
+# Words naming a kind of equipment, and the facet fields describing that kind
+EQUIPMENT_KINDS = (
+    ({"secadora", "secadoras", "secador", "secadores", "dryer", "dryers"}, ("fabricante_secadoras",)),
+    ({"lavadora", "lavadoras", "washer", "washers"}, ("fabricante_lavadoras",)),
+    ({"central", "centrals", "centrales", "pago", "payment", "payments", "tpv"},
+     ("fabricante_central_pago", "modelo_central_pago")),
+)
+EQUIPMENT_FIELDS = ("fabricante_lavadoras", "fabricante_secadoras", "fabricante_central_pago", "modelo_central_pago")
+EQUIPMENT_LABELS = {
+    "fabricante_lavadoras": "Washers",
+    "fabricante_secadoras": "Dryers",
+    "fabricante_central_pago": "Payment central",
+    "modelo_central_pago": "Payment central model",
+}
+# Words of manufacturer and model names too generic to select equipment on their own
+EQUIPMENT_GENERIC_WORDS = {
+    "sa", "sl", "slu", "srl", "plc", "spain", "systems", "international", "group", "global", "networks",
+    "investments", "laundry", "line", "professional", "wash",
+}
+# Words of an equipment question that say nothing about which centers ("which centers have ...")
+EQUIPMENT_QUERY_WORDS = MACHINE_KEYWORDS | {
+    "centers", "centres", "centros", "centro", "which", "have", "has", "with", "con", "tienen", "tiene", "que",
+    "cuales", "list", "all", "todos", "todas", "how", "many", "cuantos", "cuantas", "there", "are", "hay", "of",
+    "from", "brand", "marca", "manufacturer", "fabricante", "model", "modelo", "only", "solo",
+}
+# Words that make a query about equipment, so manufacturer and model words in it ("mark", "point") filter
+# by equipment instead of being matched as text
+EQUIPMENT_INTENT_WORDS = MACHINE_KEYWORDS | {word for kind_words, _ in EQUIPMENT_KINDS for word in kind_words} | {
+    "brand", "brands", "marca", "marcas", "manufacturer", "manufacturers", "fabricante", "fabricantes",
+    "model", "models", "modelo", "modelos",
+}
+# How far below the best location score a center still counts as in the named place
+EQUIPMENT_LOCATION_TOLERANCE = 0.05
+CODE_TERMS = {"code", "codigo", "codigo", "cod"}
+ID_TERMS = {"id", "identifier", "identificador", "identificacion", "identification"}
+
+
+def analyze_query(user_message):
+    """Normalize a user message and detect which center fields it asks for"""
+    trace = metrics.current()
+    started = trace.start()
+    # Normalize query
+    normalized_query = normalize_text(user_message.lower())
+    
+    # Remove stopwords
+    raw_words = normalized_query.split()
+    raw_clean_tokens = [re.sub(r'[^a-z0-9]', '', w) for w in raw_words]
+    query = {
+        "normalized_query": normalized_query,
+        "query_words": [w for w in raw_words if w not in STOPWORDS],
+        "machine_info_requested": any(kw in raw_words for kw in MACHINE_KEYWORDS),
+        "code_requested": any(token in CODE_TERMS for token in raw_clean_tokens if token),
+        "id_requested": any(token in ID_TERMS for token in raw_clean_tokens if token),
+    }
+    trace.stage("normalize", started)
+    return query
+
+
+def match_centers(query, snapshot=None, engine=None, top_k=None):
+    """Score the center snapshot against an analyzed query and return its RankedMatches.
+
+    ``engine`` picks the hybrid scorer ("python" or "numpy"); both rank identically.
+    A sharded snapshot is scored shard by shard; there ``top_k`` limits the
+    result to the best ``top_k`` matches (see match_shards()).
+    """
+    if snapshot is None:
+        snapshot = dataset
+    trace = metrics.current()
+    started = trace.start()
+    query_tokens = set(query["query_words"])
+    location_index = snapshot.location_index
+    # Location hints always come from the whole dataset, so shards filter like a full scan
+    city_hints = detect_location_candidates(query_tokens, query["normalized_query"], location_index["city"])
+    province_hints = detect_location_candidates(query_tokens, query["normalized_query"], location_index["province"])
+    trace.stage("locations", started)
+    if snapshot.shards:
+        return match_shards(query, snapshot, city_hints, province_hints, engine, top_k)
+    matches = collect_matches(query, snapshot, snapshot.search_index, city_hints, province_hints, engine)
+    return RankedMatches([match for _, match in matches], bool(city_hints or province_hints))
+
+
+def collect_matches(query, snapshot, search_index, detected_city_hints, detected_province_hints, engine=None,
+                    positions=None):
+    """(position, match) pairs, in dataset order, of the rows ``search_index`` covers.
+
+    ``search_index`` is the snapshot's own index or one of its shards'; the
+    city / province hints restrict the rows to the detected locations and
+    ``positions``, when given, to those records.
+    """
+    centers = snapshot.records
+    location_index = snapshot.location_index
+    normalized_query = query["normalized_query"]
+    query_words = query["query_words"]
+    id_requested = query["id_requested"]
+    code_requested = query["code_requested"]
+    trace = metrics.current()
+    clock = trace.start()
+
+    # Fuzzy matching logic with hybrid scoring
+    matches = []  # Store all potential matches with their scores
+    query_string = " ".join(query_words)
+    query_tokens = set(query_words)
+    filter_by_city = len(detected_city_hints) > 0
+    filter_by_province = len(detected_province_hints) > 0
+    # Additional normalized versions of tokens for code/id detection
+    query_tokens_clean = {clean_token(t) for t in query_tokens if clean_token(t)}
+    
+    # Pre-calculate phonetic codes for query tokens
+    query_phonetics = {qt: token_metaphone(qt) for qt in query_tokens if len(qt) > 2}
+    query_phonetic_codes = set(query_phonetics.values())
+    
+    # Candidate generation: only rows sharing some signal with the query are scored
+    id_hits, code_hits = lookup_direct_matches(search_index, query_tokens, query_tokens_clean)
+    # Vocabulary tokens within the Jaro-Winkler threshold of any query token
+    query_fuzzy_tokens = search_index["fuzzy_tokens"].match_all(query_tokens)
+    similarity_cache = {}
+    candidate_positions = generate_candidates(search_index, query_tokens, query_string, similarity_cache)
+    candidate_positions.update(id_hits)
+    candidate_positions.update(code_hits)
+    # Only rows in a detected city / province are eligible
+    if filter_by_city:
+        candidate_positions.intersection_update(location_positions(location_index["city"], detected_city_hints))
+    if filter_by_province:
+        candidate_positions.intersection_update(location_positions(location_index["province"], detected_province_hints))
+    if positions is not None:
+        candidate_positions.intersection_update(positions)
+    clock = trace.stage("candidates", clock)
+
+    long_query_tokens = [qt for qt in query_tokens if len(qt) > 3]
+    scored_records = []
+    for position in sorted(candidate_positions):
+        record = centers[position]
+        # 1. Direct Code/ID Match (Highest Priority)
+        # Check if any query token exactly matches id_centro or codigo (case-insensitive)
+        is_id_match = position in id_hits
+        is_code_match = position in code_hits
+        
+        # Apply strict matching based on user intent
+        if id_requested and is_id_match:
+            # User asked for ID and we found an ID match
+            matches.append((position, {
+                "row": record,
+                "score": 1.0,
+                "reason": "Direct ID match",
+                "location_score": 1.0
+            }))
+            continue
+        elif code_requested and is_code_match:
+            # User asked for Code and we found a Code match
+            matches.append((position, {
+                "row": record,
+                "score": 1.0,
+                "reason": "Direct Code match",
+                "location_score": 1.0
+            }))
+            continue
+        elif not id_requested and not code_requested and (is_id_match or is_code_match):
+            # User didn't specify, so match either
+            matches.append((position, {
+                "row": record,
+                "score": 1.0,
+                "reason": "Direct Code/ID match",
+                "location_score": 1.0
+            }))
+            continue
+
+        scored_records.append(record)
+    scanned = len(matches) + len(scored_records)
+    clock = trace.stage("scan", clock)
+
+    # Signals with the full-field SequenceMatcher ratios the scorers will actually read
+    cached_before = len(similarity_cache)
+    row_signals = [
+        extract_row_signals(
+            record, query_tokens, long_query_tokens, query_phonetic_codes, query_fuzzy_tokens,
+            query_string, similarity_cache,
+        )
+        for record in scored_records
+    ]
+    trace.count_comparisons("sequence_matcher", len(similarity_cache) - cached_before)
+    if trace.active:
+        skipped = {norm for record in scored_records for norm, _, _ in record.fields if norm not in similarity_cache}
+        trace.count_comparisons("sequence_matcher_skipped", len(skipped))
+    # Each row checks every field's metaphone codes and close spellings against the query
+    trace.count_comparisons("phonetic", len(row_signals) * len(SEARCH_FIELDS))
+    trace.count_comparisons("token_fuzzy", len(row_signals) * len(SEARCH_FIELDS))
+    clock = trace.stage("similarity", clock)
+
+    # Hybrid scoring of every remaining candidate at once
+    minimum_score = 0.35 if (filter_by_city or filter_by_province) else 0.4
+    fallback_records = []
+    for record, scores in zip(scored_records, SCORING_ENGINES[engine or SCORING_ENGINE](row_signals)):
+        if scores is None:
+            # No overlap, phonetic match, substring match, token fuzzy, or strong fuzzy match
+            continue
+        final_score, location_score, nombre_score = scores
+        # Only collect matches with meaningful scores
+        if final_score >= minimum_score:
+            matches.append((record.position, {
+                'row': record,
+                'score': final_score,
+                'location_score': location_score,
+                'nombre_score': nombre_score,
+                'reason': "Hybrid field match"
+            }))
+            continue
+        fallback_records.append((record, location_score, nombre_score))
+    clock = trace.stage("scoring", clock)
+
+    combined_bound = SimilarityBound(normalized_query, 0.82)
+    combined_computed = 0
+    for record, location_score, nombre_score in fallback_records:
+        # fallback scoring using combined fields for partial combos
+        if combined_bound.below(record.combined_text):
+            continue
+        combined_computed += 1
+        combined_similarity = fuzzy_similarity(normalized_query, record.combined_text)
+        if combined_similarity >= 0.82:
+            matches.append((record.position, {
+                'row': record,
+                'score': combined_similarity * 0.7,
+                'location_score': max(location_score, combined_similarity),
+                'nombre_score': max(nombre_score, combined_similarity),
+                'reason': "Combined fields match"
+            }))
+    trace.count_comparisons("sequence_matcher", combined_computed)
+    trace.count_comparisons("sequence_matcher_bound", len(fallback_records))
+    trace.count_comparisons("sequence_matcher_skipped", len(fallback_records) - combined_computed)
+    clock = trace.stage("fallback", clock)
+
+    # Back to dataset order, the tie-breaker of the ranking
+    matches.sort(key=lambda item: item[0])
+    trace.count_rows("candidates", len(candidate_positions))
+    trace.count_rows("scanned", scanned)
+    trace.count_rows("scored", len(scored_records))
+    trace.count_rows("kept", len(matches))
+    return matches
+
+
+def score_centers(query, snapshot=None, engine=None):
+    """Every ranked match for an analyzed query, best first"""
+    return match_centers(query, snapshot, engine).all()
+
+
+class RankedMatches:
+    """Matches of one query after location prioritization, ranked on demand.
+
+    Ranking is by score, best first, with dataset order breaking ties. If no
+    match clears the location threshold and a city or province was detected,
+    location_score ranks first instead. Pages come from bounded heap
+    selection (heapq.nsmallest), so showing the top 10 of a broad query does
+    not sort every match.
+    """
+
+    __slots__ = ("pool", "by_location")
+
+    def __init__(self, matches, location_filtered):
+        # Prioritize matches that strongly hit the requested location
+        location_threshold = self.location_threshold(location_filtered)
+        location_strong_matches = [m for m in matches if m['location_score'] >= location_threshold]
+        if location_strong_matches:
+            self.pool = location_strong_matches
+            self.by_location = False
+        else:
+            # fallback to best matches sorted even if location score slightly lower
+            self.pool = matches
+            self.by_location = location_filtered
+
+    @staticmethod
+    def location_threshold(location_filtered):
+        return 0.35 if location_filtered else 0.4
+
+    def __len__(self):
+        return len(self.pool)
+
+    @property
+    def total(self):
+        return len(self.pool)
+
+    def sort_key(self, match):
+        if self.by_location:
+            return (-match['location_score'], -match['score'], match['row'].position)
+        return (-match['score'], match['row'].position)
+
+    def top(self, limit, offset=0):
+        """Ranked matches ``offset`` to ``offset + limit``"""
+        if limit <= 0 or offset >= len(self.pool):
+            return []
+        return heapq.nsmallest(offset + limit, self.pool, key=self.sort_key)[offset:]
+
+    def all(self):
+        return sorted(self.pool, key=self.sort_key)
+
+
+class ShardedTopMatches(RankedMatches):
+    """The best matches of a sharded search, merged from each shard's own top k.
+
+    ``total`` counts every match in the ranking pool, but ``pool`` only holds
+    the best ``top_k`` of them, so pages past ``top_k`` are not available.
+    """
+
+    __slots__ = ("_total", "top_k")
+
+    def __init__(self, pool, by_location, total, top_k):
+        self.pool = pool
+        self.by_location = by_location
+        self._total = total
+        self.top_k = top_k
+
+    def __len__(self):
+        return self._total
+
+    @property
+    def total(self):
+        return self._total
+
+    def top(self, limit, offset=0):
+        if offset + limit > self.top_k and self._total > self.top_k:
+            raise ValueError(f"only the best {self.top_k} sharded matches are kept")
+        return super().top(limit, offset)
+
+
+def _match_entry(match):
+    """Compact, picklable form of a match: no CenterRecord crosses a process boundary"""
+    return (match['row'].position, match['score'], match['location_score'], match.get('nombre_score'), match['reason'])
+
+
+def _match_from_entry(snapshot, entry):
+    position, score, location_score, nombre_score, reason = entry
+    match = {'row': snapshot.records[position], 'score': score, 'location_score': location_score, 'reason': reason}
+    if nombre_score is not None:
+        match['nombre_score'] = nombre_score
+    return match
+
+
+def score_shard(snapshot, shard_id, query, city_hints, province_hints, engine=None, top_k=None):
+    """Score one shard of ``snapshot``: (location-strong pool?, pool size, match entries).
+
+    With ``top_k`` None the entries are all of the shard's matches in
+    dataset order; otherwise they are the best ``top_k`` of the shard's own
+    ranking pool, best first.
+    """
+    matches = collect_matches(query, snapshot, snapshot.shards[shard_id].search_index,
+                              city_hints, province_hints, engine)
+    if top_k is None:
+        return False, len(matches), [_match_entry(match) for _, match in matches]
+    location_filtered = bool(city_hints or province_hints)
+    ranked = RankedMatches([match for _, match in matches], location_filtered)
+    threshold = RankedMatches.location_threshold(location_filtered)
+    strong = any(match['location_score'] >= threshold for match in ranked.pool)
+    return strong, ranked.total, [_match_entry(match) for match in ranked.top(top_k)]
+
+
+def _score_shard_task(task):
+    # Runs in a shard pool process, against the snapshot it holds plus the edits it was sent
+    version, base, edits, shard_id, *arguments = task
+    snapshot = dataset
+    build = version.split("+")[0]
+    if snapshot.version.split("+")[0] != build and _shard_worker["followed"] != build:
+        # The serving process reloaded since this pool was forked: rebuild as it did, once per version
+        _shard_worker["followed"] = build
+        load_data()
+        snapshot = dataset
+    if len(snapshot.edits) < base:
+        raise RuntimeError(f"shard worker holds dataset {snapshot.version}, behind {version}")
+    for method, argument in edits[len(snapshot.edits) - base:]:
+        getattr(snapshot, method)(argument)
+    if snapshot.version != version:
+        raise RuntimeError(f"shard worker holds dataset {snapshot.version}, not {version}")
+    return score_shard(snapshot, shard_id, *arguments)
+
+
+_shard_worker = {"followed": None}  # build a shard pool process last reloaded for
+
+
+def _init_shard_worker():
+    # A forked worker inherits the forking thread's request trace, the serving process's pool and
+    # _reload_lock as held by start_shard_pool(); drop them so the worker can follow reloads itself
+    global _reload_lock
+    _reload_lock = threading.Lock()
+    metrics._local = threading.local()
+    _shard_pool.update(snapshot=None, base=0, pool=None)
+
+
+def shard_pool(snapshot):
+    """(pool, base) scoring the shards of ``snapshot``, or None to score them in-process.
+
+    Never forks: requests only use the pool start_shard_pool() forked, and
+    only for the published snapshot.
+    """
+    with _shard_pool_lock:
+        if _shard_pool["pool"] is None or _shard_pool["snapshot"] is not snapshot:
+            return None
+        return _shard_pool["pool"], _shard_pool["base"]
+
+
+def start_shard_pool():
+    """Fork a pool of SEARCH_WORKERS processes scoring the shards of this serving process's snapshots.
+
+    Call it only while the process runs no request threads (init_worker()
+    after the Gunicorn fork, or before the dev server starts): forking a
+    threaded process can copy locks other threads hold. The pool is forked
+    once, so its processes read the published indexes copy-on-write. It
+    then follows the serving process without forking again: in-place
+    changes travel with each task (see DatasetSnapshot.edits), and after a
+    full reload each pool process rebuilds the dataset itself on its next
+    task, as a Gunicorn worker follows a reload announcement.
+    """
+    stop_shard_pool()
+    if SEARCH_WORKERS < 1:
+        return None
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        return None
+    # No in-place change may land between forking and counting the edits the workers hold
+    with _reload_lock:
+        pool = context.Pool(SEARCH_WORKERS, initializer=_init_shard_worker)
+        with _shard_pool_lock:
+            _shard_pool.update(snapshot=dataset, base=len(dataset.edits), pool=pool)
+    return pool
+
+
+def stop_shard_pool():
+    """Stop scoring shards on a pool and join its processes once their tasks finish"""
+    with _shard_pool_lock:
+        old = _shard_pool["pool"]
+        _shard_pool.update(snapshot=None, base=0, pool=None)
+    if old is not None:
+        old.close()
+        old.join()
+
+
+def match_shards(query, snapshot, city_hints, province_hints, engine=None, top_k=None):
+    """RankedMatches of a sharded snapshot, scoring the shards on the shard pool when one is configured.
+
+    Shards that hold none of the hinted cities / provinces are skipped. With
+    ``top_k`` each shard returns only its best ``top_k`` matches and the
+    merge keeps the global best ``top_k`` (a ShardedTopMatches); without it
+    every match is merged back and the ranking equals an unsharded one.
+    """
+    trace = metrics.current()
+    started = trace.start()
+    location_filtered = bool(city_hints or province_hints)
+    tasks = [
+        (shard_id, query, city_hints, province_hints, engine, top_k)
+        for shard_id, shard in enumerate(snapshot.shards)
+        if shard.may_match(city_hints, province_hints)
+    ]
+    trace.count_rows("shards", len(tasks))
+    results = None
+    pooled = shard_pool(snapshot) if len(tasks) > 1 else None
+    if pooled is not None:
+        pool, base = pooled
+        edits = snapshot.edits[base:]
+        try:
+            results = pool.map(_score_shard_task, [(snapshot.version, base, edits, *task) for task in tasks])
+        except (ValueError, RuntimeError) as e:
+            # The pool was retired by a reload, or a change raced this request
+            logger.warning("Shard pool unavailable (%s); scoring in-process.", e)
+    if results is None:
+        results = [score_shard(snapshot, *task) for task in tasks]
+    trace.stage("shards", started)
+
+    if top_k is None:
+        entries = heapq.merge(*(entries for _, _, entries in results), key=lambda entry: entry[0])
+        return RankedMatches([_match_from_entry(snapshot, entry) for entry in entries], location_filtered)
+    # Location-strong matches anywhere outrank every other shard's pool
+    strong = [result for result in results if result[0]]
+    chosen = strong or results
+    ranked = ShardedTopMatches([], not strong and location_filtered, sum(total for _, total, _ in chosen), top_k)
+    pool = [_match_from_entry(snapshot, entry) for _, _, entries in chosen for entry in entries]
+    ranked.pool = heapq.nsmallest(top_k, pool, key=ranked.sort_key)
+    return ranked
+
+
+def ensure_ranked(ranked, query, snapshot, needed=None):
+    """``ranked``, re-scored in full when a sharded top-k cut lacks its first ``needed`` matches (all when None)"""
+    if isinstance(ranked, ShardedTopMatches):
+        wanted = ranked.total if needed is None else min(needed, ranked.total)
+        if len(ranked.pool) < wanted:
+            return match_centers(query, snapshot)
+    return ranked
+
+
+CHAT_MAX_RESULTS = 10
+
+
+def needs_clarification(total, matches):
+    """Whether the chat reply lists the matches for the user to pick one rather than naming the best"""
+    return total > 1 and not matches[0]['score'] - matches[1]['score'] > 0.15
+
+
+def equipment_details(row):
+    """Reply lines with the equipment recorded for a center"""
+    lines = [f"{label}: {row.get(field)}" for field, label in EQUIPMENT_LABELS.items() if row.get(field)]
+    if not lines:
+        return "<br>Machine details aren't available in the system yet. Please contact support if you need an exact count."
+    return "<br>" + "<br>".join(lines) + "<br>Machine counts aren't available in the system yet. Please contact support if you need an exact count."
+
+
+def format_facet_counts(counts):
+    """Reply lines summarizing FacetIndex.counts() of the equipment fields"""
+    return "".join(f"<br>{EQUIPMENT_LABELS[field]}: " + ", ".join(f"{value} ({count})" for value, count in values)
+                   for field, values in counts.items() if values)
+
+
+def format_chat_response(total, matches, query):
+    """Render the reply for ``total`` matches, of which ``matches`` are the best CHAT_MAX_RESULTS"""
+    id_requested = query["id_requested"]
+    code_requested = query["code_requested"]
+    machine_info_requested = query["machine_info_requested"]
+
+    if total == 0:
+        response = "I couldn't find a center matching your description."
+    elif total == 1:
+        # Single match - return it directly
+        best_match = matches[0]['row']
+        response = f"I believe you're referring to **{best_match['nombre']}** in {best_match['poblacion']}.<br>"
+        detail_lines = []
+        if id_requested and not code_requested:
+            detail_lines.append(f"Center ID: {best_match['id_centro']}")
+        elif code_requested and not id_requested:
+            detail_lines.append(f"Center Code: {best_match['codigo']}")
+        else:
+            detail_lines.append(f"Center ID: {best_match['id_centro']}")
+            detail_lines.append(f"Center Code: {best_match['codigo']}")
+        detail_lines.append(f"Location: {best_match['direccion']}")
+        response += "<br>".join(detail_lines)
+        if machine_info_requested:
+            response += equipment_details(best_match)
+    else:
+        # Multiple matches - check if top match is significantly better
+        # If the top match is significantly better (>15% difference), return it
+        if not needs_clarification(total, matches):
+            best_match = matches[0]['row']
+            response = f"I believe you're referring to **{best_match['nombre']}** in {best_match['poblacion']}.<br>"
+            detail_lines = []
+            if id_requested and not code_requested:
+                detail_lines.append(f"Center ID: {best_match['id_centro']}")
+                detail_lines.append(f"Center Code: {best_match['codigo']}")
+            elif code_requested and not id_requested:
+                detail_lines.append(f"Center Code: {best_match['codigo']}")
+                detail_lines.append(f"Center ID: {best_match['id_centro']}")
+            else:
+                detail_lines.append(f"Center ID: {best_match['id_centro']}")
+                detail_lines.append(f"Center Code: {best_match['codigo']}")
+            detail_lines.append(f"Location: {best_match['direccion']}")
+            response += "<br>".join(detail_lines)
+            if machine_info_requested:
+                response += equipment_details(best_match)
+        else:
+            # Multiple similar matches - ask for clarification
+            # Limit to top 10 results to avoid overwhelming the user
+            max_results = CHAT_MAX_RESULTS
+            response = f"I found {total} centers matching your query. "
+            if total > max_results:
+                response += f"Here are the top {max_results}. "
+            response += "Please specify which one you're referring to:<br><br>"
+            
+            for i, match in enumerate(matches[:max_results], 1):
+                row = match['row']
+                line = f"{i}. **{row['nombre']}** – {row['provincia']}"
+                
+                details = []
+                if id_requested and not code_requested:
+                    details.append(f"ID: {row['id_centro']}")
+                elif code_requested and not id_requested:
+                    details.append(f"Code: {row['codigo']}")
+                else:
+                    details.append(f"Code: {row['codigo']}")
+                    details.append(f"ID: {row['id_centro']}")
+                
+                line += f" ({', '.join(details)})<br>"
+                response += line
+
+    return response
+
+
+NO_DATA_RESPONSE = "Sorry, I couldn't get the data."
+EMPTY_QUERY_RESPONSE = "Please specify a center name, city, or province."
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "1000"))
+MAX_SEARCH_LIMIT = 100
+
+
+def query_cache_key(query):
+    return (query["normalized_query"], query["id_requested"], query["code_requested"], query["machine_info_requested"])
+
+
+def resolve_query(query, snapshot):
+    """RankedMatches and rendered chat reply for an analyzed query, through the query cache"""
+    cache_key = query_cache_key(query)
+    cached = query_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    generation = query_cache.generation
+    result = answer_query(query, snapshot)
+    query_cache.put(cache_key, result, generation)
+    return result
+
+
+def answer_query(query, snapshot):
+    """RankedMatches and rendered chat reply for an analyzed query, bypassing the query cache"""
+    equipment = detect_equipment(query, snapshot)
+    if equipment is None:
+        ranked = match_centers(query, snapshot, top_k=max(SHARD_TOP_K, CHAT_MAX_RESULTS))
+    else:
+        within, fields, text_query = equipment
+        ranked = facet_matches(text_query, snapshot, within)
+    trace = metrics.current()
+    started = trace.start()
+    listed = ranked.top(CHAT_MAX_RESULTS)
+    response = format_chat_response(ranked.total, listed, query)
+    if equipment is not None and needs_clarification(ranked.total, listed):
+        response += format_facet_counts(snapshot.facet_index.counts(result_bitmap(ranked), fields))
+    trace.stage("format", started)
+    return ranked, response
+
+
+def detect_equipment(query, snapshot):
+    """(bitmap, equipment fields, text query) of a question about centers with some equipment, else None.
+
+    Only a query with an equipment word ("dryers", "payment central",
+    "brand") is one. Manufacturer and model words ("girbau", "nexa") then
+    select the centers with that equipment, within the kinds of equipment
+    the query names or any kind. A kind alone ("dryers in Barcelona")
+    selects every center with that kind of equipment, but only when nothing
+    but locations is left to match. A named place narrows the bitmap to the
+    centers that match it best, as the text answer would rank them; when
+    none of those has the equipment, the text answer is given instead. The
+    text query keeps the words that remain to be matched, locations
+    included so the named place still scores in facet_matches() (none when
+    the bitmap is the answer).
+    """
+    words = set(query["query_words"])
+    if not words & EQUIPMENT_INTENT_WORDS:
+        return None
+    kind_fields = [field for kind_words, fields in EQUIPMENT_KINDS if words & kind_words for field in fields]
+    facet_index = snapshot.facet_index
+    within, named = 0, set()
+    for field in kind_fields or EQUIPMENT_FIELDS:
+        for key, (_, bits) in list(facet_index.values[field].items()):
+            hits = {word for word in suggest_terms(key) if len(word) > 2 and word not in EQUIPMENT_GENERIC_WORDS}
+            if words & hits:
+                named |= words & hits
+                within |= bits
+    if not named and not kind_fields:
+        return None
+    if not named:
+        within = 0
+        for field in kind_fields:
+            within |= facet_index.any(field)
+
+    location_index = snapshot.location_index
+    location_words = set()
+    for hint_index in (location_index["city"], location_index["province"]):
+        hints = detect_location_candidates(words, query["normalized_query"], hint_index)
+        location_words.update(word for hint in hints for word in hint.split())
+    kind_words = {word for kind_words, _ in EQUIPMENT_KINDS for word in kind_words}
+    remaining = [w for w in query["query_words"]
+                 if w not in named and w not in kind_words and w not in EQUIPMENT_QUERY_WORDS]
+    if not named and any(w not in location_words for w in remaining):
+        # "How many washers does Padilla 239 have": a center question, answered with its equipment
+        return None
+    place = [w for w in remaining if w in location_words]
+    if place:
+        # The location hints are over-inclusive ("Sant Feliu de Llobregat" hints every "... de Llobregat");
+        # keep the centers the place itself matches best
+        located = match_centers(dict(query, query_words=place), snapshot).pool
+        if located:
+            best = max(match['location_score'] for match in located)
+            within &= FacetIndex.bitmap(match['row'].position for match in located
+                                        if match['location_score'] >= best - EQUIPMENT_LOCATION_TOLERANCE)
+        if not within:
+            return None
+    text = len(place) < len(remaining)
+    return within, kind_fields or list(EQUIPMENT_FIELDS), dict(query, query_words=remaining if text else [])
+
+
+def facet_matches(query, snapshot, within):
+    """RankedMatches of an analyzed query among the centers of a FacetIndex bitmap; all of them without query words"""
+    positions = FacetIndex.positions(within)
+    if query["query_words"]:
+        return match_candidates(query, snapshot, positions)
+    records = snapshot.records
+    return RankedMatches([{'row': records[position], 'score': 1.0, 'location_score': 1.0, 'reason': "Facet filter"}
+                          for position in positions], False)
+
+
+def result_bitmap(ranked):
+    """FacetIndex bitmap of every match in a RankedMatches pool"""
+    return FacetIndex.bitmap(match['row'].position for match in ranked.pool)
+
+
+MAX_SESSION_ID_LENGTH = 128
+CHAT_SESSION_CANDIDATES = 100
+ORDINAL_WORDS = {
+    "first": 1, "primero": 1, "primera": 1, "primer": 1,
+    "second": 2, "segundo": 2, "segunda": 2,
+    "third": 3, "tercero": 3, "tercera": 3, "tercer": 3,
+    "fourth": 4, "cuarto": 4, "cuarta": 4,
+    "fifth": 5, "quinto": 5, "quinta": 5,
+    "sixth": 6, "sexto": 6, "sexta": 6,
+    "seventh": 7, "septimo": 7, "septima": 7,
+    "eighth": 8, "octavo": 8, "octava": 8,
+    "ninth": 9, "noveno": 9, "novena": 9,
+    "tenth": 10, "decimo": 10, "decima": 10,
+    "last": -1, "ultimo": -1, "ultima": -1,
+}
+# Words around a pick ("the 2nd one", "option 3", "el segundo") or a narrowing
+# ("the one on Padilla", "Barcelona only") that say nothing about the center itself
+FOLLOW_UP_WORDS = frozenset({
+    "the", "one", "ones", "number", "no", "num", "option", "opcion", "numero", "i", "want", "mean", "meant",
+    "pick", "choose", "that", "this", "it", "is", "please", "por", "favor", "el", "la", "lo", "de", "del", "en", "on", "in",
+    "at", "only", "just", "solo", "solamente", "which", "with", "con", "st", "nd", "rd", "th", "o", "a", "er",
+})
+
+
+def ordinal_choice(message, listed):
+    """1-based pick among ``listed`` options when the message is only an ordinal ("the second one", "3"), else None"""
+    folded = unicodedata.normalize("NFKD", message.lower()).encode("ascii", "ignore").decode()
+    words = [w for w in re.findall(r"[a-z]+|[0-9]+", folded) if w not in FOLLOW_UP_WORDS]
+    if len(words) != 1:
+        return None
+    word = words[0]
+    choice = int(word) if word.isdigit() else ORDINAL_WORDS.get(word)
+    if choice == -1:
+        choice = listed
+    return choice if choice is not None and 1 <= choice <= listed else None
+
+
+def match_candidates(query, snapshot, positions):
+    """RankedMatches of an analyzed query over only the records at ``positions``"""
+    query_tokens = set(query["query_words"])
+    location_index = snapshot.location_index
+    city_hints = detect_location_candidates(query_tokens, query["normalized_query"], location_index["city"])
+    province_hints = detect_location_candidates(query_tokens, query["normalized_query"], location_index["province"])
+    matches = collect_matches(query, snapshot, snapshot.search_index, city_hints, province_hints,
+                              positions=frozenset(positions))
+    return RankedMatches([match for _, match in matches], bool(city_hints or province_hints))
+
+
+def resolve_follow_up(query, message, session, snapshot):
+    """(ranked, listed matches, reply query) answering ``message`` within a chat session, None when it is a new query.
+
+    An ordinal picks one of the centers listed in the previous reply; any
+    other message re-scores only the previous candidates. A message that
+    matches none of them, or all of them, does not narrow anything and is
+    answered as a new query. The reply keeps the ID / code / machine intent
+    of the original question.
+    """
+    reply_query = dict(query)
+    for flag, requested in session["flags"].items():
+        reply_query[flag] = reply_query[flag] or requested
+    choice = ordinal_choice(message, len(session["listed"]))
+    if choice is not None:
+        picked = {"row": snapshot.records[session["listed"][choice - 1]], "score": 1.0}
+        return None, [picked], reply_query
+    narrowed = dict(query, query_words=[w for w in query["query_words"] if w not in FOLLOW_UP_WORDS])
+    if not narrowed["query_words"]:
+        return None
+    ranked = match_candidates(narrowed, snapshot, session["candidates"])
+    if not 0 < ranked.total < len(session["candidates"]):
+        return None
+    return ranked, ranked.top(CHAT_MAX_RESULTS), reply_query
+
+
+def remember_chat_session(session_id, query, ranked, listed, snapshot, generation):
+    """Keep the listed centers and the wider candidate set for the session's next message"""
+    ranked = ensure_ranked(ranked, query, snapshot, CHAT_SESSION_CANDIDATES)
+    chat_sessions.put(session_id, {
+        "version": snapshot.version,
+        "listed": [match['row'].position for match in listed],
+        "candidates": [match['row'].position for match in ranked.top(CHAT_SESSION_CANDIDATES)],
+        "flags": {flag: query[flag] for flag in ("id_requested", "code_requested", "machine_info_requested")},
+    }, generation)
+
+
+def serialize_match(match):
+    """JSON-friendly view of a ranked match"""
+    row = match['row']
+    return {
+        "codigo": row['codigo'],
+        "id_centro": row['id_centro'],
+        "nombre": row['nombre'],
+        "direccion": row['direccion'],
+        "poblacion": row['poblacion'],
+        "provincia": row['provincia'],
+        "score": match['score'],
+        "location_score": match['location_score'],
+        "reason": match['reason'],
+    }
+
+
+def search(query, snapshot, limit, offset=0, origin=None, within=None, facets=False):
+    """(total, page, facet counts or None) of ranked matches for an analyzed query.
+
+    With an ``origin`` (lat, lon), comparably good matches are ordered
+    nearest first. ``within``, a FacetIndex bitmap, restricts the matches
+    to its centers (and lists them all when the query has no words);
+    ``facets`` counts the values of every facet field over all matches.
+    """
+    if within is not None:
+        ranked = facet_matches(query, snapshot, within)
+    else:
+        ranked, _ = resolve_query(query, snapshot)
+        ranked = ensure_ranked(ranked, query, snapshot, None if origin is not None or facets else offset + limit)
+    counts = None
+    if facets:
+        counts = snapshot.facet_index.counts(within if not query["query_words"] else result_bitmap(ranked))
+    if origin is not None:
+        return ranked.total, rerank_by_distance(ranked, snapshot, *origin, limit=offset + limit)[offset:], counts
+    return ranked.total, ranked.top(limit, offset), counts
+
+
+BULK_FORMATS = ("ndjson", "csv")
+BULK_CHUNK_SIZE = 256
+# Upper bound on the process pool /admin/bulk-match may start inside a web worker
+BULK_MAX_WORKERS = int(os.environ.get("BULK_MAX_WORKERS", "1"))
+
+
+def bulk_query_text(row, field=None):
+    """Query text of one bulk input row: ``row[field]``, or every non-empty value joined when no field is given"""
+    if isinstance(row, str):
+        return row
+    if not isinstance(row, dict):
+        raise ValueError("expected a JSON object or string")
+    if field:
+        value = row.get(field)
+        if not isinstance(value, str):
+            raise ValueError(f"missing text field '{field}'")
+        return value
+    return " ".join(str(value) for value in row.values() if isinstance(value, (str, int, float)) and str(value).strip())
+
+
+def read_bulk_rows(lines, fmt="ndjson", field=None):
+    """Lazily turn NDJSON or CSV lines into (line number, query text, error) triples.
+
+    Rows are parsed one at a time, so arbitrarily large inputs are never held
+    in memory. A malformed row yields an error instead of stopping the stream.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            try:
+                yield reader.line_num, bulk_query_text(row, field), None
+            except ValueError as e:
+                yield reader.line_num, None, str(e)
+        return
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, bulk_query_text(json.loads(line), field), None
+        except ValueError as e:
+            yield line_number, None, str(e)
+
+
+def match_bulk_row(line_number, text, error, snapshot):
+    """Best center for one bulk row as a JSON-friendly dict"""
+    result = {"line": line_number, "query": text, "codigo": None, "id_centro": None,
+              "score": None, "reason": None, "total_matches": 0}
+    if error is not None:
+        result["error"] = error
+        return result
+    query = analyze_query(text)
+    if not snapshot.records or not query["query_words"]:
+        return result
+    # Straight to the matcher: one-off bulk rows would only churn the query cache
+    ranked = match_centers(query, snapshot, top_k=1)
+    best = ranked.top(1)
+    if best:
+        row = best[0]['row']
+        result.update(codigo=row['codigo'], id_centro=row['id_centro'], score=best[0]['score'],
+                      reason=best[0]['reason'], total_matches=ranked.total)
+    return result
+
+
+_bulk_snapshot = None  # the snapshot a bulk_match() pool process scores against (see _init_bulk_worker())
+
+
+def _init_bulk_worker(snapshot):
+    # The pool is forked, so the snapshot is inherited rather than pickled
+    global _bulk_snapshot
+    _bulk_snapshot = snapshot
+
+
+def _match_bulk_chunk(chunk, snapshot=None):
+    # Runs in pool processes too, where the snapshot pinned by _init_bulk_worker() is used
+    if snapshot is None:
+        snapshot = _bulk_snapshot if _bulk_snapshot is not None else dataset
+    return [match_bulk_row(line_number, text, error, snapshot) for line_number, text, error in chunk]
+
+
+def bulk_match(rows, snapshot=None, workers=1, chunk_size=BULK_CHUNK_SIZE):
+    """Generator pipeline matching (line number, text, error) rows, in input order.
+
+    Rows are pulled in chunks of ``chunk_size``. With ``workers`` > 1 the
+    chunks are scored by a process pool, keeping at most two chunks per
+    process in flight, so memory stays bounded by the window rather than
+    the input size. Pool processes are forked with ``snapshot`` pinned, so
+    they score against it rather than their module-level dataset.
+    """
+    if snapshot is None:
+        snapshot = dataset
+    chunks = iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+    if workers <= 1:
+        for chunk in chunks:
+            yield from _match_bulk_chunk(chunk, snapshot)
+        return
+    with multiprocessing.get_context("fork").Pool(workers, initializer=_init_bulk_worker,
+                                                  initargs=(snapshot,)) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.apply_async(_match_bulk_chunk, (chunk,)))
+            if len(in_flight) >= 2 * workers:
+                yield from in_flight.popleft().get()
+        while in_flight:
+            yield from in_flight.popleft().get()
+
+
+@app.before_request
+def start_request_trace():
+    metrics.begin()
+
+
+@app.before_request
+def follow_reload_announcements():
+    """Catch up with a reload or center change another worker announced.
+
+    A full reload is rebuilt in the background (follow_reload_in_background())
+    while this request is served from the current snapshot; center changes
+    are cheap and applied before serving.
+    """
+    if reload_generation.value != reload_status["generation"]:
+        follow_reload_in_background()
+    elif change_generation.value != reload_status["change_generation"]:
+        follow_change_log()
+
+
+@app.teardown_request
+def finish_request_trace(exc):
+    metrics.finish(request.endpoint or "unmatched", query_cache.stats() if metrics.directory else None)
+
+
+@app.route('/api/search', methods=['GET', 'POST'])
+def search_api():
+    """Structured search: ranked centers with scores and match reasons, paginated by limit/offset.
+
+    Facet field parameters (fabricante_secadoras=girbau, provincia=madrid, ...)
+    restrict the results to the centers with those values, and facets=1
+    adds the value counts of every facet field over all results.
+    """
+    params = request.args if request.method == 'GET' else (request.get_json(silent=True) or {})
+    if not isinstance(params, dict):
+        return jsonify({"error": "body must be a JSON object"}), 400
+    message = params.get('q', params.get('message', ''))
+    try:
+        if not isinstance(message, str):
+            raise ValueError("'q' must be a string")
+        limit = int(params.get('limit', 10))
+        offset = int(params.get('offset', 0))
+        origin = parse_origin(params)
+        filters = parse_facet_filters(params)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if not 1 <= limit <= MAX_SEARCH_LIMIT or offset < 0:
+        return jsonify({"error": f"'limit' must be between 1 and {MAX_SEARCH_LIMIT} and 'offset' non-negative"}), 400
+
+    snapshot = dataset
+    query = analyze_query(message)
+    within = snapshot.facet_index.filter(filters) if filters else None
+    facets = str(params.get('facets', '')).lower() in ("1", "true", "yes")
+    total, matches, counts = 0, [], None
+    if snapshot.records and (query["query_words"] or within is not None):
+        total, matches, counts = search(query, snapshot, limit, offset, origin, within, facets)
+    results = []
+    for rank, match in enumerate(matches, offset + 1):
+        result = serialize_match(match)
+        result["rank"] = rank
+        if 'distance_km' in match:
+            result["distance_km"] = match['distance_km']
+        results.append(result)
+    return jsonify({
+        "query": message,
+        "normalized_query": query["normalized_query"],
+        "intent": {
+            "id_requested": query["id_requested"],
+            "code_requested": query["code_requested"],
+            "machine_info_requested": query["machine_info_requested"],
+        },
+        "dataset_version": snapshot.version,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "results": results,
+        **({"facets": {field: [{"value": value, "count": count} for value, count in values]
+                       for field, values in (counts or {}).items()}} if facets else {}),
+    })
+
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """Chat reply for a message.
+
+    With a ``session_id``, a reply that lists several centers is remembered
+    for a while, and the next message of the session ("the second one",
+    "the one on Padilla", "Barcelona only") is resolved against those
+    centers instead of the whole dataset.
+    """
+    user_message = request.json.get('message', '')
+    session_id = request.json.get('session_id')
+    if session_id is not None and (not isinstance(session_id, str)
+                                   or not 0 < len(session_id) <= MAX_SESSION_ID_LENGTH):
+        return jsonify({"error": f"'session_id' must be a string of 1 to {MAX_SESSION_ID_LENGTH} characters"}), 400
+    
+    snapshot = dataset
+    if not snapshot.records:
+        return jsonify({"response": NO_DATA_RESPONSE})
+
+    query = analyze_query(user_message)
+    if not query["query_words"]:
+        return jsonify({"response": EMPTY_QUERY_RESPONSE})
+
+    try:
+        origin = parse_origin(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if session_id is None:
+        ranked, response = resolve_query(query, snapshot)
+        if origin is not None:
+            # Among comparably good matches, prefer the centers nearest to the user
+            ranked = ensure_ranked(ranked, query, snapshot)
+            nearest_first = rerank_by_distance(ranked, snapshot, *origin, limit=CHAT_MAX_RESULTS)
+            response = format_chat_response(ranked.total, nearest_first, query)
+        return jsonify({"response": response})
+
+    generation = chat_sessions.generation
+    session = chat_sessions.get(session_id)
+    follow_up = None
+    if session is not None and session["version"] == snapshot.version:
+        follow_up = resolve_follow_up(query, user_message, session, snapshot)
+    if follow_up is None:
+        ranked, response = resolve_query(query, snapshot)
+        listed, reply_query = ranked.top(CHAT_MAX_RESULTS), query
+    else:
+        ranked, listed, reply_query = follow_up
+        if ranked is None:
+            # An ordinal pick answers with that one center and ends the clarification
+            chat_sessions.discard(session_id)
+            return jsonify({"response": format_chat_response(1, listed, reply_query), "session_id": session_id})
+        response = format_chat_response(ranked.total, listed, reply_query)
+    if origin is not None:
+        ranked = ensure_ranked(ranked, reply_query, snapshot)
+        listed = rerank_by_distance(ranked, snapshot, *origin, limit=CHAT_MAX_RESULTS)
+        response = format_chat_response(ranked.total, listed, reply_query)
+    if needs_clarification(ranked.total, listed):
+        remember_chat_session(session_id, reply_query, ranked, listed, snapshot, generation)
+    else:
+        chat_sessions.discard(session_id)
+    return jsonify({"response": response, "session_id": session_id})
+
+
+@app.route('/api/suggest', methods=['GET'])
+def suggest():
+    """Typeahead completions of a partially typed center code, name, street or city"""
+    text = request.args.get('q', '')
+    kind = request.args.get('kind') or None
+    try:
+        limit = int(request.args.get('limit', 8))
+    except ValueError:
+        return jsonify({"error": "'limit' must be an integer"}), 400
+    if not 1 <= limit <= SUGGEST_MAX_LIMIT:
+        return jsonify({"error": f"'limit' must be between 1 and {SUGGEST_MAX_LIMIT}"}), 400
+    if kind is not None and kind not in SUGGEST_KINDS:
+        return jsonify({"error": f"'kind' must be one of {', '.join(SUGGEST_KINDS)}"}), 400
+    fuzzy = request.args.get('fuzzy', '').lower() in ("1", "true", "yes")
+
+    snapshot = dataset
+    trace = metrics.current()
+    started = trace.start()
+    suggestions = []
+    for (entry_kind, display, _, weight, position), edited in snapshot.suggest_index.complete(
+            suggest_prefix(text), limit, kind, fuzzy):
+        suggestion = {"kind": entry_kind, "text": display, "fuzzy": edited}
+        if position is None:
+            suggestion["centers"] = weight
+        else:
+            row = snapshot.records[position]
+            suggestion.update(codigo=row['codigo'], id_centro=row['id_centro'], nombre=row['nombre'],
+                              poblacion=row['poblacion'])
+        suggestions.append(suggestion)
+    trace.stage("suggest", started)
+    return jsonify({"query": text, "suggestions": suggestions})
+
+
+def parse_facet_filters(params):
+    """{field: [values]} of the FACET_FIELDS given as request parameters (repeat one to accept any of its values)"""
+    filters = {}
+    for field in FACET_FIELDS:
+        values = params.getlist(field) if hasattr(params, "getlist") else params.get(field)
+        if values is None or values == []:
+            continue
+        if isinstance(values, str):
+            values = [values]
+        if not isinstance(values, list) or not all(isinstance(value, str) and value.strip() for value in values):
+            raise ValueError(f"'{field}' must be a non-empty string or a list of them")
+        filters[field] = values
+    return filters
+
+
+def parse_origin(params):
+    """(lat, lon) from request parameters, None when absent; ValueError when invalid"""
+    if params.get('lat') is None and params.get('lon') is None:
+        return None
+    latitude = parse_coordinate(params.get('lat'), 90.0)
+    longitude = parse_coordinate(params.get('lon'), 180.0)
+    if latitude is None or longitude is None:
+        raise ValueError("'lat' and 'lon' must be valid coordinates")
+    return latitude, longitude
+
+
+@app.route('/api/nearest', methods=['GET'])
+def nearest():
+    """Nearest centers to a point, optionally limited to a radius in km"""
+    try:
+        origin = parse_origin(request.args)
+        if origin is None:
+            raise ValueError("'lat' and 'lon' are required")
+        k = int(request.args.get('k', 5))
+        radius_km = request.args.get('radius_km')
+        radius_km = float(radius_km) if radius_km is not None else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not 1 <= k <= 100 or (radius_km is not None and not radius_km > 0):
+        return jsonify({"error": "'k' must be between 1 and 100 and 'radius_km' positive"}), 400
+
+    snapshot = dataset
+    results = []
+    for position, distance in snapshot.geo_index.query(*origin, k=k, radius_km=radius_km):
+        row = snapshot.records[position]
+        latitude, longitude = snapshot.geo_index.coordinates(position)
+        results.append({
+            "codigo": row['codigo'],
+            "id_centro": row['id_centro'],
+            "nombre": row['nombre'],
+            "direccion": row['direccion'],
+            "poblacion": row['poblacion'],
+            "provincia": row['provincia'],
+            "latitud": latitude,
+            "longitud": longitude,
+            "distance_km": round(distance, 3),
+        })
+    return jsonify({"results": results})
+
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """Resolve many messages in one call.
+
+    The whole batch is scored against one snapshot, identical normalized
+    queries are scored once, and per-token candidate, fuzzy and phonetic
+    lookups are memoized on the snapshot's index so queries share them.
+    Batch items skip the shared query cache: one large batch of one-off
+    messages would otherwise evict the entries interactive chat relies on.
+    """
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "body must be a JSON object"}), 400
+    messages = payload.get('messages')
+    if not isinstance(messages, list) or not all(isinstance(m, str) for m in messages):
+        return jsonify({"error": "'messages' must be a list of strings"}), 400
+    if len(messages) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} messages per batch"}), 400
+    try:
+        top = max(0, min(int(payload.get('top', 3)), 10))
+    except (TypeError, ValueError):
+        return jsonify({"error": "'top' must be an integer"}), 400
+
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    snapshot = dataset
+    resolved = {}
+    results = []
+    for message in messages:
+        if not snapshot.records:
+            results.append({"message": message, "response": NO_DATA_RESPONSE, "total_matches": 0, "matches": []})
+            continue
+        query = analyze_query(message)
+        if not query["query_words"]:
+            results.append({"message": message, "response": EMPTY_QUERY_RESPONSE, "total_matches": 0, "matches": []})
+            continue
+        cache_key = query_cache_key(query)
+        if cache_key not in resolved:
+            resolved[cache_key] = answer_query(query, snapshot)
+        ranked, response = resolved[cache_key]
+        results.append({
+            "message": message,
+            "response": response,
+            "total_matches": ranked.total,
+            "matches": [serialize_match(m) for m in ranked.top(top)],
+        })
+
+    elapsed = time.perf_counter() - started
+    cpu = time.thread_time() - cpu_started
+    return jsonify({
+        "results": results,
+        "stats": {
+            "queries": len(messages),
+            "unique_queries": len(resolved),
+            "elapsed_ms": round(elapsed * 1000, 2),
+            # The batch runs on the request thread: its CPU time is one core's share
+            "cpu_ms": round(cpu * 1000, 2),
+            "queries_per_cpu_second": round(len(messages) / cpu, 1) if cpu > 0 else None,
+            "dataset_version": snapshot.version,
+        },
+    })
+
+
+def _admin_authorized():
+    """Admin endpoints require ADMIN_TOKEN to be configured and sent as X-Admin-Token"""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    if not _admin_authorized():
+        return jsonify({"error": "forbidden"}), 403
+    if not load_data():
+        return jsonify({"status": "error", "error": reload_status["last_error"], "dataset": dataset_status()}), 500
+    announce_reload()
+    return jsonify({"status": "reloaded", "dataset": dataset_status()})
+
+
+@app.route('/admin/centers', methods=['PUT'])
+def admin_upsert_center():
+    """Add a center, or replace the one with the same id_centro (else codigo), without a full reload"""
+    if not _admin_authorized():
+        return jsonify({"error": "forbidden"}), 403
+    center = request.get_json(silent=True)
+    error = center_error(center)
+    if error:
+        return jsonify({"error": error}), 400
+    with change_log_lock():
+        follow_change_log()
+        try:
+            position = dataset.match_center(center)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 409
+        append_change({"op": "upsert", "center": center})
+        follow_change_log()
+    created = position is None
+    return jsonify({"status": "created" if created else "updated", "dataset": dataset_status()}), 201 if created else 200
+
+
+@app.route('/admin/centers/<path:key>', methods=['DELETE'])
+def admin_delete_center(key):
+    """Remove the center with this id_centro (else codigo), without a full reload"""
+    if not _admin_authorized():
+        return jsonify({"error": "forbidden"}), 403
+    with change_log_lock():
+        follow_change_log()
+        positions = dataset.find(key)
+        if len(positions) != 1:
+            return (jsonify({"error": f"{key!r} matches {len(positions)} centers"}),
+                    404 if not positions else 409)
+        append_change({"op": "delete", "key": key})
+        follow_change_log()
+    return jsonify({"status": "deleted", "dataset": dataset_status()})
+
+
+@app.route('/admin/centers/compact', methods=['POST'])
+def admin_compact_centers():
+    """Fold the change log into the centers file, then reload it everywhere"""
+    if not _admin_authorized():
+        return jsonify({"error": "forbidden"}), 403
+    folded = compact_change_log()
+    if folded and not load_data():
+        return jsonify({"status": "error", "error": reload_status["last_error"], "dataset": dataset_status()}), 500
+    if folded:
+        announce_reload()
+    return jsonify({"status": "compacted", "changes": folded, "dataset": dataset_status()})
+
+
+@app.route('/admin/bulk-match', methods=['POST'])
+def admin_bulk_match():
+    """Stream-match an NDJSON or CSV upload, answering with one NDJSON result per input row"""
+    if not _admin_authorized():
+        return jsonify({"error": "forbidden"}), 403
+    fmt = request.args.get('format') or ("csv" if request.mimetype == "text/csv" else "ndjson")
+    if fmt not in BULK_FORMATS:
+        return jsonify({"error": f"'format' must be one of {', '.join(BULK_FORMATS)}"}), 400
+    try:
+        workers = max(1, min(int(request.args.get('workers', 1)), BULK_MAX_WORKERS))
+    except ValueError:
+        return jsonify({"error": "'workers' must be an integer"}), 400
+
+    rows = read_bulk_rows(io.TextIOWrapper(request.stream, encoding="utf-8", newline=""),
+                          fmt, request.args.get('field'))
+    results = bulk_match(rows, dataset, workers)
+    return Response(stream_with_context(json.dumps(result, ensure_ascii=False) + "\n" for result in results),
+                    mimetype="application/x-ndjson")
+
+
+def dataset_status():
+    snapshot = dataset
+    return {
+        "version": snapshot.version,
+        "source": snapshot.source,
+        "centers": len(snapshot),
+        "changes": snapshot.changes,
+        "loaded_at": snapshot.loaded_at,
+        "build_ms": round(snapshot.build_seconds * 1000, 2),
+        "reloads": reload_status["reloads"],
+        "last_reload_error": reload_status["last_error"],
+    }
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({
+        "status": "healthy",
+        "service": "lawash-tool",
+        "dataset": dataset_status(),
+        "cache": query_cache.stats(),
+        "sessions": chat_sessions.stats(),
+        "process": process_memory(),
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of the request, stage and comparison metrics of every worker (see METRICS_DIR)"""
+    if not metrics.enabled:
+        return jsonify({"error": "metrics are disabled"}), 404
+    return Response(metrics.render(query_cache.stats()), mimetype="text/plain; version=0.0.4")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lawash center assistant")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("serve", help="Run the development server on port 3000 (default)")
+    build = commands.add_parser("build-index", help="Prebuild the normalized, indexed dataset for fast startup")
+    build.add_argument("--data", default=DATA_FILE, help="Centers JSON file (default: %(default)s)")
+    build.add_argument("--output", help="Index file to write (default: CENTERS_INDEX_FILE or <data>.idx)")
+    compact = commands.add_parser("compact", help="Fold the center change log into the centers file")
+    compact.add_argument("--data", default=DATA_FILE, help="Centers JSON file (default: %(default)s)")
+    bulk = commands.add_parser("bulk-match", help="Match every row of an NDJSON or CSV file, writing NDJSON")
+    bulk.add_argument("input", help="NDJSON or CSV file, or - for stdin")
+    bulk.add_argument("--output", default="-", help="NDJSON file to write, or - for stdout (default)")
+    bulk.add_argument("--format", choices=BULK_FORMATS, help="Input format (default: from the file extension, else ndjson)")
+    bulk.add_argument("--field", help="Column or key holding the query text (default: all values joined)")
+    bulk.add_argument("--workers", type=int, default=1, help="Processes used for scoring (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.command == "build-index":
+        output = args.output or index_file_for(args.data)
+        snapshot = build_index(args.data, output)
+        print(f"Wrote {output}: {len(snapshot.records)} centers, version {snapshot.version}, "
+              f"{os.path.getsize(output)} bytes, built in {snapshot.build_seconds * 1000:.1f} ms")
+        return 0
+    if args.command == "compact":
+        folded = compact_change_log(args.data)
+        print(f"Folded {folded} changes from {change_log_for(args.data)} into {args.data}")
+        return 0
+    if args.command == "bulk-match":
+        fmt = args.format or ("csv" if args.input.lower().endswith(".csv") else "ndjson")
+        source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8", newline="")
+        target = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+        try:
+            for result in bulk_match(read_bulk_rows(source, fmt, args.field), workers=args.workers):
+                target.write(json.dumps(result, ensure_ascii=False) + "\n")
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if target is not sys.stdout:
+                target.close()
+        return 0
+    start_shard_pool()
+    app.run(host='0.0.0.0', port=3000)
+    return 0
+
+
+if __name__ == '__main__':
+    # Run through the importable module so pickled index classes resolve to app.*, not __main__.*
+    import app as app_module
+    sys.exit(app_module.main())
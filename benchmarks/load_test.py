@@ -0,0 +1,313 @@
+"""Closed-loop load test of the Gunicorn deployment on this machine.
+
+For every combination of --workers and --threads it starts gunicorn.conf.py
+on a free local port, then for every --concurrency level keeps that many
+requests in flight (spread over --client-processes processes, so the load
+generator is not held back by its own GIL) for --duration seconds after a
+--warmup. Requests are drawn from a mix of chat, search, suggest and nearest
+calls built from centers.json. Each configuration reports throughput,
+latency percentiles, error and timeout rates and, from /proc, the CPU use
+and memory of every worker. Where more concurrency stops adding throughput,
+the configuration is marked as saturated. Linux only.
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --workers 1,2,4 --threads 1,2,4 --concurrency 1,4,16,32
+    python benchmarks/load_test.py --mix chat=1 --no-cache --duration 20 --output load.json
+
+The load generator shares the machine with the server, so compare runs made
+on the same host and keep --client-processes well below the core count.
+"""
+import argparse
+import concurrent.futures
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+
+from worker_memory import child_pids, free_port, smaps_rollup, wait_until_ready
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DATA_FILE = os.path.join(PROJECT_ROOT, "centers.json")
+ENDPOINTS = ("chat", "search", "suggest", "nearest")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+# A concurrency step that adds less throughput than this is past the saturation point
+SATURATION_GAIN = 0.10
+
+
+def parse_counts(text):
+    return [int(value) for value in text.split(",") if value.strip()]
+
+
+def parse_mix(text):
+    """{"chat": 0.7, ...} from "chat=7,search=2,suggest=1"; weights are normalized"""
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}, expected one of {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("the mix needs a positive weight")
+    return {name: weight / total for name, weight in weights.items()}
+
+
+def make_typo(text, rng):
+    """``text`` with two adjacent letters of one longer word swapped"""
+    words = text.split()
+    candidates = [i for i, word in enumerate(words) if len(word) > 4 and word.isalpha()]
+    if not candidates:
+        return text
+    i = rng.choice(candidates)
+    j = rng.randrange(1, len(words[i]) - 2)
+    word = words[i]
+    words[i] = word[:j] + word[j + 1] + word[j] + word[j + 2:]
+    return " ".join(words)
+
+
+def chat_messages(center, rng):
+    code, nombre, direccion = center.get("codigo"), center.get("nombre"), center.get("direccion")
+    poblacion, provincia = center.get("poblacion"), center.get("provincia")
+    messages = [f"{direccion} in {poblacion}", make_typo(f"{nombre} {poblacion}", rng), f"centers in {poblacion}"]
+    if code:
+        messages.append(f"center id for code {code}")
+    if center.get("fabricante_secadoras"):
+        messages.append(f"{center['fabricante_secadoras'].split()[0].strip(',')} dryers in {provincia}")
+    return [message for message in messages if "None" not in message]
+
+
+def coordinates(center):
+    """(lat, lon) of a center, None when missing or out of range (some rows carry placeholders)"""
+    try:
+        latitude, longitude = float(center["latitud"]), float(center["longitud"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (latitude, longitude) if abs(latitude) <= 90 and abs(longitude) <= 180 else None
+
+
+def build_requests(centers, mix, count, seed=7):
+    """``count`` (endpoint, method, path, body) requests in ``mix`` proportions, shuffled"""
+    rng = random.Random(seed)
+    centers = [center for center in centers if center.get("nombre") and center.get("poblacion")]
+    located = [center for center in centers if coordinates(center)]
+    requests = []
+    for endpoint, share in mix.items():
+        for _ in range(round(count * share)):
+            center = rng.choice(centers)
+            if endpoint == "chat":
+                body = {"message": rng.choice(chat_messages(center, rng))}
+                requests.append((endpoint, "POST", "/api/chat", json.dumps(body).encode()))
+            elif endpoint == "search":
+                query = {"q": f"{center['direccion']} {center['poblacion']}", "limit": 10}
+                requests.append((endpoint, "GET", "/api/search?" + urllib.parse.urlencode(query), None))
+            elif endpoint == "suggest":
+                prefix = center["nombre"][:rng.randint(2, 8)]
+                requests.append((endpoint, "GET", "/api/suggest?" + urllib.parse.urlencode({"q": prefix}), None))
+            else:
+                latitude, longitude = coordinates(rng.choice(located))
+                query = {"lat": round(latitude + rng.uniform(-0.05, 0.05), 5),
+                         "lon": round(longitude + rng.uniform(-0.05, 0.05), 5), "k": 5}
+                requests.append((endpoint, "GET", "/api/nearest?" + urllib.parse.urlencode(query), None))
+    rng.shuffle(requests)
+    return requests
+
+
+def run_client(task):
+    """Keep ``threads`` requests in flight until ``stop_at``; [(endpoint, seconds, outcome)] of those after ``measure_from``"""
+    port, requests, threads, measure_from, stop_at, timeout, seed = task
+
+    def loop(thread):
+        rng = random.Random(seed * 1000 + thread)
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+        samples = []
+        while time.time() < stop_at:
+            endpoint, method, path, body = rng.choice(requests)
+            started = time.time()
+            try:
+                connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+                response = connection.getresponse()
+                response.read()
+                outcome = "ok" if response.status < 400 else "error"
+                if response.getheader("Connection", "").lower() == "close":
+                    connection.close()
+            except socket.timeout:
+                outcome = "timeout"
+                connection.close()
+            except (OSError, http.client.HTTPException):
+                outcome = "error"
+                connection.close()
+                time.sleep(0.01)
+            if started >= measure_from:
+                samples.append((endpoint, time.time() - started, outcome))
+        connection.close()
+        return samples
+
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        return [sample for samples in pool.map(loop, range(threads)) for sample in samples]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted ``values``"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of stat; the split starts at field 3
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def summarize(samples, elapsed, cpu_before, cpu_after, memory):
+    latencies = sorted(seconds for _, seconds, outcome in samples if outcome == "ok")
+    outcomes = [outcome for _, _, outcome in samples]
+    count = max(len(samples), 1)
+    per_worker = {
+        pid: {"cpu_percent": round((cpu_after[pid] - cpu_before[pid]) / elapsed * 100, 1),
+              "rss_mb": round(memory[pid]["rss_kb"] / 1024, 1), "pss_mb": round(memory[pid]["pss_kb"] / 1024, 1)}
+        for pid in cpu_before if pid in cpu_after and pid in memory
+    }
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(outcomes.count("ok") / elapsed, 1),
+        "p50_ms": _ms(percentile(latencies, 0.50)),
+        "p95_ms": _ms(percentile(latencies, 0.95)),
+        "p99_ms": _ms(percentile(latencies, 0.99)),
+        "max_ms": _ms(latencies[-1] if latencies else None),
+        "error_rate": round(outcomes.count("error") / count, 4),
+        "timeout_rate": round(outcomes.count("timeout") / count, 4),
+        "p95_ms_by_endpoint": {endpoint: _ms(percentile(sorted(s for e, s, o in samples if e == endpoint and o == "ok"), 0.95))
+                        for endpoint in sorted({e for e, _, _ in samples})},
+        "per_worker": per_worker,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def mark_saturation(results):
+    """Flag, per workers x threads, the first concurrency whose step up added under SATURATION_GAIN throughput"""
+    by_config = {}
+    for result in results:
+        by_config.setdefault((result["workers"], result["threads"]), []).append(result)
+    for runs in by_config.values():
+        runs.sort(key=lambda r: r["concurrency"])
+        for previous, current in zip(runs, runs[1:]):
+            gain = current["throughput_rps"] / previous["throughput_rps"] - 1 if previous["throughput_rps"] else 0
+            if gain < SATURATION_GAIN:
+                previous["saturated"] = True
+                break
+    return results
+
+
+def run_configuration(args, requests, workers, threads):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, GUNICORN_BIND=f"127.0.0.1:{port}", GUNICORN_WORKERS=str(workers),
+               GUNICORN_THREADS=str(threads), METRICS_ENABLED="1" if args.metrics else "0")
+    if args.no_cache:
+        env["QUERY_CACHE_SIZE"] = "0"
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "app:app"],
+                              cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = []
+    try:
+        wait_until_ready(base_url, server, args.startup_timeout)
+        while len(child_pids(server.pid)) < workers:
+            time.sleep(0.2)
+        for concurrency in args.concurrency:
+            processes = max(1, min(args.client_processes, concurrency))
+            start = time.time()
+            measure_from, stop_at = start + args.warmup, start + args.warmup + args.duration
+            tasks = [(port, requests, concurrency // processes + (i < concurrency % processes),
+                      measure_from, stop_at, args.timeout, i) for i in range(processes)]
+            pids = child_pids(server.pid)
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                pending = pool.map_async(run_client, tasks)
+                time.sleep(max(0.0, measure_from - time.time()))
+                cpu_before = {pid: cpu_seconds(pid) for pid in pids}
+                measured = time.time()
+                time.sleep(max(0.0, stop_at - time.time()))
+                cpu_after = {pid: cpu_seconds(pid) for pid in child_pids(server.pid)}
+                elapsed = time.time() - measured
+                memory = {pid: smaps_rollup(pid) for pid in cpu_after}
+                samples = [sample for client in pending.get() for sample in client]
+            result = {"workers": workers, "threads": threads, "concurrency": concurrency,
+                      **summarize(samples, elapsed, cpu_before, cpu_after, memory)}
+            results.append(result)
+            report(result)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+    return results
+
+
+def report(result):
+    print(f"workers={result['workers']} threads={result['threads']} concurrency={result['concurrency']}: "
+          f"{result['throughput_rps']} req/s, p99 {result['p99_ms']} ms, "
+          f"{result['error_rate']:.2%} errors, {result['timeout_rate']:.2%} timeouts", file=sys.stderr)
+
+
+def print_table(results):
+    print(f"{'workers':>7} {'threads':>7} {'conc':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+          f"{'err%':>6} {'tmo%':>6} {'cpu%/w':>12} {'rss MB/w':>9}")
+    for r in results:
+        cpu = [w["cpu_percent"] for w in r["per_worker"].values()]
+        rss = [w["rss_mb"] for w in r["per_worker"].values()]
+        print(f"{r['workers']:>7} {r['threads']:>7} {r['concurrency']:>5} {r['throughput_rps']:>8} "
+              f"{r['p50_ms'] or '-':>8} {r['p95_ms'] or '-':>8} {r['p99_ms'] or '-':>8} "
+              f"{r['error_rate'] * 100:>6.2f} {r['timeout_rate'] * 100:>6.2f} "
+              f"{(f'{sum(cpu) / len(cpu):.0f} (max {max(cpu):.0f})' if cpu else '-'):>12} "
+              f"{(f'{sum(rss) / len(rss):.1f}' if rss else '-'):>9}"
+              f"{'  <- saturated' if r.get('saturated') else ''}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=parse_counts, default=[1, 2, 4], help="worker counts (default: 1,2,4)")
+    parser.add_argument("--threads", type=parse_counts, default=[1, 2], help="threads per worker (default: 1,2)")
+    parser.add_argument("--concurrency", type=parse_counts, default=[1, 4, 16],
+                        help="requests kept in flight (default: 1,4,16)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=6,search=2,suggest=1,nearest=1"),
+                        help="endpoint weights (default: chat=6,search=2,suggest=1,nearest=1)")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per level")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each level")
+    parser.add_argument("--timeout", type=float, default=10.0, help="client timeout per request in seconds")
+    parser.add_argument("--distinct", type=int, default=2000, help="distinct requests in the pool")
+    parser.add_argument("--client-processes", type=int, default=2, help="load generator processes")
+    parser.add_argument("--no-cache", action="store_true", help="run the server with QUERY_CACHE_SIZE=0")
+    parser.add_argument("--metrics", action="store_true", help="keep request instrumentation on")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        parser.error("needs /proc/<pid>/stat and smaps_rollup (Linux 4.14+)")
+    with open(DATA_FILE, encoding="utf-8") as f:
+        requests = build_requests(json.load(f)["centers"], args.mix, args.distinct)
+    results = []
+    for workers in args.workers:
+        for threads in args.threads:
+            results.extend(run_configuration(args, requests, workers, threads))
+    mark_saturation(results)
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "args": {k: v for k, v in vars(args).items() if k != "output"},
+                       "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+"""Replayable latency and accuracy benchmark for the center matcher.
+
+Builds a query corpus from the example queries quoted in requests.jsonl,
+the functional test queries and synthetic typo, number-word, code,
+location and equipment variants of centers.json, replays it through the
+matcher (or the whole chat answer, or the Flask test client) and reports latency percentiles, throughput and top-1/top-k
+accuracy against the expected codigo. The dataset can be scaled
+synthetically to see how cost grows with the number of centers.
+
+    python benchmarks/matcher_bench.py                    # report, compare with baseline
+    python benchmarks/matcher_bench.py --scales 1,10,100  # also time 10x / 100x datasets
+    python benchmarks/matcher_bench.py --mode answer      # time the chat answer path
+    python benchmarks/matcher_bench.py --batch-size 500   # /api/chat/batch vs /api/chat, per core
+    python benchmarks/matcher_bench.py --update-baseline  # store the current results
+    python benchmarks/matcher_bench.py --scales 10 --shards 8 --workers 4  # sharded, multi-core
+
+Exits with status 1 when accuracy or latency is worse than the stored baseline.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+REQUESTS_FILE = os.path.join(PROJECT_ROOT, "requests.jsonl")
+
+# Queries from tests/test_chat.py with the center they must resolve to
+TEST_QUERIES = [
+    ("I need the center id for code ES0263", "ES0263"),
+    ("Padilla 239 in Barcelona", "ES0323"),
+    ("center id for Sardinia 200 Barcelona", "ES0284"),
+    ("centers in Sant Andreu de la Barca Barcelona", None),
+    ("Peru thirty eight", None),
+]
+
+ONES = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+        "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen"]
+TENS = ["", "", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+
+
+def number_to_words(number):
+    """English words for 0-9999, in the form normalize_text() converts back"""
+    if number < 20:
+        return ONES[number]
+    if number < 100:
+        tens, ones = divmod(number, 10)
+        return TENS[tens] + (f" {ONES[ones]}" if ones else "")
+    if number < 1000:
+        hundreds, rest = divmod(number, 100)
+        return f"{ONES[hundreds]} hundred" + (f" {number_to_words(rest)}" if rest else "")
+    thousands, rest = divmod(number, 1000)
+    return f"{number_to_words(thousands)} thousand" + (f" {number_to_words(rest)}" if rest else "")
+
+
+def make_typo(text, rng):
+    """Swap, drop or insert one character inside the longest word"""
+    words = text.split()
+    if not words:
+        return text
+    index = max(range(len(words)), key=lambda i: len(words[i]))
+    word = words[index]
+    if len(word) < 5:
+        return text
+    i = rng.randrange(1, len(word) - 2)
+    operation = rng.choice("sdi")
+    if operation == "s":
+        word = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    elif operation == "d":
+        word = word[:i] + word[i + 1:]
+    else:
+        word = word[:i] + rng.choice("aeiourlnst") + word[i:]
+    words[index] = word
+    return " ".join(words)
+
+
+def spell_numbers(text):
+    return re.sub(r"\b\d{1,4}\b", lambda m: number_to_words(int(m.group(0))), text)
+
+
+def requests_queries(path=REQUESTS_FILE):
+    """Example queries quoted in the backlog (e.g. "Sardinia 200 Barcelona"), without expectations"""
+    if not os.path.exists(path):
+        return []
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            body = json.loads(line).get("body", "")
+            for quoted in re.findall(r'"([^"]{3,60})"', body):
+                if not re.search(r"[()=\[\]{}]|\\b|\.\w+\(", quoted):
+                    queries.append(quoted)
+    return queries
+
+
+def build_corpus(records, seed=7, per_center=1.0):
+    """(message, expected codigo or None, kind) triples"""
+    rng = random.Random(seed)
+    corpus = [(q, code, "test") for q, code in TEST_QUERIES]
+    corpus += [(q, None, "requests") for q in requests_queries()]
+    codes, towns, washers = {}, {}, {}
+    for record in records:
+        codes.setdefault(record["codigo"], []).append(record)
+        towns.setdefault(record["poblacion"], []).append(record)
+        if record["fabricante_lavadoras"]:
+            washers.setdefault((record["fabricante_lavadoras"], record["poblacion"]), []).append(record)
+    for record in records:
+        if rng.random() > per_center:
+            continue
+        code = record["codigo"]
+        if not code or len(codes[code]) > 1:
+            continue
+        nombre, direccion, poblacion = record["nombre"], record["direccion"], record["poblacion"]
+        corpus.append((f"code {code}", code, "code"))
+        corpus.append((f"center code for {code.lower()}", code, "code"))
+        corpus.append((f"{direccion} in {poblacion}", code, "address"))
+        corpus.append((make_typo(f"{nombre} {poblacion}", rng), code, "typo"))
+        spelled = spell_numbers(direccion)
+        if spelled != direccion:
+            corpus.append((f"{spelled} {poblacion}", code, "number_words"))
+        # Location and equipment questions, labelled only when a single center answers them
+        if poblacion and towns[poblacion][0] is record:
+            corpus.append((f"centers in {poblacion}", unique_code(towns[poblacion]), "location"))
+        corpus.append((f"how many washers does {direccion} in {poblacion} have", code, "equipment"))
+        fabricante = record["fabricante_lavadoras"]
+        if fabricante and washers[(fabricante, poblacion)][0] is record:
+            corpus.append((f"{fabricante} washers in {poblacion}", unique_code(washers[(fabricante, poblacion)]),
+                           "equipment"))
+    return corpus
+
+
+def unique_code(records):
+    return records[0]["codigo"] if len(records) == 1 else None
+
+
+def scaled_records(records, factor, shard_count=None):
+    """Synthetic dataset of ``factor`` copies with distinct names, addresses and codes"""
+    raw = []
+    for copy in range(factor):
+        for record in records:
+            center = dict(record.data)
+            if copy:
+                center["id_centro"] = f"{center['id_centro']}x{copy}"
+                center["codigo"] = f"{center['codigo']}X{copy}"
+                center["nombre"] = f"{center['nombre']} {copy}"
+                center["direccion"] = re.sub(r"\d+", lambda m: str(int(m.group(0)) + copy), center["direccion"] or "") or f"Calle {copy}"
+            raw.append(center)
+    return app_module.DatasetSnapshot(app_module.build_center_records(raw), version=f"x{factor}",
+                                      shard_count=shard_count)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_corpus(corpus, snapshot, mode="direct", top_k=5):
+    """Replay the corpus with the query cache bypassed and collect latency and accuracy.
+
+    ``direct`` times match_centers() alone, ``answer`` the whole chat answer
+    (answer_query(): equipment detection, facet filtering, matching and the
+    rendered reply) and ``client`` a /api/search request.
+    """
+    client = app_module.app.test_client() if mode == "client" else None
+    latencies = []
+    top1 = topk = expected_total = 0
+    failures = []
+    for message, expected, kind in corpus:
+        query = app_module.analyze_query(message)
+        started = time.perf_counter()
+        if client is not None:
+            app_module.query_cache.clear()
+            payload = client.get("/api/search", query_string={"q": message, "limit": top_k}).get_json()
+            ranked_codes = [r["codigo"] for r in payload["results"]]
+        elif mode == "answer":
+            ranked, _ = app_module.answer_query(query, snapshot)
+            ranked_codes = [m["row"]["codigo"] for m in ranked.top(top_k)]
+        elif query["query_words"]:
+            ranked = app_module.match_centers(query, snapshot, top_k=top_k)
+            ranked_codes = [m["row"]["codigo"] for m in ranked.top(top_k)]
+        else:
+            ranked_codes = []
+        latencies.append(time.perf_counter() - started)
+        if expected is None:
+            continue
+        expected_total += 1
+        if ranked_codes[:1] == [expected]:
+            top1 += 1
+        if expected in ranked_codes:
+            topk += 1
+        else:
+            failures.append((kind, message, expected, ranked_codes[:3]))
+    elapsed = sum(latencies)
+    return {
+        "queries": len(corpus),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        "throughput_qps": round(len(corpus) / elapsed, 1) if elapsed else 0.0,
+        "top1_accuracy": round(top1 / expected_total, 4) if expected_total else None,
+        f"top{top_k}_accuracy": round(topk / expected_total, 4) if expected_total else None,
+        "labelled": expected_total,
+        "failures": failures,
+    }
+
+
+def run_batch(corpus, batch_size):
+    """Queries per CPU second of /api/chat one message at a time and of /api/chat/batch.
+
+    Both go through the Flask test client on this thread, so CPU time is one
+    core's; the query cache is cleared before every single message. A first
+    pass warms the per-token lookup memos both paths share.
+    """
+    client = app_module.app.test_client()
+    messages = [message for message, _, _ in corpus]
+    batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+    for batch in batches:
+        client.post("/api/chat/batch", json={"messages": batch})
+    started = time.thread_time()
+    for message in messages:
+        app_module.query_cache.clear()
+        client.post("/api/chat", json={"message": message})
+    single = time.thread_time() - started
+    started = time.thread_time()
+    for batch in batches:
+        client.post("/api/chat/batch", json={"messages": batch})
+    batched = time.thread_time() - started
+    return {
+        "queries": len(messages),
+        "batch_size": batch_size,
+        "single_qps_per_core": round(len(messages) / single, 1) if single else 0.0,
+        "batch_qps_per_core": round(len(messages) / batched, 1) if batched else 0.0,
+        "speedup": round(single / batched, 2) if batched else None,
+    }
+
+
+def compare_with_baseline(results, baseline, latency_tolerance, accuracy_tolerance):
+    """Human-readable regressions of ``results`` against ``baseline``"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for metric, value in current.items():
+            if not metric.endswith("_accuracy") or value is None or previous.get(metric) is None:
+                continue
+            if value < previous[metric] - accuracy_tolerance:
+                regressions.append(f"{name}: {metric} {value} < baseline {previous[metric]}")
+        for metric in ("p50_ms", "p95_ms"):
+            if metric in previous and current[metric] > previous[metric] * (1 + latency_tolerance):
+                regressions.append(f"{name}: {metric} {current[metric]} > baseline {previous[metric]} (+{latency_tolerance:.0%})")
+    return regressions
+
+
+def run_scales(args, base, corpus):
+    results = {}
+    for factor in [int(s) for s in args.scales.split(",") if s.strip()]:
+        if factor == 1:
+            snapshot, queries = base, corpus
+        else:
+            started = time.perf_counter()
+            snapshot = scaled_records(base.records, factor, args.shards)
+            print(f"built {factor}x dataset ({len(snapshot.records)} centers) in {time.perf_counter() - started:.1f}s")
+            queries = random.Random(args.seed).sample(corpus, min(args.scaled_sample, len(corpus)))
+            # Expected codes refer to the unscaled dataset's copies, which keep their codes
+        name = f"{args.mode}_x{factor}"
+        mode = args.mode if factor == 1 or args.mode == "answer" else "direct"
+        # The shard pool only serves the published snapshot it was forked for
+        app_module.dataset = snapshot
+        app_module.start_shard_pool()
+        results[name] = run_corpus(queries, snapshot, mode=mode, top_k=args.top_k)
+        results[name]["centers"] = len(snapshot.records)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("direct", "answer", "client"), default="direct",
+                        help="call the matcher directly, answer as /api/chat does or go through /api/search")
+    parser.add_argument("--scales", default="1", help="comma-separated dataset multipliers, e.g. 1,10,100")
+    parser.add_argument("--scaled-sample", type=int, default=200,
+                        help="queries replayed against scaled datasets")
+    parser.add_argument("--engine", choices=sorted(app_module.SCORING_ENGINES), default=None)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--shards", type=int, default=None,
+                        help="partition every dataset into this many shards (default: SEARCH_SHARDS)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes scoring shards in parallel (default: SEARCH_WORKERS)")
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="also compare /api/chat/batch in batches of this size with /api/chat, per core")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--latency-tolerance", type=float, default=0.5,
+                        help="allowed relative latency increase before failing")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.0)
+    parser.add_argument("--show-failures", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.engine:
+        app_module.SCORING_ENGINE = args.engine
+    if args.workers is not None:
+        app_module.SEARCH_WORKERS = args.workers
+    base = app_module.dataset
+    if args.shards is not None and args.shards != base.shard_count:
+        base = app_module.DatasetSnapshot(base.records, version=base.version, shard_count=args.shards)
+    corpus = build_corpus(base.records, seed=args.seed)
+    published = app_module.dataset
+    try:
+        results = run_scales(args, base, corpus)
+    finally:
+        app_module.stop_shard_pool()
+        app_module.dataset = published
+
+    if args.batch_size > 0:
+        batch = run_batch(corpus, min(args.batch_size, app_module.MAX_BATCH_SIZE))
+        print("batch: " + ", ".join(f"{k}={v}" for k, v in batch.items()))
+
+    for name, result in results.items():
+        failures = result.pop("failures")
+        summary = ", ".join(f"{k}={v}" for k, v in result.items())
+        print(f"{name}: {summary}")
+        for failure in failures[:args.show_failures]:
+            print("   miss", failure)
+
+    if args.update_baseline:
+        # Keep the stored results of the other modes
+        stored = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                stored = {name: result for name, result in json.load(f).items()
+                          if not name.startswith(f"{args.mode}_")}
+        stored.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("no baseline stored; run with --update-baseline")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(results, baseline, args.latency_tolerance, args.accuracy_tolerance)
+    for regression in regressions:
+        print("REGRESSION", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
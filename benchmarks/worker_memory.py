@@ -0,0 +1,163 @@
+"""Per-worker memory of the Gunicorn deployment, with and without preload.
+
+Starts gunicorn.conf.py twice on a free local port, once with the dataset
+loaded in the master and shared copy-on-write (GUNICORN_PRELOAD=1) and once
+with every worker loading its own copy (GUNICORN_PRELOAD=0). After a warm-up
+of chat queries it reads /proc/<pid>/smaps_rollup of every worker and
+reports RSS, PSS (RSS with shared pages split between the processes sharing
+them) and the shared / private split. It then calls /admin/reload once and
+checks that every worker picked up the new snapshot (reload announcements
+only reach workers forked from a preloading master). Linux only.
+
+    python benchmarks/worker_memory.py
+    python benchmarks/worker_memory.py --workers 8 --threads 2 --warmup 400
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+WARMUP_QUERIES = [
+    "I need the center id for code ES0263",
+    "Padilla 239 in Barcelona",
+    "center id for Sardinia 200 Barcelona",
+    "centers in Sant Andreu de la Barca Barcelona",
+    "lavanderia en calle mayor madrid",
+]
+ADMIN_TOKEN = "worker-memory-bench"
+MEMORY_FIELDS = {"Rss": "rss_kb", "Pss": "pss_kb", "Shared_Clean": "shared_kb", "Shared_Dirty": "shared_kb",
+                 "Private_Clean": "private_kb", "Private_Dirty": "private_kb"}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def child_pids(parent):
+    """Worker pids of a Gunicorn master, found through the ppid field of /proc/<pid>/stat"""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name is parenthesised and may contain spaces
+        if int(stat.rsplit(")", 1)[1].split()[1]) == parent:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def smaps_rollup(pid):
+    memory = dict.fromkeys(set(MEMORY_FIELDS.values()), 0)
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in MEMORY_FIELDS:
+                memory[MEMORY_FIELDS[name]] += int(value.split()[0])
+    return memory
+
+
+def request(url, payload=None, headers=None):
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json", **(headers or {})})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def wait_until_ready(base_url, server, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {server.returncode}")
+        try:
+            return request(f"{base_url}/health")
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not become ready")
+
+
+def workers_after_reload(base_url, workers, since, attempts=200):
+    """Poll /health until every worker answered; return pid -> whether it serves a snapshot loaded after `since`"""
+    seen = {}
+    for _ in range(attempts):
+        health = request(f"{base_url}/health")
+        seen[health["process"]["pid"]] = health["dataset"]["loaded_at"] >= since
+        if len(seen) >= workers and all(seen.values()):
+            break
+    return seen
+
+
+def measure(args, preload):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, GUNICORN_BIND=f"127.0.0.1:{port}", GUNICORN_WORKERS=str(args.workers),
+               GUNICORN_THREADS=str(args.threads), GUNICORN_PRELOAD="1" if preload else "0",
+               ADMIN_TOKEN=ADMIN_TOKEN, METRICS_ENABLED="0")
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "app:app"],
+                              cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(base_url, server, args.startup_timeout)
+        # Wait for all workers to boot; without preload each one loads the dataset itself
+        while len(child_pids(server.pid)) < args.workers:
+            time.sleep(0.2)
+        for i in range(args.warmup):
+            request(f"{base_url}/api/chat", {"message": WARMUP_QUERIES[i % len(WARMUP_QUERIES)]})
+        pids = child_pids(server.pid)
+        workers = {pid: smaps_rollup(pid) for pid in pids}
+        master = smaps_rollup(server.pid)
+
+        reload_started = time.time()
+        request(f"{base_url}/admin/reload", {}, headers={"X-Admin-Token": ADMIN_TOKEN})
+        reloaded = workers_after_reload(base_url, len(pids), reload_started)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+    return {"master": master, "workers": workers, "reloaded": reloaded}
+
+
+def summarize(name, result):
+    workers = result["workers"]
+    keys = ("rss_kb", "pss_kb", "shared_kb", "private_kb")
+    per_worker = {key: sum(memory[key] for memory in workers.values()) // max(len(workers), 1) for key in keys}
+    # The master holds the preloaded pages too, so it counts towards the total
+    totals = {key: sum(memory[key] for memory in [result["master"], *workers.values()]) for key in keys}
+    reloaded = result["reloaded"]
+    print(f"{name}: {len(workers)} workers")
+    print("  per worker: " + ", ".join(f"{key}={value}" for key, value in per_worker.items()))
+    print("  master + workers: " + ", ".join(f"{key}={value}" for key, value in totals.items()))
+    print(f"  reload reached {sum(reloaded.values())}/{len(reloaded)} workers")
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--warmup", type=int, default=200, help="chat queries sent before measuring")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        parser.error("needs /proc/<pid>/smaps_rollup (Linux 4.14+)")
+    separate = summarize("separate copies (GUNICORN_PRELOAD=0)", measure(args, preload=False))
+    shared = summarize("shared dataset (GUNICORN_PRELOAD=1)", measure(args, preload=True))
+    saved = separate["pss_kb"] - shared["pss_kb"]
+    print(f"preload saves {saved} kB PSS with {args.workers} workers "
+          f"({saved / max(separate['pss_kb'], 1):.0%})")
+
+
+if __name__ == "__main__":
+    main()
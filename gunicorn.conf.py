@@ -0,0 +1,53 @@
+"""Gunicorn settings for lawash-tool.
+
+The app is imported once in the master (preload_app) so the centers
+snapshot and its search indexes are built a single time and shared
+copy-on-write by every worker, instead of each worker holding its own copy.
+"""
+import gc
+import os
+import tempfile
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:3000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+threads = int(os.environ.get("GUNICORN_THREADS", "2"))
+timeout = 60
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1").lower() not in ("0", "false", "no")
+# How often the master polls centers.json when CENTERS_RELOAD_INTERVAL is unset. The master
+# announces each reload, so running workers follow it and workers forked later (kill -HUP,
+# crashed workers) start from the same snapshot
+master_reload_interval = 5.0
+# Workers publish their metrics here so /metrics on whichever worker is scraped reports all of them
+if not os.environ.get("METRICS_DIR"):
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="lawash-metrics-")
+
+
+def when_ready(server):
+    if preload_app:
+        import app
+        app.start_reload_watcher(app.RELOAD_INTERVAL or master_reload_interval, announce=True)
+
+
+def pre_fork(server, worker):
+    # Move the loaded snapshot out of the collector's generations; otherwise the
+    # first collection in a worker writes to every object header and un-shares the pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import app
+        app.init_worker()
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        # The worker imported the app itself; give it a shard pool as init_worker() does
+        import app
+        app.start_shard_pool()
+
+
+def worker_exit(server, worker):
+    # Keep the requests served since the last periodic publish in the totals
+    import app
+    app.metrics.publish()
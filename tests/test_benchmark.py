@@ -0,0 +1,56 @@
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for path in (PROJECT_ROOT, os.path.join(PROJECT_ROOT, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import app as app_module
+import matcher_bench
+
+
+def test_number_words_round_trip_through_normalizer():
+    for number in (0, 7, 38, 200, 239, 1001, 2024):
+        assert app_module.normalize_text(matcher_bench.number_to_words(number)) == str(number)
+
+
+def test_corpus_expectations_refer_to_existing_centers():
+    records = app_module.dataset.records
+    corpus = matcher_bench.build_corpus(records, per_center=0.1)
+    codes = {record["codigo"] for record in records}
+    kinds = {kind for _, _, kind in corpus}
+    assert {"test", "code", "address", "typo", "location", "equipment"} <= kinds
+    assert all(expected in codes for _, expected, _ in corpus if expected)
+
+
+def test_run_corpus_reports_latency_and_accuracy():
+    corpus = [(q, code, "test") for q, code in matcher_bench.TEST_QUERIES if code]
+    result = matcher_bench.run_corpus(corpus, app_module.dataset)
+    assert result["queries"] == len(corpus)
+    assert result["top5_accuracy"] == 1.0
+    assert 0 < result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+
+
+def test_answer_mode_times_the_chat_answer_path(monkeypatch):
+    calls = []
+    answer_query = app_module.answer_query
+    monkeypatch.setattr(app_module, "answer_query", lambda query, snapshot: calls.append(query) or answer_query(query, snapshot))
+    corpus = [("Padilla 239 in Barcelona", "ES0323", "test"), ("girbau washers in Barcelona", None, "equipment")]
+    result = matcher_bench.run_corpus(corpus, app_module.dataset, mode="answer")
+    assert len(calls) == 2
+    assert result["top1_accuracy"] == 1.0
+
+
+def test_batch_comparison_reports_throughput_per_core():
+    corpus = [(q, code, "test") for q, code in matcher_bench.TEST_QUERIES] * 2
+    result = matcher_bench.run_batch(corpus, batch_size=4)
+    assert result["queries"] == len(corpus)
+    assert result["single_qps_per_core"] > 0 and result["batch_qps_per_core"] > 0
+
+
+def test_baseline_comparison_flags_regressions():
+    baseline = {"direct_x1": {"p50_ms": 10.0, "p95_ms": 20.0, "top1_accuracy": 0.9}}
+    current = {"direct_x1": {"p50_ms": 10.0, "p95_ms": 40.0, "top1_accuracy": 0.8}}
+    regressions = matcher_bench.compare_with_baseline(current, baseline, 0.5, 0.0)
+    assert len(regressions) == 2
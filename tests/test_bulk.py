@@ -0,0 +1,88 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "secret")
+    app_module.app.testing = True
+    with app_module.app.test_client() as test_client:
+        yield test_client
+
+
+def post_bulk(client, body, query_string="", content_type="application/x-ndjson"):
+    response = client.post(f"/admin/bulk-match{query_string}", data=body, content_type=content_type,
+                           headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_bulk_match_streams_ndjson_results_in_order(client):
+    body = '{"query": "Padilla 239 in Barcelona"}\n\nnot json\n"Laundry in Sabadell"\n'
+    results = post_bulk(client, body)
+    assert [r["line"] for r in results] == [1, 3, 4]
+    assert results[0]["codigo"] == "ES0323" and results[0]["reason"]
+    assert "error" in results[1] and results[1]["codigo"] is None
+    expected = app_module.score_centers(app_module.analyze_query("Laundry in Sabadell"))[0]
+    assert results[2]["codigo"] == expected["row"]["codigo"]
+    assert results[2]["score"] == expected["score"]
+
+
+def test_bulk_match_reads_csv_columns(client):
+    results = post_bulk(client, "street,city\nPadilla 239,Barcelona\n", content_type="text/csv")
+    assert results == [{
+        "line": 2, "query": "Padilla 239 Barcelona", "codigo": "ES0323", "id_centro": results[0]["id_centro"],
+        "score": results[0]["score"], "reason": "Hybrid field match", "total_matches": results[0]["total_matches"],
+    }]
+    missing = post_bulk(client, "street,city\nPadilla 239,Barcelona\n", "?format=csv&field=address")
+    assert missing[0]["error"] == "missing text field 'address'"
+
+
+def test_bulk_match_requires_token_and_known_format(client):
+    assert client.post("/admin/bulk-match", data="").status_code == 403
+    response = client.post("/admin/bulk-match?format=xml", data="", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 400
+
+
+def test_bulk_match_pulls_rows_lazily():
+    consumed = []
+
+    def rows():
+        for number in range(1, 10_000):
+            consumed.append(number)
+            yield number, "Laundry in Sabadell", None
+
+    results = app_module.bulk_match(rows(), chunk_size=4)
+    assert next(results)["line"] == 1
+    assert len(consumed) == 4
+
+
+def test_bulk_match_process_pool_matches_serial_results():
+    lines = io.StringIO("".join(json.dumps({"q": q}) + "\n" for q in ["Padilla 239", "Sabadell", "ES0112", "xyz"] * 3))
+    rows = list(app_module.read_bulk_rows(lines, field="q"))
+    serial = list(app_module.bulk_match(iter(rows), chunk_size=2))
+    pooled = list(app_module.bulk_match(iter(rows), workers=2, chunk_size=2))
+    assert pooled == serial
+
+
+def test_explicit_empty_snapshot_is_not_replaced_by_the_dataset():
+    # A snapshot whose centers were all removed is falsy (DatasetSnapshot defines __len__) but still the one asked for
+    empty = app_module.DatasetSnapshot(app_module.dataset.records[:1])
+    empty.remove(0)
+    assert len(empty) == 0
+    query = app_module.analyze_query("Laundry in Sabadell")
+    assert app_module.match_centers(query, empty).total == 0 < app_module.match_centers(query).total
+    for workers in (1, 2):
+        [result] = app_module.bulk_match(iter([(1, "Padilla 239 in Barcelona", None)]), empty, workers=workers)
+        assert result["codigo"] is None and result["total_matches"] == 0
@@ -0,0 +1,123 @@
+import json
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+ADMIN = {"X-Admin-Token": "secret"}
+NEW_CENTER = {
+    "id_centro": "9001", "codigo": "ES9001", "nombre": "Lavanderia Zurbaran",
+    "direccion": "Calle Zurbaran 12", "poblacion": "Madrid", "provincia": "Madrid",
+    "longitud": "-3.6920", "latitud": "40.4330",
+}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    with open(app_module.DATA_FILE) as f:
+        centers = json.load(f)["centers"]
+    path = tmp_path / "centers.json"
+    path.write_text(json.dumps({"centers": centers[:200]}))
+    monkeypatch.setattr(app_module, "DATA_FILE", str(path))
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "secret")
+    original = app_module.dataset
+    assert app_module.load_data()
+    app_module.app.testing = True
+    with app_module.app.test_client() as test_client:
+        yield test_client
+    app_module.dataset = original
+
+
+def _search(client, q):
+    return [r["codigo"] for r in client.get("/api/search", query_string={"q": q}).get_json()["results"]]
+
+
+def test_upsert_indexes_a_new_center_everywhere(client):
+    assert "ES9001" not in _search(client, "zurbaran madrid")
+    response = client.put("/admin/centers", json=NEW_CENTER, headers=ADMIN)
+    assert response.status_code == 201
+    assert response.get_json()["dataset"]["centers"] == 201
+
+    assert "ES9001" in _search(client, "zurbaran madrid")
+    assert _search(client, "ES9001")[0] == "ES9001"
+    suggestions = client.get("/api/suggest", query_string={"q": "zurb"}).get_json()["suggestions"]
+    assert suggestions[0]["codigo"] == "ES9001"
+    nearest = client.get("/api/nearest", query_string={"lat": 40.4330, "lon": -3.6920, "k": 1}).get_json()
+    assert nearest["results"][0]["codigo"] == "ES9001"
+
+
+def test_update_moves_a_center_and_delete_removes_it(client):
+    client.put("/admin/centers", json=NEW_CENTER, headers=ADMIN)
+    moved = dict(NEW_CENTER, poblacion="Sevilla", provincia="Sevilla")
+    assert client.put("/admin/centers", json=moved, headers=ADMIN).status_code == 200
+    assert "ES9001" in _search(client, "zurbaran sevilla")
+    assert "ES9001" not in _search(client, "zurbaran madrid")
+    assert app_module.dataset.location_index["city"]["positions"]["sevilla"]
+    in_sevilla = client.get("/api/search?poblacion=sevilla&limit=100").get_json()["results"]
+    assert "ES9001" in [r["codigo"] for r in in_sevilla]
+
+    assert client.delete("/admin/centers/es9001", headers=ADMIN).status_code == 200
+    assert _search(client, "zurbaran") == []
+    assert client.get("/api/suggest", query_string={"q": "zurb"}).get_json()["suggestions"] == []
+    assert client.delete("/admin/centers/ES9001", headers=ADMIN).status_code == 404
+    assert app_module.dataset_status()["centers"] == 200
+
+
+def test_invalid_and_unauthorized_changes_are_rejected(client):
+    assert client.put("/admin/centers", json=NEW_CENTER).status_code == 403
+    assert client.put("/admin/centers", json={"nombre": "x"}, headers=ADMIN).status_code == 400
+    assert client.put("/admin/centers", json=dict(NEW_CENTER, nombre=["x"]), headers=ADMIN).status_code == 400
+
+
+def test_log_replays_into_a_fresh_snapshot_and_compacts(client):
+    client.put("/admin/centers", json=NEW_CENTER, headers=ADMIN)
+    first = app_module.dataset.records[0]
+    assert client.delete(f"/admin/centers/{first['id_centro']}", headers=ADMIN).status_code == 200
+
+    fresh = app_module.build_snapshot(use_index=False)
+    assert app_module.replay_change_log(fresh) == 2
+    assert len(fresh) == len(app_module.dataset) == 200
+    assert fresh.find("es9001") and not fresh.find(first["id_centro"])
+
+    response = client.post("/admin/centers/compact", headers=ADMIN)
+    assert response.get_json()["changes"] == 2
+    with open(app_module.DATA_FILE) as f:
+        centers = json.load(f)["centers"]
+    assert len(centers) == 200 and centers[-1]["codigo"] == "ES9001"
+    assert os.path.getsize(app_module.change_log_for(app_module.DATA_FILE)) == 0
+    assert app_module.dataset.changes == 0
+    assert "ES9001" in _search(client, "zurbaran madrid")
+
+
+def test_changes_swap_in_fresh_memos(client):
+    index = app_module.dataset.search_index
+    candidates, fuzzy = index["token_candidates"], index["fuzzy_tokens"].lookup
+    # Lookups made before the change, as a racing request would
+    new_position = len(app_module.dataset.records)
+    assert new_position not in candidates("zurbaran") and "zurbaran" not in fuzzy("zurbaram")
+    client.put("/admin/centers", json=NEW_CENTER, headers=ADMIN)
+    # A late write into the old memos cannot hide the new center from later lookups
+    assert index["token_candidates"] is not candidates and index["fuzzy_tokens"].lookup is not fuzzy
+    assert new_position in index["token_candidates"]("zurbaran")
+    assert "zurbaran" in index["fuzzy_tokens"].lookup("zurbaram")
+
+
+def test_centers_missing_display_fields_are_rejected_and_not_replayed(client):
+    partial = {"id_centro": "9999", "codigo": "ZZ9999"}
+    response = client.put("/admin/centers", json=partial, headers=ADMIN)
+    assert response.status_code == 400 and "'nombre'" in response.get_json()["error"]
+    assert client.put("/admin/centers", json=dict(NEW_CENTER, provincia=None), headers=ADMIN).status_code == 400
+
+    # One logged before the fields were required is skipped, not served
+    with app_module.change_log_lock():
+        app_module.append_change({"op": "upsert", "center": partial})
+    assert app_module.load_data()
+    assert not app_module.dataset.find("zz9999") and len(app_module.dataset) == 200
+    assert client.get("/api/search", query_string={"q": "ZZ9999"}).status_code == 200
+    assert client.post("/api/chat", json={"message": "centers in Madrid"}).status_code == 200
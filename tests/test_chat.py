@@ -51,3 +51,57 @@ def test_find_multiple_centers_in_city(client):
     response = _chat(client, "centers in Sant Andreu de la Barca Barcelona")
     assert any(code in response for code in ("ES0172", "ES0329")), response
 
+
+
+def test_repeated_query_is_served_from_cache(client):
+    from app import query_cache
+
+    first = _chat(client, "Padilla 239 in Barcelona")
+    hits_before = query_cache.stats()["hits"]
+    second = _chat(client, "  PADILLA 239 in barcelona ")
+    assert second == first
+    assert query_cache.stats()["hits"] == hits_before + 1
+
+    health = client.get("/health").get_json()
+    assert health["cache"]["hits"] >= 1
+
+
+def test_reload_invalidates_cache(client):
+    from app import load_data, query_cache
+
+    _chat(client, "Padilla 239 in Barcelona")
+    assert query_cache.stats()["size"] > 0
+    load_data()
+    assert query_cache.stats()["size"] == 0
+
+
+def test_batch_matches_single_queries_in_order(client):
+    messages = [
+        "I need the center id for code ES0263",
+        "Padilla 239 in Barcelona",
+        "padilla 239 in barcelona",
+        "",
+    ]
+    response = client.post("/api/chat/batch", json={"messages": messages})
+    assert response.status_code == 200
+    payload = response.get_json()
+    results = payload["results"]
+    assert [r["message"] for r in results] == messages
+    for message, result in zip(messages, results):
+        assert result["response"] == _chat(client, message)
+    assert results[1]["matches"][0]["codigo"] == "ES0323"
+    assert payload["stats"]["unique_queries"] == 2
+    assert payload["stats"]["cpu_ms"] > 0 and payload["stats"]["queries_per_cpu_second"] > 0
+
+
+def test_batch_leaves_the_query_cache_alone(client):
+    _chat(client, "Padilla 239 in Barcelona")
+    before = client.get("/health").get_json()["cache"]
+    messages = [f"Laundry number {n} in Sabadell" for n in range(20)] + ["Padilla 239 in Barcelona"]
+    assert client.post("/api/chat/batch", json={"messages": messages}).status_code == 200
+    assert client.get("/health").get_json()["cache"] == before
+
+
+def test_batch_rejects_invalid_payload(client):
+    assert client.post("/api/chat/batch", json={"messages": "Barcelona"}).status_code == 400
+    assert client.post("/api/chat/batch", json=["Padilla 239 in Barcelona"]).status_code == 400
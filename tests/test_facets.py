@@ -0,0 +1,98 @@
+import os
+import re
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+
+@pytest.fixture(scope="module")
+def client():
+    app_module.app.testing = True
+    with app_module.app.test_client() as test_client:
+        yield test_client
+
+
+def _centers(predicate):
+    return {record["id_centro"] for record in app_module.dataset.records if predicate(record)}
+
+
+def _codes(predicate):
+    return {record["codigo"] for record in app_module.dataset.records if predicate(record)}
+
+
+def test_bitmaps_round_trip_positions():
+    positions = [0, 3, 7, 8, 64, 1000]
+    bitmap = app_module.FacetIndex.bitmap(positions)
+    assert app_module.FacetIndex.positions(bitmap) == positions
+    assert app_module.FacetIndex.positions(0) == []
+
+
+def test_filters_intersect_fields_and_match_a_scan(client):
+    payload = client.get("/api/search", query_string={
+        "fabricante_secadoras": "girbau", "provincia": "Barcelona", "limit": 100}).get_json()
+    expected = _centers(lambda r: r["fabricante_secadoras"] == "GIRBAU, S.A." and r["provincia"].lower() == "barcelona")
+    assert payload["total"] == len(expected)
+    assert {result["id_centro"] for result in payload["results"]} == expected
+
+    # Repeating a field accepts any of its values
+    payload = client.get("/api/search?modelo_central_pago=nexa&modelo_central_pago=mark&limit=100").get_json()
+    assert payload["total"] == len(_centers(lambda r: r["modelo_central_pago"] in ("Nexa", "MARK")))
+
+
+def test_facet_counts_cover_every_match(client):
+    payload = client.get("/api/search", query_string={"q": "centers in Madrid", "facets": "1"}).get_json()
+    counts = {f["value"]: f["count"] for f in payload["facets"]["modelo_central_pago"]}
+    full = client.get("/api/search", query_string={"q": "centers in Madrid", "limit": 100}).get_json()
+    models = [app_module.dataset.records[app_module.dataset.find(r["id_centro"])[0]]["modelo_central_pago"]
+              for r in full["results"]]
+    assert counts == {model: models.count(model) for model in set(models) if model}
+    assert "facets" not in full
+
+
+def test_chat_answers_equipment_questions(client):
+    response = client.post("/api/chat", json={"message": "Nexa payment centrals in Madrid"}).get_json()["response"]
+    expected = _centers(lambda r: r["modelo_central_pago"] == "Nexa" and r["poblacion"].lower() == "madrid")
+    assert f"I found {len(expected)} centers" in response
+    assert f"Payment central model: Nexa ({len(expected)})" in response
+
+    response = client.post("/api/chat", json={"message": "machines at ES0323"}).get_json()["response"]
+    assert "Washers: ELECTROLUX PROFESSIONAL SA" in response
+    assert "Payment central model: Nexa" in response
+
+
+def test_invalid_filter(client):
+    assert client.post("/api/search", json={"fabricante_lavadoras": ["girbau", 3]}).status_code == 400
+
+
+@pytest.mark.parametrize("message, code", [
+    ("mark", "ES0240"),            # a payment central model, and the Premià de Mar marina
+    ("pro wash porto", "PT0008"),  # a payment central manufacturer's words
+])
+def test_equipment_names_alone_are_matched_as_text(client, message, code):
+    assert app_module.detect_equipment(app_module.analyze_query(message), app_module.dataset) is None
+    assert f"Center Code: {code}" in client.post("/api/chat", json={"message": message}).get_json()["response"]
+
+
+@pytest.mark.parametrize("message", ["Point Lisboa", "pos Madrid"])
+def test_equipment_words_without_equipment_intent_keep_the_text_answer(client, message):
+    query = app_module.analyze_query(message)
+    assert app_module.detect_equipment(query, app_module.dataset) is None
+    response = client.post("/api/chat", json={"message": message}).get_json()["response"]
+    assert "couldn't find" not in response
+
+
+def test_equipment_questions_stay_in_the_named_town(client):
+    # Location hints also cover the other "... de Llobregat" towns
+    response = client.post("/api/chat", json={"message": "washers in Sant Feliu de Llobregat"}).get_json()["response"]
+    listed = set(re.findall(r"Code: (\w+)", response))
+    assert listed == _codes(lambda r: r["poblacion"] == "Sant Feliu de Llobregat" and r["fabricante_lavadoras"])
+
+    # No equipment recorded there: the center is still named
+    response = client.post("/api/chat", json={"message": "washers in Odivelas"}).get_json()["response"]
+    assert "Center Code: PT0006" in response and "Machine details aren't available" in response
@@ -0,0 +1,68 @@
+import math
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * app_module.EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def _brute_force(geo_index, lat, lon):
+    return sorted(
+        (_haversine_km(lat, lon, geo_index.latitudes[i], geo_index.longitudes[i]), int(geo_index.positions[i]))
+        for i in range(len(geo_index))
+    )
+
+
+def test_geo_index_skips_invalid_coordinates():
+    geo_index = app_module.dataset.geo_index
+    assert 0 < len(geo_index) < len(app_module.dataset.records)
+    assert all(-90 <= lat <= 90 for lat in geo_index.latitudes)
+    assert all(-180 <= lon <= 180 for lon in geo_index.longitudes)
+
+
+def test_nearest_and_radius_match_brute_force():
+    geo_index = app_module.dataset.geo_index
+    for lat, lon in ((41.3874, 2.1686), (40.4168, -3.7038), (28.4636, -16.2518), (38.7223, -9.1393)):
+        reference = _brute_force(geo_index, lat, lon)
+        nearest = geo_index.query(lat, lon, k=5)
+        assert [p for p, _ in nearest] == [p for _, p in reference[:5]]
+        for (_, distance), (expected, _) in zip(nearest, reference):
+            assert math.isclose(distance, expected, rel_tol=1e-9, abs_tol=1e-6)
+        within = geo_index.query(lat, lon, radius_km=25)
+        assert [p for p, _ in within] == [p for d, p in reference if d <= 25]
+
+
+def test_nearest_endpoint():
+    client = app_module.app.test_client()
+    response = client.get("/api/nearest?lat=41.3874&lon=2.1686&k=3")
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert len(results) == 3
+    assert results[0]["distance_km"] <= results[1]["distance_km"] <= results[2]["distance_km"]
+    assert client.get("/api/nearest?lat=100&lon=2").status_code == 400
+    assert client.get("/api/nearest").status_code == 400
+
+
+def test_chat_reranks_ambiguous_matches_by_distance():
+    lat, lon = 41.4478, 1.9747
+    query = app_module.analyze_query("centers in Barcelona")
+    ranked = app_module.match_centers(query)
+    reranked = app_module.rerank_by_distance(ranked, app_module.dataset, lat, lon, limit=ranked.total)
+    assert sorted(m["row"].position for m in reranked) == sorted(m["row"].position for m in ranked.pool)
+    distances = [m["distance_km"] for m in reranked[:10] if m["distance_km"] is not None]
+    assert distances == sorted(distances)
+
+    client = app_module.app.test_client()
+    response = client.post("/api/chat", json={"message": "centers in Barcelona", "lat": lat, "lon": lon})
+    nearest = reranked[0]["row"]
+    assert f"**{nearest['nombre']}**" in response.get_json()["response"].split("<br>")[2]
+    assert client.post("/api/chat", json={"message": "Barcelona", "lat": "x", "lon": 2}).status_code == 400
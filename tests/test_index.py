@@ -0,0 +1,75 @@
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+
+def test_direct_code_lookup_uses_index():
+    index = app_module.dataset.search_index
+    id_hits, code_hits = app_module.lookup_direct_matches(index, {"es0263"}, {"es0263"})
+    assert not id_hits
+    assert [app_module.dataset.records[p]["codigo"] for p in code_hits] == ["ES0263"]
+
+
+def test_candidates_are_a_small_subset_for_selective_queries():
+    index = app_module.dataset.search_index
+    candidates = app_module.generate_candidates(index, {"padilla", "239"}, "padilla 239", {})
+    assert candidates
+    assert len(candidates) < len(app_module.dataset.records) / 2
+    assert any(app_module.dataset.records[p]["codigo"] == "ES0323" for p in candidates)
+
+
+def test_fuzzy_token_index_matches_brute_force_jaro_winkler():
+    vocabulary = list(app_module.dataset.search_index["tokens"])
+    fuzzy_index = app_module.FuzzyTokenIndex(vocabulary)
+    for query in ("sardinia", "barcelna", "padila", "mompu", "tenerfe", "abc"):
+        expected = {
+            token for token in vocabulary
+            if len(token) > 2 and app_module.jellyfish.jaro_winkler_similarity(query, token) >= 0.88
+        }
+        assert fuzzy_index.lookup(query) == expected, query
+
+
+def legacy_detect_location_candidates(query_tokens, query_string, values):
+    """The linear scan detect_location_candidates() replaced, kept to pin its hints"""
+    hints = set()
+    for value in dict.fromkeys(v for v in values if v):
+        tokens = {w for w in value.split() if w not in app_module.STOPWORDS} or set(value.split())
+        if not tokens or not query_tokens:
+            continue
+        overlap = len(tokens & query_tokens)
+        token_ratio = overlap / len(tokens)
+        if overlap == len(tokens) or (len(tokens) > 1 and token_ratio >= 0.6) or (len(tokens) == 1 and overlap == 1):
+            hints.add(value)
+        elif overlap >= 1 and token_ratio >= 0.4:
+            hints.add(value)
+        elif app_module.fuzzy_similarity(query_string, value) >= 0.88:
+            hints.add(value)
+    return hints
+
+
+def test_indexed_location_hints_match_linear_scan():
+    records = app_module.dataset.records
+    location_index = app_module.dataset.location_index
+    messages = ["centers in Barcelona", "Laundry in Sabadell", "santa cruz de tenerife", "barcelna",
+                "sant cugat del valles", "las palmas gran canaria", "madrid centro", "Padilla 239"]
+    messages += [r.norm_poblacion[:-1] for r in records[::7]] + [r.norm_provincia + " x" for r in records[::11]]
+    for message in messages:
+        query = app_module.analyze_query(message)
+        query_tokens = set(query["query_words"])
+        for kind, field in (("city", "norm_poblacion"), ("province", "norm_provincia")):
+            values = [getattr(r, field) for r in records]
+            expected = legacy_detect_location_candidates(query_tokens, query["normalized_query"], values)
+            hints = app_module.detect_location_candidates(query_tokens, query["normalized_query"], location_index[kind])
+            assert hints == expected, (message, kind)
+
+
+def test_location_positions_prefilter_rows():
+    location_index = app_module.dataset.location_index["city"]
+    positions = app_module.location_positions(location_index, {"sabadell"})
+    assert positions
+    assert all(app_module.dataset.records[p].norm_poblacion == "sabadell" for p in positions)
@@ -0,0 +1,33 @@
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for path in (PROJECT_ROOT, os.path.join(PROJECT_ROOT, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import app as app_module
+import load_test
+
+
+def test_request_pool_follows_the_mix():
+    centers = [record.data for record in app_module.dataset.records]
+    mix = load_test.parse_mix("chat=3,nearest=1")
+    requests = load_test.build_requests(centers, mix, 400)
+    endpoints = [endpoint for endpoint, _, _, _ in requests]
+    assert endpoints.count("chat") == 300 and endpoints.count("nearest") == 100
+    client = app_module.app.test_client()
+    for endpoint, method, path, body in requests[:40]:
+        response = client.open(path, method=method, data=body, content_type="application/json")
+        assert response.status_code == 200, (endpoint, path, body)
+
+
+def test_percentiles_and_saturation():
+    values = [i / 1000 for i in range(1, 101)]
+    assert load_test.percentile(values, 0.5) == 0.05
+    assert load_test.percentile(values, 0.99) == 0.099
+    assert load_test.percentile([], 0.5) is None
+    runs = [{"workers": 1, "threads": 2, "concurrency": c, "throughput_rps": rps}
+            for c, rps in ((1, 100.0), (4, 300.0), (16, 310.0), (32, 305.0))]
+    load_test.mark_saturation(runs)
+    assert [r.get("saturated", False) for r in runs] == [False, True, False, False]
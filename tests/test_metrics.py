@@ -0,0 +1,87 @@
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+
+@pytest.fixture
+def client():
+    app_module.app.testing = True
+    app_module.query_cache.clear()
+    with app_module.app.test_client() as test_client:
+        yield test_client
+
+
+def sample_value(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_metrics_expose_stage_histograms_and_counters(client):
+    client.post("/api/chat", json={"message": "Laundry in Sabadell"})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert "# TYPE lawash_stage_duration_seconds histogram" in text
+    for stage in ("normalize", "locations", "candidates", "scan", "similarity", "scoring", "fallback", "format"):
+        assert sample_value(text, f'lawash_stage_duration_seconds_count{{stage="{stage}"}}') >= 1
+    assert sample_value(text, 'lawash_request_duration_seconds_bucket{endpoint="chat",le="+Inf"}') >= 1
+    assert sample_value(text, 'lawash_query_rows_sum{kind="kept"}') >= 1
+    assert sample_value(text, 'lawash_comparisons_total{kind="sequence_matcher"}') >= 1
+    assert sample_value(text, "lawash_query_cache_misses_total") >= 1
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = app_module.Metrics(enabled=True)
+    registry.begin()
+    trace = registry.current()
+    trace.count_rows("kept", 3)
+    trace.count_rows("kept", 3000)
+    registry.finish("chat")
+    text = registry.render()
+    assert sample_value(text, 'lawash_query_rows_bucket{kind="kept",le="1"}') == 0
+    assert sample_value(text, 'lawash_query_rows_bucket{kind="kept",le="5"}') == 1
+    assert sample_value(text, 'lawash_query_rows_bucket{kind="kept",le="+Inf"}') == 2
+    assert sample_value(text, 'lawash_query_rows_sum{kind="kept"}') == 3003
+    assert registry.current() is app_module.NULL_TRACE
+
+
+def test_disabled_metrics_record_nothing(client, monkeypatch):
+    registry = app_module.Metrics(enabled=False)
+    monkeypatch.setattr(app_module, "metrics", registry)
+    client.post("/api/chat", json={"message": "Laundry in Sabadell"})
+    assert registry.requests == {} and registry.stages == {} and registry.comparisons == {}
+    assert client.get("/metrics").status_code == 404
+
+
+def test_metrics_add_up_every_worker_in_the_directory(tmp_path):
+    registry = app_module.Metrics(enabled=True, directory=str(tmp_path), publish_interval=3600)
+
+    def serve_one_request():
+        registry.begin()
+        registry.current().count_comparisons("sequence_matcher", 5)
+        registry.finish("chat", {"hits": 1, "misses": 2, "evictions": 0, "size": 2})
+        registry.publish()
+
+    # Two forked workers, then this process, each serving with the registry they inherited
+    for _ in range(2):
+        worker = app_module.multiprocessing.get_context("fork").Process(target=serve_one_request)
+        worker.start()
+        worker.join()
+        assert worker.exitcode == 0
+    serve_one_request()
+    assert len(list(tmp_path.glob("metrics-*.json"))) == 3
+
+    text = registry.render({"hits": 1, "misses": 2, "evictions": 0, "size": 2})
+    assert sample_value(text, 'lawash_request_duration_seconds_count{endpoint="chat"}') == 3
+    assert sample_value(text, 'lawash_comparisons_total{kind="sequence_matcher"}') == 15
+    assert sample_value(text, "lawash_query_cache_misses_total") == 6
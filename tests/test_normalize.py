@@ -0,0 +1,99 @@
+import json
+import os
+import re
+import sys
+import unicodedata
+
+import pytest
+from word2number import w2n
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app import DATA_FILE, normalize_text
+
+
+def legacy_normalize_text(text):
+    """The original per-call normalizer, kept verbatim as the parity reference."""
+    if not isinstance(text, str):
+        return ""
+    text = ''.join(c for c in unicodedata.normalize('NFD', text)
+                  if unicodedata.category(c) != 'Mn').lower()
+    number_words = {
+        'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine',
+        'ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen',
+        'seventeen', 'eighteen', 'nineteen', 'twenty', 'thirty', 'forty', 'fifty',
+        'sixty', 'seventy', 'eighty', 'ninety', 'hundred', 'thousand', 'million', 'and'
+    }
+    try:
+        words = text.split()
+        new_words = []
+        i = 0
+        while i < len(words):
+            if words[i] in number_words:
+                number_sequence = []
+                j = i
+                while j < len(words) and words[j] in number_words:
+                    number_sequence.append(words[j])
+                    j += 1
+                try:
+                    num = w2n.word_to_num(" ".join(number_sequence))
+                    new_words.append(str(num))
+                    i = j
+                except ValueError:
+                    new_words.extend(number_sequence)
+                    i = j
+            else:
+                new_words.append(words[i])
+                i += 1
+        text = " ".join(new_words)
+    except Exception:
+        pass
+    replacements = {
+        "saint": "sant", "san": "sant", "andrews": "andreu", "andrew": "andreu",
+        "andrea": "andreu", "andres": "andreu", "sardinia": "sardenya", "sardenia": "sardenya",
+        "della": "de la", "dalla": "de la", "dela": "de la", "barca": "barca",
+        "barka": "barca", "barqa": "barca", "tenerife": "tenerife", "tenerfaith": "tenerife"
+    }
+    for old, new in replacements.items():
+        text = re.sub(rf"\b{old}\b", new, text)
+    return text
+
+
+TEST_QUERIES = [
+    "I need the center id for code ES0263",
+    "Padilla 239 in Barcelona",
+    "center id for Sardinia 200 Barcelona",
+    "centers in Sant Andreu de la Barca Barcelona",
+    "Peru thirty eight",
+    "I am referring to Peru thirty eight",
+    "one hundred and twenty three  Saint   Andrews, barka",
+    "million thousand street",
+    "and and",
+    "Tenerfaith dela sardenia (san) andres-dalla",
+    "Àngra do Heroísmo — Açores",
+    "",
+    None,
+    42,
+]
+
+
+def _dataset_strings():
+    with open(DATA_FILE) as f:
+        centers = json.load(f)["centers"]
+    for center in centers:
+        for value in center.values():
+            yield value
+
+
+@pytest.mark.parametrize("text", TEST_QUERIES)
+def test_normalize_matches_legacy_for_queries(text):
+    assert normalize_text(text) == legacy_normalize_text(text)
+    assert normalize_text(text.lower() if isinstance(text, str) else text) == \
+        legacy_normalize_text(text.lower() if isinstance(text, str) else text)
+
+
+def test_normalize_matches_legacy_for_dataset():
+    mismatches = [v for v in _dataset_strings() if normalize_text(v) != legacy_normalize_text(v)]
+    assert not mismatches
@@ -0,0 +1,156 @@
+import json
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+
+@pytest.fixture
+def data_file(tmp_path, monkeypatch):
+    with open(app_module.DATA_FILE) as f:
+        centers = json.load(f)["centers"]
+    path = tmp_path / "centers.json"
+    path.write_text(json.dumps({"centers": centers[:5]}))
+    monkeypatch.setattr(app_module, "DATA_FILE", str(path))
+    original = app_module.dataset
+    yield path, centers
+    app_module.dataset = original
+
+
+def test_reload_swaps_in_a_new_snapshot(data_file):
+    path, centers = data_file
+    assert app_module.load_data()
+    first = app_module.dataset
+    assert len(first.records) == 5
+
+    path.write_text(json.dumps({"centers": centers[:7]}))
+    os.utime(path, ns=(first.source_mtime + 10**9, first.source_mtime + 10**9))
+    assert app_module.reload_if_changed()
+    assert len(app_module.dataset.records) == 7
+    assert app_module.dataset.version != first.version
+    # The previous snapshot is untouched for requests still holding it
+    assert len(first.records) == 5
+    assert not app_module.reload_if_changed()
+
+
+def test_failed_reload_keeps_previous_snapshot(data_file):
+    path, _ = data_file
+    assert app_module.load_data()
+    current = app_module.dataset
+    path.write_text("{not json")
+    assert not app_module.load_data()
+    assert app_module.dataset is current
+    assert app_module.reload_status["last_error"]
+
+
+def test_admin_reload_requires_token(data_file, monkeypatch):
+    client = app_module.app.test_client()
+    assert client.post("/admin/reload").status_code == 403
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "secret")
+    assert client.post("/admin/reload", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    response = client.post("/admin/reload", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.get_json()["dataset"]["centers"] == 5
+    health = client.get("/health").get_json()
+    assert health["dataset"]["version"] == app_module.dataset.version
+
+
+def test_prebuilt_index_loads_the_same_dataset(data_file):
+    path, centers = data_file
+    built = app_module.build_index(str(path))
+    loaded = app_module.build_snapshot(str(path))
+    assert loaded.source == "index" and built.source == "json"
+    assert loaded.version == built.version
+    assert [r.fields for r in loaded.records] == [r.fields for r in built.records]
+    query = app_module.analyze_query(centers[0]["nombre"])
+    ranked = [(m["row"].position, m["score"]) for m in app_module.score_centers(query, loaded)]
+    assert ranked == [(m["row"].position, m["score"]) for m in app_module.score_centers(query, built)]
+
+
+def test_stale_or_corrupt_index_falls_back_to_json(data_file):
+    path, centers = data_file
+    app_module.build_index(str(path))
+    path.write_text(json.dumps({"centers": centers[:6]}))
+    snapshot = app_module.build_snapshot(str(path))
+    assert snapshot.source == "json" and len(snapshot.records) == 6
+
+    with open(app_module.index_file_for(str(path)), "wb") as f:
+        f.write(b"garbage")
+    assert app_module.build_snapshot(str(path)).source == "json"
+
+
+def test_reload_announced_by_another_worker_is_followed(data_file):
+    path, centers = data_file
+    assert app_module.load_data()
+    app_module.announce_reload()
+    path.write_text(json.dumps({"centers": centers[:6]}))
+
+    # A forked sibling worker reloads through /admin/reload and announces it
+    worker = app_module.multiprocessing.get_context("fork").Process(target=app_module.announce_reload)
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+
+    client = app_module.app.test_client()
+    client.get("/health")
+    app_module._reload_follower["thread"].join()
+    health = client.get("/health").get_json()
+    assert health["dataset"]["centers"] == 6
+    assert app_module.reload_status["generation"] == app_module.reload_generation.value
+    assert health["process"]["pid"] == os.getpid()
+
+
+def test_master_file_reload_reaches_running_workers(data_file):
+    path, centers = data_file
+    assert app_module.load_data()
+    first = app_module.dataset
+    path.write_text(json.dumps({"centers": centers[:8]}))
+    os.utime(path, ns=(first.source_mtime + 10**9, first.source_mtime + 10**9))
+
+    # The preloading master's watcher notices the edit, reloads and announces it
+    master = app_module.multiprocessing.get_context("fork").Process(
+        target=app_module.reload_if_changed, kwargs={"announce": True})
+    master.start()
+    master.join()
+    assert master.exitcode == 0
+    assert app_module.reload_generation.value != app_module.reload_status["generation"]
+
+    # This process plays a worker forked before the edit
+    client = app_module.app.test_client()
+    client.get("/health")
+    app_module._reload_follower["thread"].join()
+    assert client.get("/health").get_json()["dataset"]["centers"] == 8
+
+
+def test_announced_reload_rebuilds_without_blocking_requests(data_file, monkeypatch):
+    path, centers = data_file
+    assert app_module.load_data()
+    path.write_text(json.dumps({"centers": centers[:6]}))
+    release = app_module.threading.Event()
+    build_snapshot = app_module.build_snapshot
+
+    def slow_build_snapshot(*args, **kwargs):
+        release.wait(10)
+        return build_snapshot(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, "build_snapshot", slow_build_snapshot)
+    app_module.announce_reload()
+    worker = app_module.multiprocessing.get_context("fork").Process(target=app_module.announce_reload)
+    worker.start()
+    worker.join()
+
+    # Requests during the rebuild answer from the current snapshot and start a single rebuild
+    client = app_module.app.test_client()
+    assert client.get("/health").get_json()["dataset"]["centers"] == 5
+    follower = app_module._reload_follower["thread"]
+    assert client.get("/health").get_json()["dataset"]["centers"] == 5
+    assert app_module._reload_follower["thread"] is follower
+    release.set()
+    follower.join()
+    assert client.get("/health").get_json()["dataset"]["centers"] == 6
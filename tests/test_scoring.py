@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+
+def _queries():
+    queries = [
+        "I need the center id for code ES0263",
+        "Padilla 239 in Barcelona",
+        "center id for Sardinia 200 Barcelona",
+        "centers in Sant Andreu de la Barca Barcelona",
+        "Peru thirty eight",
+        "Angara do Hero simo",
+        "Puerto Santa at Cadiz",
+        "center code for SAN SEBASTIAN at GUIPUZCOA",
+        "machines in Madrid",
+    ]
+    for record in app_module.dataset.records[::7]:
+        queries.append(record["nombre"])
+        queries.append(f"{record['direccion']} {record['poblacion']}")
+        queries.append(f"centers in {record['provincia']}")
+    return queries
+
+
+def _ranking(matches):
+    return [(m["row"].position, m["score"], m["location_score"], m["reason"]) for m in matches]
+
+
+@pytest.mark.parametrize("message", _queries())
+def test_numpy_engine_ranks_identically(message):
+    query = app_module.analyze_query(message)
+    if not query["query_words"]:
+        pytest.skip("empty query")
+    python_matches = app_module.score_centers(query, engine="python")
+    numpy_matches = app_module.score_centers(query, engine="numpy")
+    assert _ranking(numpy_matches) == _ranking(python_matches)
+
+
+def test_similarity_bound_never_prunes_a_reachable_ratio():
+    values = {value for record in app_module.dataset.records[::3] for value, _, _ in record.fields}
+    for query in ("padilla 239 barcelona", "sabadell", "sant andreu de la barca", "peru 38"):
+        for threshold in (0.7, 0.82):
+            bound = app_module.SimilarityBound(query, threshold)
+            for value in values:
+                if bound.below(value):
+                    assert app_module.fuzzy_similarity(query, value) < threshold, (query, value)
+
+
+def test_skipped_ratios_are_counted():
+    client = app_module.app.test_client()
+    before = dict(app_module.metrics.comparisons)
+    app_module.query_cache.clear()
+    client.post("/api/chat", json={"message": "centers in Sant Andreu de la Barca Barcelona"})
+    skipped = app_module.metrics.comparisons.get("sequence_matcher_skipped", 0) - before.get("sequence_matcher_skipped", 0)
+    assert skipped > 0
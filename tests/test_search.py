@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+
+@pytest.fixture(scope="module")
+def client():
+    app_module.app.testing = True
+    with app_module.app.test_client() as test_client:
+        yield test_client
+
+
+def test_search_returns_structured_ranked_results(client):
+    payload = client.get("/api/search?q=Padilla 239 in Barcelona&limit=3").get_json()
+    assert payload["total"] >= 1
+    best = payload["results"][0]
+    assert best["codigo"] == "ES0323"
+    assert best["rank"] == 1
+    assert best["reason"]
+    assert {"score", "location_score", "nombre", "direccion", "poblacion", "provincia", "id_centro"} <= set(best)
+
+
+def test_search_pages_match_full_ranking(client):
+    full = client.get("/api/search?q=centers in Barcelona&limit=100").get_json()
+    assert full["total"] > 20
+    first = client.get("/api/search?q=centers in Barcelona&limit=10").get_json()
+    second = client.post("/api/search", json={"q": "centers in Barcelona", "limit": 10, "offset": 10}).get_json()
+    paged = first["results"] + second["results"]
+    assert [r["codigo"] for r in paged] == [r["codigo"] for r in full["results"][:20]]
+    assert [r["rank"] for r in paged] == list(range(1, 21))
+
+
+def test_heap_selection_matches_full_sort():
+    for message in ("centers in Barcelona", "Madrid", "Sardinia 200 Barcelona", "Peru 38"):
+        ranked = app_module.match_centers(app_module.analyze_query(message))
+        ordered = ranked.all()
+        for offset, limit in ((0, 1), (0, 10), (5, 7), (len(ordered) - 1, 10)):
+            assert ranked.top(limit, offset) == ordered[offset:offset + limit]
+
+
+def test_search_validates_pagination(client):
+    assert client.get("/api/search?q=Barcelona&limit=0").status_code == 400
+    assert client.get("/api/search?q=Barcelona&offset=-1").status_code == 400
+    assert client.get("/api/search?q=Barcelona&limit=abc").status_code == 400
+    assert client.post("/api/search", json=["Barcelona"]).status_code == 400
+    empty = client.get("/api/search?q=the").get_json()
+    assert empty["total"] == 0 and empty["results"] == []
@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+
+@pytest.fixture
+def client():
+    app_module.chat_sessions.clear()
+    app_module.app.testing = True
+    with app_module.app.test_client() as test_client:
+        yield test_client
+
+
+def _chat(client, message, session_id="session-1"):
+    payload = client.post("/api/chat", json={"message": message, "session_id": session_id}).get_json()
+    return payload["response"]
+
+
+def test_ordinal_choice():
+    assert app_module.ordinal_choice("the second one", 10) == 2
+    assert app_module.ordinal_choice("El 3º, por favor", 10) == 3
+    assert app_module.ordinal_choice("option 10", 10) == 10
+    assert app_module.ordinal_choice("last", 4) == 4
+    assert app_module.ordinal_choice("the 12th one", 10) is None
+    assert app_module.ordinal_choice("Padilla 239", 10) is None
+
+
+def test_ordinal_follow_up_picks_a_listed_center(client):
+    listing = _chat(client, "centers in Barcelona")
+    assert "Please specify" in listing
+    second = listing.split("<br>")[3]
+    assert second.startswith("2. ")
+    reply = _chat(client, "the second one")
+    assert "I believe you're referring to" in reply
+    assert second.split("Code: ")[1].split(",")[0] in reply
+    # The pick ends the clarification: the next message is a fresh query
+    assert _chat(client, "centers in Barcelona") == listing
+
+
+def test_follow_up_rescores_only_previous_candidates(client):
+    _chat(client, "centers in Barcelona")
+    reply = _chat(client, "the one on Padilla")
+    assert "Padilla 239" in reply
+    assert "ES0323" in reply
+
+    _chat(client, "centers in Barcelona")
+    narrowed = _chat(client, "Sabadell only")
+    assert "I found 2 centers" in narrowed
+    assert "Madrid" not in narrowed
+
+
+def test_unrelated_follow_up_is_a_new_query(client):
+    fresh = _chat(client, "centers in madrid", session_id="other")
+    _chat(client, "centers in Barcelona")
+    assert _chat(client, "centers in madrid") == fresh
+
+
+def test_session_id_is_validated(client):
+    assert client.post("/api/chat", json={"message": "hola", "session_id": 7}).status_code == 400
+    assert client.post("/api/chat", json={"message": "hola", "session_id": "x" * 200}).status_code == 400
@@ -0,0 +1,129 @@
+import json
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+QUERIES = [
+    "Padilla 239 in Barcelona",
+    "centers in Barcelona",
+    "Laundry in Sabadell",
+    "center code for SAN SEBASTIAN at GUIPUZCOA",
+    "I need the center id for code ES0263",
+    "Puerto Santa at Cadiz",
+    "lavanderia",
+]
+
+
+@pytest.fixture(scope="module")
+def sharded():
+    return app_module.DatasetSnapshot(app_module.dataset.records, version=app_module.dataset.version, shard_count=4)
+
+
+def ranking(matches):
+    return [(m["row"].position, m["score"], m["location_score"], m["reason"]) for m in matches]
+
+
+def test_shards_partition_records_by_province(sharded):
+    assert len(sharded.shards) == 4
+    positions = sorted(p for shard in sharded.shards for p in shard.positions)
+    assert positions == list(range(len(sharded.records)))
+    for province in {r.norm_provincia for r in sharded.records}:
+        assert sum(province in shard.provinces for shard in sharded.shards) == 1
+
+
+@pytest.mark.parametrize("message", QUERIES)
+def test_sharded_ranking_equals_unsharded(sharded, message):
+    query = app_module.analyze_query(message)
+    expected = app_module.match_centers(query, app_module.dataset)
+    assert ranking(app_module.match_centers(query, sharded).all()) == ranking(expected.all())
+    top = app_module.match_centers(query, sharded, top_k=5)
+    assert top.total == expected.total
+    assert ranking(top.top(5)) == ranking(expected.top(5))
+
+
+def test_location_hints_skip_shards(sharded):
+    query = app_module.analyze_query("Laundry in Sabadell")
+    province_hints = app_module.detect_location_candidates(
+        set(query["query_words"]), query["normalized_query"], sharded.location_index["province"])
+    city_hints = app_module.detect_location_candidates(
+        set(query["query_words"]), query["normalized_query"], sharded.location_index["city"])
+    assert city_hints
+    assert sum(shard.may_match(city_hints, province_hints) for shard in sharded.shards) == 1
+
+
+def test_deep_pages_rescore_past_the_top_k(sharded):
+    query = app_module.analyze_query("centers in Barcelona")
+    top = app_module.match_centers(query, sharded, top_k=5)
+    assert top.total > 5
+    with pytest.raises(ValueError):
+        top.top(5, offset=5)
+    full = app_module.ensure_ranked(top, query, sharded, needed=10)
+    assert ranking(full.top(5, offset=5)) == ranking(app_module.match_centers(query, app_module.dataset).top(5, offset=5))
+
+
+def test_shard_pool_scores_in_worker_processes(sharded, monkeypatch):
+    snapshot = app_module.DatasetSnapshot(sharded.records, version=sharded.version, shard_count=4)
+    monkeypatch.setattr(app_module, "SEARCH_WORKERS", 2)
+    monkeypatch.setattr(app_module, "dataset", snapshot)
+    try:
+        pool = app_module.start_shard_pool()
+        assert pool is not None and app_module.shard_pool(sharded) is None
+        for message in QUERIES[:3]:
+            query = app_module.analyze_query(message)
+            pooled = app_module.match_centers(query, snapshot, top_k=10)
+            local = app_module.match_centers(query, app_module.DatasetSnapshot(sharded.records, shard_count=1))
+            assert pooled.total == local.total
+            assert ranking(pooled.top(10)) == ranking(local.top(10))
+
+        # In-place changes reach the pool's workers without forking a new pool
+        center = dict(sharded.records[0].data, id_centro="9001", codigo="ES9001", nombre="Lavanderia Zurbaran")
+        snapshot.upsert(center)
+        snapshot.remove(sharded.records[1].position)
+        assert app_module.shard_pool(snapshot) == (pool, 0)
+        query = app_module.analyze_query(f"Zurbaran in {center['poblacion']}")
+        tasks = [(snapshot.version, 0, snapshot.edits, shard_id, query, [], [], None, None)
+                 for shard_id in range(len(snapshot.shards))]
+        entries = [entry for _, _, shard_entries in pool.map(app_module._score_shard_task, tasks)
+                   for entry in shard_entries]
+        assert len(snapshot.records) - 1 in [entry[0] for entry in entries]
+        pooled = app_module.match_centers(query, snapshot, top_k=10)
+        assert ranking(pooled.top(10)) == ranking(app_module.match_centers(query, snapshot).top(10))
+    finally:
+        app_module.stop_shard_pool()
+
+
+def test_shard_pool_follows_a_full_reload_without_forking(tmp_path, monkeypatch):
+    with open(app_module.DATA_FILE) as f:
+        centers = json.load(f)["centers"]
+    path = tmp_path / "centers.json"
+    path.write_text(json.dumps({"centers": centers[:150]}))
+    monkeypatch.setattr(app_module, "DATA_FILE", str(path))
+    monkeypatch.setattr(app_module, "SEARCH_SHARDS", 4)
+    monkeypatch.setattr(app_module, "SEARCH_WORKERS", 2)
+    original = app_module.dataset
+    try:
+        assert app_module.load_data()
+        pool = app_module.start_shard_pool()
+        path.write_text(json.dumps({"centers": centers[:250]}))
+        assert app_module.load_data()
+        snapshot = app_module.dataset
+        assert app_module.shard_pool(snapshot) == (pool, 0)
+
+        # Each pool process rebuilds the new snapshot itself; a stale one would raise
+        query = app_module.analyze_query("centers in Barcelona")
+        tasks = [(snapshot.version, 0, [], shard_id, query, [], [], None, None) for shard_id in range(4)]
+        pooled = sorted(entry[0] for _, _, entries in pool.map(app_module._score_shard_task, tasks)
+                        for entry in entries)
+        local = sorted(entry[0] for shard_id in range(4)
+                       for entry in app_module.score_shard(snapshot, shard_id, query, [], [])[2])
+        assert pooled == local and max(pooled) >= 150
+    finally:
+        app_module.stop_shard_pool()
+        app_module.dataset = original
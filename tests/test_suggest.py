@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import app as app_module
+
+
+@pytest.fixture(scope="module")
+def client():
+    app_module.app.testing = True
+    with app_module.app.test_client() as test_client:
+        yield test_client
+
+
+def _suggest(client, **params):
+    response = client.get("/api/suggest", query_string=params)
+    assert response.status_code == 200
+    return response.get_json()["suggestions"]
+
+
+def test_prefix_completes_names_streets_and_codes(client):
+    suggestions = _suggest(client, q="Padi")
+    assert [(s["kind"], s["codigo"]) for s in suggestions] == [("name", "ES0323"), ("street", "ES0323")]
+    assert all(s["codigo"].startswith("ES02") for s in _suggest(client, q="es02", kind="code"))
+    # Later words of a text complete too
+    assert any(s["text"] == "Sant Andreu de la Barca" for s in _suggest(client, q="andreu de", kind="city"))
+
+
+def test_cities_rank_by_number_of_centers(client):
+    cities = _suggest(client, q="ma", kind="city", limit=3)
+    assert cities[0]["text"] == "Madrid"
+    assert cities[0]["centers"] >= cities[1]["centers"] >= cities[2]["centers"]
+
+
+def test_precomputed_short_prefixes_match_a_scan():
+    index = app_module.dataset.suggest_index
+    for prefix in ("b", "ma", "1", "es"):
+        for kind in (None, *app_module.SUGGEST_KINDS):
+            best = {}
+            index._collect(prefix, False, kind, best)
+            expected = sorted((rank, entry_id) for entry_id, rank in best.items())[:app_module.SUGGEST_MAX_LIMIT]
+            assert index.precomputed.get((prefix, kind), []) == expected
+
+
+def test_fuzzy_tolerates_one_edit_in_the_last_word(client):
+    assert _suggest(client, q="calle padlla") == []
+    suggestions = _suggest(client, q="calle padlla", fuzzy="1")
+    assert suggestions[0]["text"] == "Calle Padilla 239" and suggestions[0]["fuzzy"]
+    assert _suggest(client, q="barcleona", fuzzy="1", kind="city")[0]["text"] == "Barcelona"
+
+
+def test_invalid_parameters(client):
+    assert client.get("/api/suggest?q=a&limit=0").status_code == 400
+    assert client.get("/api/suggest?q=a&kind=planet").status_code == 400
+    assert _suggest(client, q="  ") == []